@@ -1,68 +1,854 @@
 import sys
+import bisect
+import gc
+import argparse
+import json
+import time
+import tracemalloc
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
 from PIL import Image
+import numpy as np
+import ctypes
+import hashlib
 import math
 import os
 import random
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 # ------------------------- CLASES PARA OBJETOS 3D -------------------------
 class Textura:
-    def __init__(self, ruta):
-        self.id = self.cargar_textura(ruta)
+    def __init__(self, ruta, cargar=True):
         self.ruta = ruta
+        # id es None mientras no se haya subido (los objetos usan color sólido)
+        self.id = self.cargar_textura(ruta) if cargar else None
     
     def cargar_textura(self, ruta):
         """Carga una textura desde un archivo de imagen"""
         try:
-            textura_id = glGenTextures(1)
-            glBindTexture(GL_TEXTURE_2D, textura_id)
-            
-            img = Image.open(ruta).convert('RGB')
-            # Voltear la imagen verticalmente (OpenGL usa coordenadas Y invertidas)
-            img = img.transpose(Image.FLIP_TOP_BOTTOM)
-            img_data = img.tobytes()
-            
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, img.width, img.height,
-                         0, GL_RGB, GL_UNSIGNED_BYTE, img_data)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-            
-            return textura_id
-            
+            ancho, alto, datos = self.decodificar(ruta)
         except Exception as e:
-            # Si no puede cargar, simplemente devuelve None (usará color sólido)
-            return None    
+            print(f"No se pudo cargar la textura {ruta}: {e}")
+            return None
+        return self.subir(ancho, alto, datos)
+    
+    @staticmethod
+    def decodificar(ruta):
+        """(ancho, alto, bytes RGB) con las filas ya volteadas para OpenGL"""
+        img = Image.open(ruta).convert('RGB')
+        # Voltear la imagen verticalmente (OpenGL usa coordenadas Y invertidas)
+        img = img.transpose(Image.FLIP_TOP_BOTTOM)
+        return img.width, img.height, img.tobytes()
+    
+    @staticmethod
+    def subir(ancho, alto, datos):
+        """Crea la textura OpenGL con mipmaps y devuelve su id"""
+        textura_id = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, textura_id)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        if bool(glGenerateMipmap):
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, ancho, alto, 0, GL_RGB, GL_UNSIGNED_BYTE, datos)
+            glGenerateMipmap(GL_TEXTURE_2D)
+        else:
+            gluBuild2DMipmaps(GL_TEXTURE_2D, GL_RGB, ancho, alto, GL_RGB, GL_UNSIGNED_BYTE, datos)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        return textura_id
+
+
+class GestorTexturas:
+    """Carga texturas sin bloquear el hilo de OpenGL.
+
+    Las imágenes se decodifican y voltean en un pool de hilos; subir_pendientes,
+    llamado en cada cuadro desde el hilo de OpenGL, sube las que ya terminaron.
+    Las texturas se comparten por ruta y por hash del contenido, y los píxeles
+    decodificados se guardan comprimidos en directorio_cache para no volver a
+    decodificar en el siguiente arranque.
+    """
+    CABECERA_CACHE = struct.Struct("<II")  # ancho, alto
+    
+    def __init__(self, directorio_cache=".cache_texturas", hilos=2):
+        self.directorio_cache = directorio_cache
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos)
+        self._por_ruta = {}  # ruta normalizada -> Textura
+        self._ids_por_hash = {}  # sha1 del archivo -> id de OpenGL
+        self._pendientes = []  # (Textura, futuro)
+        self.subidas = 0  # Texturas que recibieron su id (cambia la forma de lo que las usa)
+    
+    def obtener(self, ruta):
+        """Textura para la ruta; su id sigue en None hasta que se sube"""
+        clave = os.path.normcase(os.path.abspath(ruta))
+        textura = self._por_ruta.get(clave)
+        if textura is None:
+            textura = Textura(ruta, cargar=False)
+            self._por_ruta[clave] = textura
+            self._pendientes.append((textura, self._ejecutor.submit(self._decodificar, ruta)))
+        return textura
+    
+    def _decodificar(self, ruta):
+        """En un hilo del pool: (hash, ancho, alto, datos), usando la caché en disco si existe"""
+        with open(ruta, "rb") as archivo:
+            resumen = hashlib.sha1(archivo.read()).hexdigest()
+        ruta_cache = os.path.join(self.directorio_cache, resumen + ".rgbz") if self.directorio_cache else None
+        
+        if ruta_cache and os.path.exists(ruta_cache):
+            try:
+                with open(ruta_cache, "rb") as archivo:
+                    contenido = archivo.read()
+                ancho, alto = self.CABECERA_CACHE.unpack_from(contenido)
+                datos = zlib.decompress(contenido[self.CABECERA_CACHE.size:])
+                if len(datos) == ancho * alto * 3:
+                    return resumen, ancho, alto, datos
+            except (OSError, struct.error, zlib.error) as e:
+                print(f"Caché de textura dañada ({ruta_cache}): {e}")
+        
+        ancho, alto, datos = Textura.decodificar(ruta)
+        if ruta_cache:
+            try:
+                os.makedirs(self.directorio_cache, exist_ok=True)
+                # Nombre temporal por hilo: dos rutas con el mismo contenido pueden coincidir aquí
+                temporal = f"{ruta_cache}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temporal, "wb") as archivo:
+                    archivo.write(self.CABECERA_CACHE.pack(ancho, alto))
+                    archivo.write(zlib.compress(datos, 6))
+                os.replace(temporal, ruta_cache)
+            except OSError as e:
+                print(f"No se pudo escribir la caché de textura {ruta_cache}: {e}")
+        return resumen, ancho, alto, datos
+    
+    def subir_pendientes(self):
+        """Sube a OpenGL las texturas ya decodificadas; devuelve cuántas quedan pendientes"""
+        if not self._pendientes:
+            return 0
+        quedan = []
+        for textura, futuro in self._pendientes:
+            if not futuro.done():
+                quedan.append((textura, futuro))
+                continue
+            try:
+                resumen, ancho, alto, datos = futuro.result()
+            except Exception as e:
+                print(f"No se pudo cargar la textura {textura.ruta}: {e}")
+                continue
+            if resumen not in self._ids_por_hash:
+                self._ids_por_hash[resumen] = Textura.subir(ancho, alto, datos)
+            textura.id = self._ids_por_hash[resumen]
+            self.subidas += 1
+        self._pendientes = quedan
+        return len(quedan)
+    
+    def esperar(self):
+        """Bloquea hasta subir todas las texturas pedidas (modo headless y benchmark)"""
+        for _, futuro in self._pendientes:
+            futuro.exception()
+        self.subir_pendientes()
+
+# ------------------------- CACHÉ DE GEOMETRÍA -------------------------
+class CacheGeometria:
+    """Compila la geometría de los objetos en display lists reutilizables.
+
+    Cada lista se identifica por la clase del objeto y su clave de geometría
+    (los parámetros que cambian su forma). Si la clave cambia, por ejemplo al
+    modificar los picos de una montaña o al cargar una textura, se compila una
+    lista nueva y las antiguas se liberan cuando se supera el límite.
+    """
+    def __init__(self, max_listas=256):
+        self.listas = {}  # (clase, clave) -> id de la display list
+        self.max_listas = max_listas
+        self.activa = True
+    
+    def obtener_lista(self, objeto, clave):
+        """Devuelve la display list del objeto, compilándola la primera vez"""
+        clave_cache = (type(objeto), clave)
+        lista = self.listas.pop(clave_cache, None)
+        if lista is None:
+            self._liberar_sobrantes(self.max_listas - 1)
+            lista = glGenLists(1)
+            glNewList(lista, GL_COMPILE)
+            try:
+                objeto._dibujar()
+            finally:
+                glEndList()
+        # Reinsertar al final para mantener el orden de uso (LRU)
+        self.listas[clave_cache] = lista
+        return lista
+    
+    def invalidar(self, clase=None):
+        """Libera las listas compiladas (todas o solo las de una clase)"""
+        for clave_cache in list(self.listas):
+            if clase is None or clave_cache[0] is clase:
+                glDeleteLists(self.listas.pop(clave_cache), 1)
+    
+    def _liberar_sobrantes(self, limite):
+        while len(self.listas) > max(limite, 0):
+            clave_antigua = next(iter(self.listas))
+            glDeleteLists(self.listas.pop(clave_antigua), 1)
+
+
+# ------------------------- ESTADO DE RENDER -------------------------
+class EstadoGL:
+    """Copia del estado de OpenGL que solo emite los cambios reales.
+
+    Guarda qué capacidades están activas y qué textura está enlazada; pedir
+    el mismo estado dos veces seguidas no genera ninguna llamada a OpenGL.
+    El estado de un objeto se describe como una tupla
+    (textura_id, doble_cara, iluminacion, mezcla).
+    """
+    ESTADO_POR_DEFECTO = (None, False, True, False)
+
+    def __init__(self):
+        self.capacidades = {}
+        self.fijas = {}  # Capacidades que los objetos no pueden cambiar (ver fijar)
+        self.textura_id = None
+        self.cambios = 0  # Llamadas glEnable/glDisable/glBindTexture emitidas en el cuadro
+
+    def reiniciar(self):
+        """Olvida el estado conocido (al empezar el cuadro o tras llamadas GL directas)"""
+        self.capacidades.clear()
+        self.textura_id = None
+        self.cambios = 0
+
+    def fijar(self, capacidad, activa):
+        """Mantiene una capacidad en un valor hasta soltar(), diga lo que diga cada objeto"""
+        self.capacidad(capacidad, activa)
+        self.fijas[capacidad] = activa
+    
+    def soltar(self):
+        self.fijas.clear()
+    
+    def capacidad(self, capacidad, activa):
+        if capacidad in self.fijas or self.capacidades.get(capacidad) == activa:
+            return
+        if activa:
+            glEnable(capacidad)
+        else:
+            glDisable(capacidad)
+        self.capacidades[capacidad] = activa
+        self.cambios += 1
+
+    def textura(self, textura_id):
+        """Activa y enlaza una textura, o desactiva el texturizado con None"""
+        self.capacidad(GL_TEXTURE_2D, bool(textura_id))
+        if textura_id and textura_id != self.textura_id:
+            glBindTexture(GL_TEXTURE_2D, textura_id)
+            self.textura_id = textura_id
+            self.cambios += 1
+
+    def aplicar(self, estado):
+        textura_id, doble_cara, iluminacion, mezcla = estado
+        self.textura(textura_id)
+        self.capacidad(GL_CULL_FACE, not doble_cara)
+        self.capacidad(GL_LIGHTING, iluminacion)
+        self.capacidad(GL_BLEND, mezcla)
+
+
+class ColaRender:
+    """Elementos de dibujo de un cuadro, ordenados por estado antes de emitirse.
+
+    Primero lo texturizado (agrupado por textura), después lo que no lleva
+    textura y al final lo que se dibuja sin iluminación, de modo que cada
+    textura se enlaza una sola vez por cuadro. El orden de inserción se
+    mantiene entre elementos con el mismo estado. La cola se puede ejecutar
+    varias veces (por ejemplo para una segunda pasada de sombras) hasta vaciarla.
+    """
+    def __init__(self):
+        self.elementos = []
+        self._ordenada = True
+
+    def agregar(self, estado, dibujar):
+        self.elementos.append((estado, dibujar))
+        self._ordenada = False
+    
+    def vaciar(self):
+        self.elementos.clear()
+
+    @staticmethod
+    def _clave(elemento):
+        textura_id, doble_cara, iluminacion, mezcla = elemento[0]
+        return (mezcla, not iluminacion, not textura_id, textura_id or 0, doble_cara)
+
+    def ejecutar(self, estado_gl):
+        if not self._ordenada:
+            self.elementos.sort(key=self._clave)
+            self._ordenada = True
+        for estado, dibujar in self.elementos:
+            estado_gl.aplicar(estado)
+            dibujar()
+
+
+# ------------------------- ALMACÉN DE OBJETOS -------------------------
+class AlmacenEscena:
+    """Transformaciones, colores y esferas de todos los objetos 3D en arreglos contiguos.
+
+    Cada objeto reserva una fila al crearse y la devuelve al destruirse (las
+    filas libres se reutilizan). Sus atributos posicion, rotacion, escala y
+    colores se guardan en esa fila, así que el culling, las sombras y los
+    lotes leen los datos de miles de objetos con un solo índice de NumPy en
+    lugar de recorrerlos uno a uno. Los arreglos se reemplazan al crecer y
+    las filas cambian de dueño, así que fuera de esas rutas no se guardan
+    vistas de ellos: los atributos devuelven copias.
+
+    Cada escritura de una fila anota en `modificada` el valor de `reloj`, que
+    aumenta con cada una: un lote que subió su buffer con el reloj en t solo
+    tiene que volver a subirlo si alguna de sus filas tiene una marca mayor.
+    """
+    COLORES_POR_FILA = 4  # `color` y hasta tres colores de partes
+    TRANSFORMACION_INICIAL = (0, 0, 0, 0, 0, 0, 1, 1, 1)
+    ARREGLOS = ("transformaciones", "colores", "esferas", "esfera_sucia", "forma_sucia", "modificada")
+
+    def __init__(self, capacidad=1024):
+        self.transformaciones = np.zeros((capacidad, 9))  # Posición, rotación y escala
+        self.colores = np.ones((capacidad, self.COLORES_POR_FILA, 3), dtype=np.float32)
+        self.esferas = np.zeros((capacidad, 4))  # Centro y radio de Objeto3D._esfera_local
+        self.esfera_sucia = np.ones(capacidad, dtype=bool)  # La esfera guardada ya no vale
+        self.forma_sucia = np.ones(capacidad, dtype=bool)  # Puede haber cambiado de lote
+        self.modificada = np.zeros(capacidad, dtype=np.int64)  # Valor de `reloj` en la última escritura
+        self.reloj = 0
+        self.libres = []
+        self.usadas = 0  # Filas repartidas alguna vez; las siguientes están sin estrenar
+
+    def __len__(self):
+        return self.usadas - len(self.libres)
+
+    def _crecer(self, minimo):
+        capacidad = max(minimo, 2 * len(self.transformaciones))
+        for nombre in self.ARREGLOS:
+            anterior = getattr(self, nombre)
+            arreglo = np.empty((capacidad,) + anterior.shape[1:], dtype=anterior.dtype)
+            arreglo[:self.usadas] = anterior[:self.usadas]
+            setattr(self, nombre, arreglo)
+
+    def _limpiar(self, filas):
+        self.transformaciones[filas] = self.TRANSFORMACION_INICIAL
+        self.colores[filas] = 1.0
+        self.esferas[filas] = 0.0
+        self.esfera_sucia[filas] = True
+        self.forma_sucia[filas] = True
+        self.marcar(filas)
+
+    def marcar(self, filas):
+        """Anota que se escribieron esas filas (para los lotes que las dibujan)"""
+        self.reloj += 1
+        self.modificada[filas] = self.reloj
+
+    def reservar(self):
+        """Fila para un objeto nuevo"""
+        if self.libres:
+            fila = self.libres.pop()
+        else:
+            if self.usadas == len(self.transformaciones):
+                self._crecer(self.usadas + 1)
+            fila = self.usadas
+            self.usadas += 1
+        self._limpiar(fila)
+        return fila
+
+    def reservar_lote(self, cantidad):
+        """Arreglo con `cantidad` filas, primero las libres y luego las nuevas"""
+        reutilizadas = min(cantidad, len(self.libres))
+        filas_libres = self.libres[len(self.libres) - reutilizadas:]
+        del self.libres[len(self.libres) - reutilizadas:]
+        nuevas = cantidad - reutilizadas
+        if self.usadas + nuevas > len(self.transformaciones):
+            self._crecer(self.usadas + nuevas)
+        filas = np.concatenate([np.array(filas_libres, dtype=np.intp),
+                                np.arange(self.usadas, self.usadas + nuevas, dtype=np.intp)])
+        self.usadas += nuevas
+        self._limpiar(filas)
+        return filas
+
+    def liberar(self, fila):
+        self.libres.append(fila)
+
+    def bytes_por_fila(self):
+        """Memoria que ocupa la fila de un objeto sumando todos los arreglos"""
+        return sum(getattr(self, nombre).nbytes // len(self.transformaciones) for nombre in self.ARREGLOS)
+
+    @staticmethod
+    def filas_de(objetos):
+        """Arreglo con la fila de cada objeto, en el mismo orden"""
+        return np.fromiter((obj._fila for obj in objetos), dtype=np.intp, count=len(objetos))
+
+    def copiar_fila(self, origen, filas):
+        """Copia colores y esfera de la fila `origen` a `filas` (la transformación no)"""
+        self.colores[filas] = self.colores[origen]
+        self.esferas[filas] = self.esferas[origen]
+        self.esfera_sucia[filas] = self.esfera_sucia[origen]
+
+    def esferas_de(self, objetos, filas=None):
+        """esferas_mundo de los objetos; antes recalcula las esferas locales que cambiaron"""
+        if filas is None:
+            filas = self.filas_de(objetos)
+        for i in np.flatnonzero(self.esfera_sucia[filas]).tolist():
+            objetos[i]._guardar_esfera()
+        return self.esferas_mundo(filas)
+
+    def esferas_mundo(self, filas):
+        """Centros (N, 3) y radios (N,) como Objeto3D.esfera_envolvente para esas filas"""
+        transformaciones = self.transformaciones[filas]
+        esferas = self.esferas[filas]
+        escalas = transformaciones[:, 6:9]
+        radios = esferas[:, 3] * np.abs(escalas).max(axis=1, initial=0.0)
+        desplazamientos = esferas[:, 0:3] * escalas
+        # Con rotación se envuelven todas las orientaciones posibles del centro
+        rotados = np.any(transformaciones[:, 3:6] != 0, axis=1)
+        centros = transformaciones[:, 0:3] + np.where(rotados[:, None], 0.0, desplazamientos)
+        radios += np.where(rotados, np.linalg.norm(desplazamientos, axis=1), 0.0)
+        return centros, radios
+
+
+def _propiedad_transformacion(inicio, doc):
+    """Propiedad que lee (como tupla) y escribe tres columnas de la fila del objeto en el almacén"""
+    def leer(self):
+        return tuple(self.almacen.transformaciones[self._fila, inicio:inicio + 3].tolist())
+
+    def escribir(self, valor):
+        self.almacen.transformaciones[self._fila, inicio:inicio + 3] = valor
+        self.almacen.marcar(self._fila)
+
+    return property(leer, escribir, doc=doc)
+
+
+def _propiedad_color(columna, doc):
+    """Propiedad para uno de los colores RGB de la fila del objeto en el almacén (se lee como tupla)"""
+    def leer(self):
+        return tuple(self.almacen.colores[self._fila, columna].tolist())
+
+    def escribir(self, valor):
+        self.almacen.colores[self._fila, columna] = tuple(valor)[:3]
+        self.almacen.marcar(self._fila)
+
+    return property(leer, escribir, doc=doc)
+
+
+# ------------------------- MALLAS -------------------------
+def matriz_traslacion(x, y, z):
+    matriz = np.identity(4)
+    matriz[:3, 3] = (x, y, z)
+    return matriz
+
+def matriz_escala(x, y, z):
+    return np.diag([x, y, z, 1.0])
+
+def matriz_rotacion(angulo, x, y, z):
+    """Matriz 4x4 equivalente a glRotatef (ángulo en grados)"""
+    eje = np.array([x, y, z], dtype=float)
+    eje /= np.linalg.norm(eje)
+    c, s = math.cos(math.radians(angulo)), math.sin(math.radians(angulo))
+    k = np.array([[0, -eje[2], eje[1]], [eje[2], 0, -eje[0]], [-eje[1], eje[0], 0]])
+    matriz = np.identity(4)
+    matriz[:3, :3] = c * np.identity(3) + s * k + (1 - c) * np.outer(eje, eje)
+    return matriz
+
+def matriz_perspectiva(fov, aspecto, cerca, lejos):
+    """Matriz 4x4 equivalente a gluPerspective (fov vertical en grados)"""
+    f = 1.0 / math.tan(math.radians(fov) / 2)
+    matriz = np.zeros((4, 4))
+    matriz[0, 0] = f / aspecto
+    matriz[1, 1] = f
+    matriz[2, 2] = (lejos + cerca) / (cerca - lejos)
+    matriz[2, 3] = 2 * lejos * cerca / (cerca - lejos)
+    matriz[3, 2] = -1.0
+    return matriz
+
+def matriz_ortogonal(izquierda, derecha, abajo, arriba, cerca, lejos):
+    """Matriz 4x4 equivalente a glOrtho"""
+    matriz = np.identity(4)
+    matriz[0, 0] = 2.0 / (derecha - izquierda)
+    matriz[1, 1] = 2.0 / (arriba - abajo)
+    matriz[2, 2] = -2.0 / (lejos - cerca)
+    matriz[:3, 3] = (-(derecha + izquierda) / (derecha - izquierda),
+                     -(arriba + abajo) / (arriba - abajo),
+                     -(lejos + cerca) / (lejos - cerca))
+    return matriz
+
+def matriz_mirar(ojo, centro, arriba):
+    """Matriz 4x4 equivalente a gluLookAt"""
+    ojo = np.asarray(ojo, dtype=np.float64)
+    adelante = np.asarray(centro, dtype=np.float64) - ojo
+    adelante /= np.linalg.norm(adelante)
+    lado = np.cross(adelante, arriba)
+    lado /= np.linalg.norm(lado)
+    arriba = np.cross(lado, adelante)
+    matriz = np.identity(4)
+    matriz[0, :3], matriz[1, :3], matriz[2, :3] = lado, arriba, -adelante
+    matriz[:3, 3] = -matriz[:3, :3] @ ojo
+    return matriz
+
+def matrices_rotacion(rotaciones):
+    """Rotaciones (N, 3) en grados -> matrices (N, 3, 3) equivalentes a Rx * Ry * Rz"""
+    radianes = np.radians(np.asarray(rotaciones, dtype=np.float64))
+    c, s = np.cos(radianes), np.sin(radianes)
+    n = len(radianes)
+    rx = np.zeros((n, 3, 3)); ry = np.zeros((n, 3, 3)); rz = np.zeros((n, 3, 3))
+    rx[:, 0, 0] = 1; rx[:, 1, 1] = c[:, 0]; rx[:, 1, 2] = -s[:, 0]; rx[:, 2, 1] = s[:, 0]; rx[:, 2, 2] = c[:, 0]
+    ry[:, 1, 1] = 1; ry[:, 0, 0] = c[:, 1]; ry[:, 0, 2] = s[:, 1]; ry[:, 2, 0] = -s[:, 1]; ry[:, 2, 2] = c[:, 1]
+    rz[:, 2, 2] = 1; rz[:, 0, 0] = c[:, 2]; rz[:, 0, 1] = -s[:, 2]; rz[:, 1, 0] = s[:, 2]; rz[:, 1, 1] = c[:, 2]
+    return rx @ ry @ rz
+
+
+class Malla:
+    """Malla de triángulos guardada en arrays de NumPy.
+
+    Cada vértice indica a qué parte del objeto pertenece (tronco, copa, ...)
+    para poder colorear cada instancia con sus propios colores.
+    """
+    def __init__(self, vertices, normales, partes=None, texcoords=None):
+        self.vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+        self.normales = np.asarray(normales, dtype=np.float32).reshape(-1, 3)
+        num_vertices = len(self.vertices)
+        if partes is None:
+            partes = np.zeros(num_vertices, dtype=np.intp)
+        self.partes = np.broadcast_to(np.asarray(partes, dtype=np.intp), (num_vertices,)).copy()
+        if texcoords is None:
+            texcoords = np.zeros((num_vertices, 2), dtype=np.float32)
+        self.texcoords = np.asarray(texcoords, dtype=np.float32).reshape(-1, 2)
+        self.textura_id = None
+        self.doble_cara = False
+    
+    def transformada(self, matriz):
+        """Devuelve una copia de la malla transformada por una matriz 4x4"""
+        lineal = matriz[:3, :3]
+        vertices = self.vertices @ lineal.T + matriz[:3, 3]
+        normales = self.normales @ np.linalg.inv(lineal)
+        normales /= np.maximum(np.linalg.norm(normales, axis=1, keepdims=True), 1e-12)
+        return Malla(vertices, normales, self.partes, self.texcoords)
+    
+    @staticmethod
+    def combinar(mallas):
+        return Malla(np.concatenate([m.vertices for m in mallas]),
+                     np.concatenate([m.normales for m in mallas]),
+                     np.concatenate([m.partes for m in mallas]),
+                     np.concatenate([m.texcoords for m in mallas]))
+    
+    @staticmethod
+    def _triangular_cuadricula(puntos, normales):
+        """Convierte una cuadrícula (filas, columnas, 3) en triángulos CCW"""
+        a, b = puntos[:-1, :-1], puntos[1:, :-1]
+        c, d = puntos[1:, 1:], puntos[:-1, 1:]
+        na, nb = normales[:-1, :-1], normales[1:, :-1]
+        nc, nd = normales[1:, 1:], normales[:-1, 1:]
+        vertices = np.stack([a, b, c, a, c, d], axis=2).reshape(-1, 3)
+        normales = np.stack([na, nb, nc, na, nc, nd], axis=2).reshape(-1, 3)
+        return vertices, normales
+    
+    @staticmethod
+    def _tapa(radio, z, lados, normal_z):
+        """Disco en el plano z orientado hacia +z o -z"""
+        angulos = np.linspace(0, 2 * math.pi, lados + 1)
+        anillo = np.stack([radio * np.cos(angulos), radio * np.sin(angulos), np.full(lados + 1, z)], axis=1)
+        centro = np.array([0.0, 0.0, z])
+        if normal_z > 0:
+            tris = np.stack([np.broadcast_to(centro, (lados, 3)), anillo[:-1], anillo[1:]], axis=1)
+        else:
+            tris = np.stack([np.broadcast_to(centro, (lados, 3)), anillo[1:], anillo[:-1]], axis=1)
+        normales = np.broadcast_to([0.0, 0.0, normal_z], tris.shape)
+        return tris.reshape(-1, 3), normales.reshape(-1, 3)
+    
+    @staticmethod
+    def cubo(lado=1.0, parte=0):
+        """Cubo centrado en el origen (como glutSolidCube)"""
+        caras = [((1, 0, 0), (0, 1, 0), (0, 0, 1)), ((-1, 0, 0), (0, 0, 1), (0, 1, 0)),
+                 ((0, 1, 0), (0, 0, 1), (1, 0, 0)), ((0, -1, 0), (1, 0, 0), (0, 0, 1)),
+                 ((0, 0, 1), (1, 0, 0), (0, 1, 0)), ((0, 0, -1), (0, 1, 0), (1, 0, 0))]
+        vertices, normales = [], []
+        for n, u, v in caras:
+            n, u, v = np.array(n), np.array(u), np.array(v)
+            esquinas = [(n - u - v), (n + u - v), (n + u + v), (n - u + v)]
+            for i in (0, 1, 2, 0, 2, 3):
+                vertices.append(esquinas[i] * lado / 2)
+                normales.append(n)
+        return Malla(vertices, normales, parte)
+    
+    @staticmethod
+    def esfera(radio, lados, pisos, parte=0):
+        """Esfera alrededor del eje Z (como glutSolidSphere)"""
+        theta = np.linspace(0, math.pi, pisos + 1)[:, None]
+        phi = np.linspace(0, 2 * math.pi, lados + 1)[None, :]
+        normales = np.stack(np.broadcast_arrays(np.sin(theta) * np.cos(phi),
+                                                np.sin(theta) * np.sin(phi),
+                                                np.cos(theta)), axis=2)
+        vertices, normales = Malla._triangular_cuadricula(normales * radio, normales)
+        return Malla(vertices, normales, parte)
+    
+    @staticmethod
+    def cilindro(radio, altura, lados, parte=0):
+        """Cilindro con tapas a lo largo de +Z (como glutSolidCylinder)"""
+        phi = np.linspace(0, 2 * math.pi, lados + 1)[None, :]
+        z = np.array([[altura], [0.0]])  # De arriba abajo para que las caras queden CCW
+        radial = np.stack(np.broadcast_arrays(np.cos(phi), np.sin(phi), np.zeros_like(z)), axis=2)
+        puntos = radial * [radio, radio, 0] + np.stack(np.broadcast_arrays(0 * phi, 0 * phi, z), axis=2)
+        vertices, normales = Malla._triangular_cuadricula(puntos, radial)
+        tapa_inf = Malla._tapa(radio, 0.0, lados, -1)
+        tapa_sup = Malla._tapa(radio, altura, lados, 1)
+        return Malla(np.concatenate([vertices, tapa_inf[0], tapa_sup[0]]),
+                     np.concatenate([normales, tapa_inf[1], tapa_sup[1]]), parte)
+    
+    @staticmethod
+    def cono(radio, altura, lados, parte=0):
+        """Cono con base en z=0 y vértice en z=altura (como glutSolidCone)"""
+        phi = np.linspace(0, 2 * math.pi, lados + 1)
+        medio = (phi[:-1] + phi[1:]) / 2
+        base = np.stack([radio * np.cos(phi), radio * np.sin(phi), np.zeros_like(phi)], axis=1)
+        punta = np.array([0.0, 0.0, altura])
+        def normal(angulo):
+            n = np.stack([altura * np.cos(angulo), altura * np.sin(angulo), np.full_like(angulo, radio)], axis=-1)
+            return n / np.linalg.norm(n, axis=-1, keepdims=True)
+        vertices = np.stack([base[:-1], base[1:], np.broadcast_to(punta, (lados, 3))], axis=1)
+        normales = np.stack([normal(phi[:-1]), normal(phi[1:]), normal(medio)], axis=1)
+        tapa = Malla._tapa(radio, 0.0, lados, -1)
+        return Malla(np.concatenate([vertices.reshape(-1, 3), tapa[0]]),
+                     np.concatenate([normales.reshape(-1, 3), tapa[1]]), parte)
 
 class Objeto3D:
+    # Los datos numéricos viven en una fila de `almacen`; el objeto solo guarda su número
+    __slots__ = ("_fila", "_nivel_detalle")
+    almacen = AlmacenEscena()
+    # Caché compartida por todas las instancias (las listas se crean al dibujar)
+    cache_geometria = CacheGeometria()
+    # Estado de OpenGL compartido: cada objeto pide el suyo antes de dibujarse
+    estado_gl = EstadoGL()
+    # Las subclases con _construir_malla pueden dibujarse con RenderizadorLotes
+    por_lotes = False
+    # Si SistemaSombras proyecta su malla sobre el suelo
+    proyecta_sombra = False
+    # (lados, pisos) de esferas y cilindros GLUT para cada nivel de detalle
+    TESELACIONES = ((4, 3), (5, 4), (6, 5), (8, 8))
+    # Columnas de AlmacenEscena.colores con los colores de colores_partes(), en orden
+    COLUMNAS_COLOR = (0,)
+    
+    posicion = _propiedad_transformacion(0, "Posición (copia de la fila del almacén)")
+    rotacion = _propiedad_transformacion(3, "Rotación en grados sobre X, Y y Z")
+    escala = _propiedad_transformacion(6, "Escala en X, Y y Z")
+    color = _propiedad_color(0, "Color principal")
+    
     def __init__(self, pos=(0, 0, 0), rot=(0, 0, 0), esc=(1, 1, 1), color=(1, 1, 1)):
-        self.posicion = list(pos)
-        self.rotacion = list(rot)
-        self.escala = list(esc)
+        self._fila = self.almacen.reservar()
+        self.posicion = pos
+        self.rotacion = rot
+        self.escala = esc
         self.color = color
+        self._nivel_detalle = len(self.TESELACIONES) - 1  # Lo ajusta SelectorLOD
+    
+    def __del__(self):
+        try:
+            self.almacen.liberar(self._fila)
+        except AttributeError:  # __init__ no llegó a reservar la fila
+            pass
+    
+    @property
+    def nivel_detalle(self):
+        """Índice en TESELACIONES (lo ajusta SelectorLOD)"""
+        return self._nivel_detalle
+    
+    @nivel_detalle.setter
+    def nivel_detalle(self, valor):
+        if valor != self._nivel_detalle:
+            self._nivel_detalle = valor
+            self._invalidar_forma()
+    
+    @classmethod
+    def _ranuras(cls):
+        """Atributos de __slots__ de la clase y sus bases, salvo la fila del almacén"""
+        return [nombre for base in cls.__mro__ for nombre in base.__dict__.get("__slots__", ())
+                if nombre != "_fila"]
     
     def dibujar(self):
+        self.estado_gl.aplicar(self.estado_render())
         glPushMatrix()
         glTranslatef(*self.posicion)
         glRotatef(self.rotacion[0], 1, 0, 0)
         glRotatef(self.rotacion[1], 0, 1, 0)
         glRotatef(self.rotacion[2], 0, 0, 1)
         glScalef(*self.escala)
+        self._aplicar_transformacion_local()
         glColor3f(*self.color)
-        self._dibujar()
+        clave = self.clave_geometria()
+        if clave is not None and self.cache_geometria.activa:
+            glCallList(self.cache_geometria.obtener_lista(self, clave))
+        else:
+            self._dibujar()
         glPopMatrix()
     
+    def _aplicar_transformacion_local(self):
+        """Transformación propia de la subclase que no forma parte de la geometría"""
+        pass
+    
+    def matriz_local(self):
+        """La transformación de _aplicar_transformacion_local como matriz 4x4"""
+        return np.identity(4)
+    
+    def matriz_modelo(self):
+        """Matriz 4x4 local -> mundo, la misma que arma dibujar()"""
+        return (matriz_traslacion(*self.posicion)
+                @ matriz_rotacion(self.rotacion[0], 1, 0, 0)
+                @ matriz_rotacion(self.rotacion[1], 0, 1, 0)
+                @ matriz_rotacion(self.rotacion[2], 0, 0, 1)
+                @ matriz_escala(*self.escala)
+                @ self.matriz_local())
+
+    def estado_render(self):
+        """(textura_id, doble_cara, iluminacion, mezcla) que necesita el objeto.
+
+        Se aplica fuera de la display list, así que _dibujar no debe cambiarlo.
+        """
+        return EstadoGL.ESTADO_POR_DEFECTO
+    
+    def clave_geometria(self):
+        """Parámetros que determinan la geometría; None si no se puede cachear"""
+        forma = self.clave_forma()
+        if forma is None:
+            return None
+        return (forma, tuple(tuple(color) for color in self.colores_partes()))
+    
+    def clave_forma(self):
+        """Parámetros que cambian la forma (sin colores); None si es dinámica"""
+        return None
+    
+    def colores_partes(self):
+        """Colores de cada parte de la malla, en el orden de Malla.partes"""
+        return [self.color]
+    
+    def _construir_malla(self):
+        """Malla de triángulos en coordenadas locales (para el render por lotes)"""
+        return None
+    
+    def clave_sombra(self):
+        """Parámetros que cambian la malla de la sombra (agrupa los lotes de sombras)"""
+        return self.clave_forma()
+    
+    def _construir_malla_sombra(self):
+        """Malla simplificada que se proyecta como sombra"""
+        return self._construir_malla()
+    
+    def malla_seleccion(self):
+        """Malla local contra la que se comprueban los clics (None: la esfera envolvente)"""
+        return self._construir_malla_sombra()
+    
+    def volumen_colision(self):
+        """Forma en el plano XZ local para SistemaColisiones.
+
+        ("caja", semieje_x, semieje_z), ("circulo", radio) o None si no choca.
+        """
+        return None
+    
+    def _esfera_local(self):
+        """Centro y radio de una esfera que envuelve al objeto sin transformar"""
+        return (0, 0, 0), 1.0
+    
+    def _guardar_esfera(self):
+        """Copia _esfera_local a la fila del almacén, de donde la lee el culling"""
+        centro, radio = self._esfera_local()
+        self.almacen.esferas[self._fila] = (*centro, radio)
+        self.almacen.esfera_sucia[self._fila] = False
+    
+    def _invalidar_esfera(self):
+        """La forma cambió: _guardar_esfera se vuelve a llamar antes del próximo culling"""
+        self.almacen.esfera_sucia[self._fila] = True
+    
+    def _invalidar_forma(self):
+        """Cambió algo de lo que dependen clave_forma o clave_sombra: la escena revisa sus lotes"""
+        self.almacen.forma_sucia[self._fila] = True
+    
+    def esfera_envolvente(self):
+        """Esfera envolvente en coordenadas del mundo: (centro, radio)"""
+        centro, radio = self._esfera_local()
+        radio *= max(abs(e) for e in self.escala)
+        desplazamiento = [c * e for c, e in zip(centro, self.escala)]
+        if any(self.rotacion):
+            # Con rotación se envuelven todas las orientaciones posibles del centro
+            radio += math.sqrt(sum(d * d for d in desplazamiento))
+            return tuple(self.posicion), radio
+        return tuple(p + d for p, d in zip(self.posicion, desplazamiento)), radio
+    
     def _dibujar(self):
         raise NotImplementedError("Debes implementar este método en la subclase")
 
 # ------------------------- CLASES PARA FRACTALES -------------------------
 class Fractal(Objeto3D):
+    __slots__ = ("_nivel", "_escala_fractal", "_nivel_lod")
+    # Cuánto se reduce el detalle en cada nivel de recursión (lo usa SelectorLOD)
+    FACTOR_SUBDIVISION = 2.0
+    # Mallas generadas, compartidas por todas las instancias: (clase, nivel) -> malla
+    _mallas = {}
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.nivel = 3  # Nivel de recursión por defecto
+        self._nivel = 3  # Nivel de recursión por defecto
         self.escala_fractal = 1.0  # Escala inicial del fractal
+        self._nivel_lod = None  # Límite de recursión según la distancia
+    
+    @property
+    def nivel(self):
+        return self._nivel
+    
+    @nivel.setter
+    def nivel(self, valor):
+        # El nivel de dibujo decide el lote (ver clave_forma)
+        if valor != self._nivel:
+            self._nivel = valor
+            self._invalidar_forma()
+    
+    @property
+    def nivel_lod(self):
+        return self._nivel_lod
+    
+    @nivel_lod.setter
+    def nivel_lod(self, valor):
+        if valor != self._nivel_lod:
+            self._nivel_lod = valor
+            self._invalidar_forma()
+    
+    @property
+    def escala_fractal(self):
+        return self._escala_fractal
+    
+    @escala_fractal.setter
+    def escala_fractal(self, valor):
+        # La esfera envolvente depende de la escala
+        self._escala_fractal = valor
+        self._invalidar_esfera()
+    
+    def nivel_dibujo(self):
+        """Nivel de recursión efectivo teniendo en cuenta el LOD"""
+        if self.nivel_lod is None:
+            return self.nivel
+        return min(self.nivel, self.nivel_lod)
+    
+    def clave_forma(self):
+        # La escala del fractal es solo una transformación (ver _aplicar_transformacion_local)
+        return (self.nivel_dibujo(),)
+    
+    def _aplicar_transformacion_local(self):
+        glScalef(self.escala_fractal, self.escala_fractal, self.escala_fractal)
+    
+    def matriz_local(self):
+        return matriz_escala(self.escala_fractal, self.escala_fractal, self.escala_fractal)
+    
+    def malla_seleccion(self):
+        # Las ramas del helecho son líneas: por defecto basta la esfera envolvente
+        return None
+    
+    @classmethod
+    def obtener_malla(cls, nivel):
+        """Malla del fractal para un nivel, generada una sola vez por tipo y nivel"""
+        clave = (cls, nivel)
+        malla = Fractal._mallas.get(clave)
+        if malla is None:
+            malla = Fractal._mallas[clave] = cls._generar_malla(nivel)
+        return malla
+    
+    @classmethod
+    def _generar_malla(cls, nivel):
+        raise NotImplementedError("Debes implementar este método en la subclase")
     
     def aumentar_nivel(self):
         self.nivel = min(self.nivel + 1, 6)  # Límite máximo de recursión
@@ -78,124 +864,235 @@ class Fractal(Objeto3D):
 
 
 class HelechoFractal(Fractal):
+    __slots__ = ()
+    FACTOR_SUBDIVISION = 1 / 0.6
+    COLUMNAS_COLOR = (1, 2)
+    color_hojas = _propiedad_color(1, "Color de las hojas")
+    color_tallo = _propiedad_color(2, "Color del tallo")
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.color_hojas = (0.1, 0.7, 0.2)
         self.color_tallo = (0.3, 0.5, 0.2)
     
+    def colores_partes(self):
+        return [self.color_hojas, self.color_tallo]
+    
+    def _esfera_local(self):
+        return (0, 1.9 * self.escala_fractal, 0), 2.6 * self.escala_fractal
+    
     def _dibujar(self):
+        malla = self.obtener_malla(self.nivel_dibujo())
         glPushMatrix()
-        glScalef(self.escala_fractal, self.escala_fractal, self.escala_fractal)
         glRotatef(-90, 1, 0, 0)  # Apuntar hacia arriba
-        self._dibujar_helecho(self.nivel, 1.5)
-        glPopMatrix()
-    
-    def _dibujar_helecho(self, nivel, longitud):
-        if nivel == 0:
-            glColor3f(*self.color_hojas)
-            glBegin(GL_TRIANGLES)
-            glVertex3f(0, 0, 0)
-            glVertex3f(-longitud*0.3, 0, longitud*0.8)
-            glVertex3f(longitud*0.3, 0, longitud*0.8)
-            glEnd()
-            return
+        glEnableClientState(GL_VERTEX_ARRAY)
         
         glColor3f(*self.color_tallo)
-        glBegin(GL_LINES)
-        glVertex3f(0, 0, 0)
-        glVertex3f(0, 0, longitud)
-        glEnd()
-        
-        glPushMatrix()
-        glTranslatef(0, 0, longitud)
+        glVertexPointer(3, GL_FLOAT, 0, malla["tallos"])
+        glDrawArrays(GL_LINES, 0, len(malla["tallos"]))
         
-        # Sub-ramas
-        for i in range(3):
-            glPushMatrix()
-            angle = -30 + i * 30
-            glRotatef(angle, 0, 1, 0)
-            self._dibujar_helecho(nivel - 1, longitud * 0.6)
-            glPopMatrix()
+        glColor3f(*self.color_hojas)
+        glVertexPointer(3, GL_FLOAT, 0, malla["hojas"])
+        glDrawArrays(GL_TRIANGLES, 0, len(malla["hojas"]))
         
+        glDisableClientState(GL_VERTEX_ARRAY)
         glPopMatrix()
+    
+    @classmethod
+    def _generar_malla(cls, nivel):
+        """Tallos y hojas de todas las ramas, nivel a nivel en vez de recursivamente"""
+        # Cada rama hija: avanzar hasta la punta del tallo y girar en Y
+        hijos = np.array([matriz_traslacion(0, 0, 1) @ matriz_rotacion(-30 + i * 30, 0, 1, 0)
+                          for i in range(3)])
+        marcos = np.identity(4)[None]  # Transformación de cada rama del nivel actual
+        longitud = 1.5
+        tallos = []
+        for _ in range(nivel):
+            origen = marcos[:, :3, 3]
+            punta = origen + marcos[:, :3, 2] * longitud
+            tallos.append(np.stack([origen, punta], axis=1))
+            
+            desplazamiento = hijos.copy()
+            desplazamiento[:, :3, 3] *= longitud
+            marcos = (marcos[:, None] @ desplazamiento[None]).reshape(-1, 4, 4)
+            longitud *= 0.6
+        
+        # Una hoja triangular al final de cada rama
+        hoja = np.array([(0, 0, 0), (-longitud * 0.3, 0, longitud * 0.8), (longitud * 0.3, 0, longitud * 0.8)])
+        hojas = np.einsum('nij,vj->nvi', marcos[:, :3, :3], hoja) + marcos[:, None, :3, 3]
+        
+        tallos = np.concatenate(tallos) if tallos else np.zeros((0, 2, 3))
+        return {
+            "tallos": tallos.reshape(-1, 3).astype(np.float32),
+            "hojas": hojas.reshape(-1, 3).astype(np.float32)
+        }
 
 class TrianguloSierpinski(Fractal):
+    __slots__ = ()
+    COLUMNAS_COLOR = (1, 2)
+    color_base = _propiedad_color(1, "Color de los triángulos")
+    color_borde = _propiedad_color(2, "Color de los bordes")
+    ALTURA = 4.0 * math.sqrt(3) / 2
+    VERTICES = ((0, ALTURA * 2/3, 0), (-2, -ALTURA * 1/3, 0), (2, -ALTURA * 1/3, 0))
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.color_base = (0.9, 0.2, 0.1)
         self.color_borde = (0.7, 0.1, 0.0)
     
+    def colores_partes(self):
+        return [self.color_base, self.color_borde]
+    
+    def _esfera_local(self):
+        return (0, 0, 0), 4.0 / math.sqrt(3) * self.escala_fractal
+    
     def _dibujar(self):
-        glPushMatrix()
-        glScalef(self.escala_fractal, self.escala_fractal, self.escala_fractal)
-        glRotatef(0, 0, 0, 1)
+        malla = self.obtener_malla(self.nivel_dibujo())
+        glEnableClientState(GL_VERTEX_ARRAY)
         
-        altura = 4.0 * math.sqrt(3) / 2
-        self.vertices = [
-            (0, altura * 2/3, 0),
-            (-2, -altura * 1/3, 0),
-            (2, -altura * 1/3, 0)
-        ]
+        glColor3f(*self.color_base)
+        glNormal3f(0, 0, 1)
+        glVertexPointer(3, GL_FLOAT, 0, malla["triangulos"])
+        glDrawArrays(GL_TRIANGLES, 0, len(malla["triangulos"]))
         
-        self._dibujar_sierpinski(self.nivel, self.vertices)
-        glPopMatrix()
-    
-    def _dibujar_sierpinski(self, nivel, vertices):
-        if nivel == 0:
-            glColor3f(*self.color_base)
-            glBegin(GL_TRIANGLES)
-            for v in vertices:
-                glVertex3f(v[0], v[1], v[2])
-            glEnd()
-            
-            glColor3f(*self.color_borde)
-            glLineWidth(2)
-            glBegin(GL_LINE_LOOP)
-            for v in vertices:
-                glVertex3f(v[0], v[1], v[2])
-            glEnd()
-            return
+        glColor3f(*self.color_borde)
+        glLineWidth(2)
+        glVertexPointer(3, GL_FLOAT, 0, malla["bordes"])
+        glDrawArrays(GL_LINES, 0, len(malla["bordes"]))
         
-        p1, p2, p3 = vertices
-        m1 = ((p1[0] + p2[0])/2, (p1[1] + p2[1])/2, (p1[2] + p2[2])/2)
-        m2 = ((p2[0] + p3[0])/2, (p2[1] + p3[1])/2, (p2[2] + p3[2])/2)
-        m3 = ((p3[0] + p1[0])/2, (p3[1] + p1[1])/2, (p3[2] + p1[2])/2)
+        glDisableClientState(GL_VERTEX_ARRAY)
+    
+    def malla_seleccion(self):
+        triangulos = self.obtener_malla(self.nivel_dibujo())["triangulos"]
+        return Malla(triangulos, np.broadcast_to((0.0, 0.0, 1.0), triangulos.shape))
+    
+    @classmethod
+    def _generar_malla(cls, nivel):
+        """Triángulos hoja y sus bordes, subdividiendo todos a la vez en cada nivel"""
+        triangulos = np.array([cls.VERTICES], dtype=np.float64)
+        for _ in range(nivel):
+            p1, p2, p3 = triangulos[:, 0], triangulos[:, 1], triangulos[:, 2]
+            m1, m2, m3 = (p1 + p2) / 2, (p2 + p3) / 2, (p3 + p1) / 2
+            triangulos = np.stack([np.stack([p1, m1, m3], axis=1),
+                                   np.stack([m1, p2, m2], axis=1),
+                                   np.stack([m3, m2, p3], axis=1)], axis=1).reshape(-1, 3, 3)
         
-        self._dibujar_sierpinski(nivel - 1, [p1, m1, m3])
-        self._dibujar_sierpinski(nivel - 1, [m1, p2, m2])
-        self._dibujar_sierpinski(nivel - 1, [m3, m2, p3])
+        # Cada borde como un par de vértices (equivalente a GL_LINE_LOOP por triángulo)
+        bordes = triangulos[:, [0, 1, 1, 2, 2, 0]]
+        return {
+            "triangulos": triangulos.reshape(-1, 3).astype(np.float32),
+            "bordes": bordes.reshape(-1, 3).astype(np.float32)
+        }
+
 class CuboMenger(Fractal):
+    __slots__ = ()
+    FACTOR_SUBDIVISION = 3.0
+    # La rejilla de vóxeles crece como 27^nivel; por encima se reutiliza esta malla
+    NIVEL_MAXIMO_MALLA = 5
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.color = (0.2, 0.5, 0.8)
     
+    def clave_forma(self):
+        return (min(self.nivel_dibujo(), self.NIVEL_MAXIMO_MALLA),)
+    
+    def _esfera_local(self):
+        return (0, 0, 0), math.sqrt(3) / 2 * self.escala_fractal
+    
     def _dibujar(self):
-        glPushMatrix()
-        glScalef(self.escala_fractal, self.escala_fractal, self.escala_fractal)
+        malla = self.obtener_malla(min(self.nivel_dibujo(), self.NIVEL_MAXIMO_MALLA))
         glColor3f(*self.color)
-        self._dibujar_cubo(self.nivel, 1.0)
+        
+        # Los vértices son enteros en unidades de vóxel: llevarlos al cubo de lado 1
+        glPushMatrix()
+        glTranslatef(-0.5, -0.5, -0.5)
+        glScalef(1 / malla["lado"], 1 / malla["lado"], 1 / malla["lado"])
+        glEnableClientState(GL_VERTEX_ARRAY)
+        for normal, vertices in malla["caras"]:
+            glNormal3f(*normal)
+            glVertexPointer(3, GL_SHORT, 0, vertices)
+            glDrawArrays(GL_QUADS, 0, len(vertices))
+        glDisableClientState(GL_VERTEX_ARRAY)
         glPopMatrix()
     
-    def _dibujar_cubo(self, nivel, tamaño):
-        if nivel == 0:
-            glutSolidCube(tamaño)
-            return
-        
-        tercio = tamaño / 3
-        for x in [-1, 0, 1]:
-            for y in [-1, 0, 1]:
-                for z in [-1, 0, 1]:
-                    # Saltar el cubo central y los centros de las caras
-                    if (x == 0 and y == 0) or (x == 0 and z == 0) or (y == 0 and z == 0):
-                        continue
-                    
-                    glPushMatrix()
-                    glTranslatef(x*tercio, y*tercio, z*tercio)
-                    self._dibujar_cubo(nivel - 1, tercio)
-                    glPopMatrix()
+    def malla_seleccion(self):
+        malla = self.obtener_malla(min(self.nivel_dibujo(), self.NIVEL_MAXIMO_MALLA))
+        vertices, normales = [], []
+        for normal, quads in malla["caras"]:
+            quads = quads.reshape(-1, 4, 3)
+            vertices.append(quads[:, [0, 1, 2, 0, 2, 3]].reshape(-1, 3))
+            normales.append(np.broadcast_to(normal, (len(quads) * 6, 3)))
+        # Del espacio de vóxeles al cubo de lado 1 centrado (como en _dibujar)
+        return Malla(np.concatenate(vertices), np.concatenate(normales)).transformada(
+            matriz_traslacion(-0.5, -0.5, -0.5) @ matriz_escala(*[1 / malla["lado"]] * 3))
+    
+    @staticmethod
+    def _ocupacion(nivel):
+        """Rejilla booleana (lado^3) con los vóxeles sólidos de la esponja"""
+        lado = 3 ** nivel
+        indices = np.arange(lado)
+        ocupado = np.ones((lado, lado, lado), dtype=bool)
+        for k in range(nivel):
+            # Un vóxel es hueco si en algún dígito base 3 dos coordenadas valen 1
+            centro = (indices // 3 ** k) % 3 == 1
+            x, y, z = centro[:, None, None], centro[None, :, None], centro[None, None, :]
+            ocupado &= ~((x & y) | (x & z) | (y & z))
+        return ocupado
+    
+    @classmethod
+    def _generar_malla(cls, nivel):
+        """Caras exteriores de la esponja, fusionando cubos vecinos.
+
+        Solo se generan las caras entre un vóxel sólido y uno vacío (las caras
+        internas entre subcubos vecinos desaparecen) y las caras contiguas de
+        una misma fila se unen en un único rectángulo.
+        """
+        ocupado = cls._ocupacion(nivel)
+        lado = ocupado.shape[0]
+        caras = []
+        for eje in range(3):
+            # Ordenar los ejes como (eje, b, c) con b x c = eje
+            ejes = (eje, (eje + 1) % 3, (eje + 2) % 3)
+            rejilla = np.transpose(ocupado, ejes)
+            relleno = np.zeros((lado + 2, lado, lado), dtype=bool)
+            relleno[1:-1] = rejilla
+            positivas = relleno[:-1] & ~relleno[1:]  # Sólido detrás, vacío delante
+            negativas = ~relleno[:-1] & relleno[1:]
+            for signo, mascara in ((1, positivas), (-1, negativas)):
+                quads = cls._fusionar_filas(mascara)
+                vertices = np.empty(quads.shape[:2] + (3,), dtype=np.int16)
+                vertices[:, :, ejes[0]] = quads[:, :, 0]
+                vertices[:, :, ejes[1]] = quads[:, :, 1]
+                vertices[:, :, ejes[2]] = quads[:, :, 2]
+                if signo < 0:
+                    vertices = vertices[:, ::-1]
+                normal = [0, 0, 0]
+                normal[eje] = signo
+                caras.append((tuple(normal), np.ascontiguousarray(vertices.reshape(-1, 3))))
+        return {"lado": lado, "caras": caras}
+    
+    @staticmethod
+    def _fusionar_filas(mascara):
+        """Une las caras consecutivas de cada fila en rectángulos (N, 4, [plano, b, c])"""
+        planos, filas, _ = mascara.shape
+        bordes = np.diff(mascara.astype(np.int8), axis=2,
+                         prepend=np.zeros((planos, filas, 1), dtype=np.int8),
+                         append=np.zeros((planos, filas, 1), dtype=np.int8))
+        plano, fila, inicio = np.nonzero(bordes == 1)
+        fin = np.nonzero(bordes == -1)[2]
+        quads = np.empty((len(plano), 4, 3), dtype=np.int32)
+        quads[:, :, 0] = plano[:, None]
+        quads[:, :, 1] = np.stack([fila, fila + 1, fila + 1, fila], axis=1)
+        quads[:, :, 2] = np.stack([inicio, inicio, fin, fin], axis=1)
+        return quads
 
 
 class Auto(Objeto3D):
+    # Los colores del auto no van por lotes (y el de las ventanas lleva alfa)
+    __slots__ = ("color_cuerpo", "color_ventanas", "color_llantas", "color_luces_delanteras",
+                 "color_luces_traseras", "color_interior", "textura_cuerpo", "ancho", "largo", "alto")
+    
     def __init__(self, textura_cuerpo=None, **kwargs):
         super().__init__(**kwargs)
         self.color_cuerpo = (0.66, 0.66, 0.9)   # Rojo brillante
@@ -209,6 +1106,22 @@ class Auto(Objeto3D):
         self.largo = 4.2
         self.alto = 1.4
 
+    proyecta_sombra = True
+
+    def _esfera_local(self):
+        return (0, 0.8, 0), 2.9
+
+    def volumen_colision(self):
+        return ("caja", self.ancho / 2, self.largo / 2)
+
+    def clave_sombra(self):
+        return (self.ancho, self.alto, self.largo)
+
+    def _construir_malla_sombra(self):
+        # Una caja desde el chasis hasta el techo
+        return Malla.cubo().transformada(matriz_traslacion(0, 0.1 + self.alto / 2, 0)
+                                         @ matriz_escala(self.ancho, self.alto, self.largo))
+
     def _dibujar(self):
         # Orden de dibujo optimizado
         self._dibujar_chasis()
@@ -217,9 +1130,9 @@ class Auto(Objeto3D):
         self._dibujar_detalles_exteriores()
     
     def _dibujar_chasis(self):
+        # El auto se dibuja en modo inmediato: puede cambiar de estado a mitad del objeto
         if self.textura_cuerpo and self.textura_cuerpo.id:
-            glEnable(GL_TEXTURE_2D)
-            glBindTexture(GL_TEXTURE_2D, self.textura_cuerpo.id)
+            self.estado_gl.textura(self.textura_cuerpo.id)
             glColor3f(1, 1, 1)
         else:
             glColor3f(*self.color_cuerpo)
@@ -260,12 +1173,10 @@ class Auto(Objeto3D):
         glutSolidCube(1.0)
         glPopMatrix()
         
-   
-        if self.textura_cuerpo and self.textura_cuerpo.id:
-            glDisable(GL_TEXTURE_2D)
+        self.estado_gl.textura(None)
     
     def _dibujar_ventanas(self):
-        glEnable(GL_BLEND)
+        self.estado_gl.capacidad(GL_BLEND, True)
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
         glColor4f(*self.color_ventanas)
         
@@ -301,7 +1212,7 @@ class Auto(Objeto3D):
             glutSolidCube(1.0)
             glPopMatrix()
         
-        glDisable(GL_BLEND)
+        self.estado_gl.capacidad(GL_BLEND, False)
     
     def _dibujar_interior(self):
         glColor3f(*self.color_interior)
@@ -363,12 +1274,43 @@ class Auto(Objeto3D):
             glPopMatrix()
         
 class Casa(Objeto3D):
+    __slots__ = ()
+    COLUMNAS_COLOR = (1, 2, 3)
+    color_paredes = _propiedad_color(1, "Color de las paredes")
+    color_techo = _propiedad_color(2, "Color del techo")
+    color_puerta = _propiedad_color(3, "Color de la puerta")
+    
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.color_paredes = (0.7, 0.5, 0.3)
         self.color_techo = (0.8, 0.2, 0.1)
         self.color_puerta = (0.4, 0.2, 0.0)
     
+    por_lotes = True
+    proyecta_sombra = True
+    
+    def clave_forma(self):
+        return ()
+    
+    def colores_partes(self):
+        return [self.color_paredes, self.color_techo, self.color_puerta]
+    
+    def _esfera_local(self):
+        # Paredes de y=-2.25 a 2.25 y techo hasta 3.3 con base de radio 2.5
+        return (0, 0.525, 0), 3.75
+    
+    def volumen_colision(self):
+        # Las paredes (el alero del techo queda por encima del auto)
+        return ("caja", 1.0, 1.0)
+    
+    def _construir_malla(self):
+        paredes = Malla.cubo(parte=0).transformada(matriz_escala(2, 4.5, 2))
+        techo = Malla.cono(2.5, 1, 4, parte=1).transformada(
+            matriz_traslacion(0, 2.3, 0) @ matriz_rotacion(-90, 1, 0, 0))
+        puerta = Malla.cubo(parte=2).transformada(
+            matriz_traslacion(0, 0.5, 1.01) @ matriz_escala(0.6, 1.0, 0.1))
+        return Malla.combinar([paredes, techo, puerta])
+    
     def _dibujar(self):
         # Paredes
         glColor3f(*self.color_paredes)
@@ -394,6 +1336,11 @@ class Casa(Objeto3D):
         glPopMatrix()
 
 class Montana(Objeto3D):
+    __slots__ = ("_textura", "_picos")
+    COLUMNAS_COLOR = (1, 2)
+    color_base = _propiedad_color(1, "Color de la base")
+    color_pico = _propiedad_color(2, "Color de los picos")
+    
     def __init__(self, textura=None, **kwargs):
         super().__init__(**kwargs)
         self.textura = textura
@@ -401,17 +1348,77 @@ class Montana(Objeto3D):
         self.color_pico = (0.5, 0.4, 0.2)  # Color picos
         self.picos = [(-1.5, -1.5, 5), (1.5, -1.5, 4), (0, 1.5, 6)]  # (x, z, altura)
     
+    @property
+    def textura(self):
+        return self._textura
+    
+    @textura.setter
+    def textura(self, valor):
+        self._textura = valor
+        self._invalidar_forma()
+    
+    @property
+    def picos(self):
+        return self._picos
+    
+    @picos.setter
+    def picos(self, valor):
+        # Se guarda como tupla para que todo cambio pase por aquí: la esfera
+        # envolvente depende de la altura de los picos y el lote de su forma
+        self._picos = tuple(tuple(pico) for pico in valor)
+        self._invalidar_esfera()
+        self._invalidar_forma()
+    
+    por_lotes = True
+    proyecta_sombra = True
+    
+    def clave_forma(self):
+        textura_id = self.textura.id if self.textura else None
+        return (self.picos, textura_id)
+    
+    def colores_partes(self):
+        if self.textura and self.textura.id:
+            return [(1, 1, 1), (1, 1, 1)]
+        return [self.color_base, self.color_pico]
+    
+    def _esfera_local(self):
+        altura = max([pico[2] for pico in self.picos] + [0.05])
+        return (0, altura / 2, 0), math.sqrt(4**2 + 4**2 + (altura / 2)**2)
+    
+    def volumen_colision(self):
+        return ("caja", 4.0, 4.0)
+    
+    def _construir_malla(self):
+        base = Malla.cubo(parte=0).transformada(matriz_escala(8, 0.1, 8))
+        
+        # Cada pico es un abanico de 4 triángulos hacia las esquinas de la base
+        esquinas = np.array([(-4, 0, -4), (4, 0, -4), (4, 0, 4), (-4, 0, 4), (-4, 0, -4)], dtype=float)
+        tex_esquinas = np.array([(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)], dtype=float)
+        picos = []
+        for offset_x, offset_z, height in self.picos:
+            cima = np.array([offset_x, height, offset_z], dtype=float)
+            tris = np.stack([np.broadcast_to(cima, (4, 3)), esquinas[:-1], esquinas[1:]], axis=1)
+            normales = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+            normales *= np.where(normales[:, 1:2] < 0, -1, 1)  # Siempre hacia arriba
+            normales /= np.maximum(np.linalg.norm(normales, axis=1, keepdims=True), 1e-12)
+            texcoords = np.stack([np.broadcast_to((0.5, 1), (4, 2)), tex_esquinas[:-1], tex_esquinas[1:]], axis=1)
+            picos.append(Malla(tris, np.repeat(normales, 3, axis=0), 1, texcoords))
+        
+        malla = Malla.combinar([base] + picos)
+        malla.textura_id = self.textura.id if self.textura else None
+        malla.doble_cara = True
+        return malla
+    
+    def estado_render(self):
+        # Polígonos de dos caras: sin culling para las montañas
+        textura_id = self.textura.id if self.textura else None
+        return (textura_id, True, True, False)
+    
     def _dibujar(self):
-        # Configurar textura si existe
         if self.textura and self.textura.id:
-            glEnable(GL_TEXTURE_2D)
-            glBindTexture(GL_TEXTURE_2D, self.textura.id)
             glColor3f(1, 1, 1)
         else:
             glColor3f(*self.color_base)
-
-        # Habilitar polígonos de dos caras para montañas
-        glDisable(GL_CULL_FACE)  # Desactivar culling para montañas
         
         # Base de la montaña (usando GLUT para la base cuadrada)
         glPushMatrix()
@@ -440,11 +1447,6 @@ class Montana(Objeto3D):
                 glVertex3f(-4, 0, 4)
                 glVertex3f(-4, 0, -4)
                 glEnd()
-        
-        if self.textura and self.textura.id:
-            glDisable(GL_TEXTURE_2D)
-        
-        glEnable(GL_CULL_FACE)  # Reactivar culling
 
 
 class Carretera(Objeto3D):
@@ -460,6 +1462,12 @@ class Carretera(Objeto3D):
         ]
         self.segmentos = 100
         self.ancho = 5
+        
+        # Malla teselada y consultas de cercanía en caché (se recalculan si cambia la curva)
+        self._malla = None
+        self._clave_malla = None
+        self._consulta = None
+        self._clave_consulta = None
     
     def _calcular_punto(self, t):
         """Calcula un punto en la curva Bézier cúbica"""
@@ -485,123 +1493,362 @@ class Carretera(Objeto3D):
         
         return (x, y, z)
     
+    def _calcular_puntos(self, ts):
+        """Versión vectorizada de _calcular_punto para un array de parámetros t"""
+        ts = np.asarray(ts, dtype=np.float64)
+        puntos = np.asarray(self.puntos_control, dtype=np.float64)
+        if len(puntos) < 4:
+            return np.broadcast_to(puntos[0], ts.shape + (3,)).copy()
+        
+        num_segmentos = len(puntos) - 3
+        segmento = np.minimum((ts * num_segmentos).astype(int), num_segmentos - 1)
+        t_segmento = ((ts * num_segmentos) - segmento)[..., None]
+        
+        mt = 1 - t_segmento
+        return (mt * mt * mt * puntos[segmento] + 3 * mt * mt * t_segmento * puntos[segmento + 1]
+                + 3 * mt * t_segmento * t_segmento * puntos[segmento + 2]
+                + t_segmento * t_segmento * t_segmento * puntos[segmento + 3])
+    
+    def _obtener_malla(self):
+        """Devuelve la malla teselada, recalculándola solo si cambió la curva"""
+        clave = (tuple(tuple(p) for p in self.puntos_control), self.segmentos, self.ancho)
+        if clave != self._clave_malla:
+            self._malla = self._teselar()
+            self._clave_malla = clave
+        return self._malla
+    
+    def obtener_consulta(self):
+        """ConsultaCarretera de la curva actual, reconstruida solo si cambió"""
+        clave = (tuple(tuple(p) for p in self.puntos_control), self.ancho)
+        if clave != self._clave_consulta:
+            self._consulta = ConsultaCarretera(self)
+            self._clave_consulta = clave
+        return self._consulta
+    
+    def _teselar(self):
+        """Calcula los vértices del asfalto y de las marcas viales con NumPy"""
+        indices = np.arange(self.segmentos + 1)
+        ts = indices / self.segmentos
+        puntos = self._calcular_puntos(ts)
+        
+        # Tangente hacia delante (la del último punto apunta a +Z)
+        puntos_sig = self._calcular_puntos((indices[:-1] + 0.01) / self.segmentos)
+        tangentes = np.zeros_like(puntos)
+        tangentes[:-1, 0] = puntos_sig[:, 0] - puntos[:-1, 0]
+        tangentes[:-1, 2] = puntos_sig[:, 2] - puntos[:-1, 2]
+        tangentes[-1] = (0, 0, 1)
+        normales = self._normales_escaladas(tangentes, self.ancho)
+        
+        # Bordes izquierdo y derecho intercalados para GL_QUAD_STRIP
+        vertices = np.empty((len(puntos), 2, 3), dtype=np.float32)
+        vertices[:, 0] = puntos + normales
+        vertices[:, 1] = puntos - normales
+        texcoords = np.empty((len(puntos), 2, 2), dtype=np.float32)
+        texcoords[:, 0, 0] = 0
+        texcoords[:, 1, 0] = 1
+        texcoords[:, :, 1] = (ts * 10)[:, None]  # Repetir textura a lo largo
+        
+        # Marcas viales: un rectángulo entre los puntos i e i+2 cada 4 puntos
+        inicio = np.arange(0, self.segmentos - 1, 4)
+        p1 = puntos[inicio] + (0, 0.01, 0)
+        p2 = puntos[inicio + 2] + (0, 0.01, 0)
+        tangentes_marcas = (p2 - p1) * (1, 0, 1)
+        normales_marcas = self._normales_escaladas(tangentes_marcas, 0.15)
+        marcas = np.stack([p1 + normales_marcas, p1 - normales_marcas,
+                           p2 - normales_marcas, p2 + normales_marcas], axis=1)
+        
+        return {
+            "vertices": vertices.reshape(-1, 3),
+            "texcoords": texcoords.reshape(-1, 2),
+            "marcas": marcas.reshape(-1, 3).astype(np.float32)
+        }
+    
+    @staticmethod
+    def _normales_escaladas(tangentes, longitud):
+        """Perpendicular horizontal a cada tangente con la longitud indicada"""
+        normales = np.stack([-tangentes[:, 2], np.zeros(len(tangentes)), tangentes[:, 0]], axis=1)
+        magnitud = np.linalg.norm(normales, axis=1, keepdims=True)
+        return np.where(magnitud > 0, normales / np.where(magnitud > 0, magnitud, 1) * longitud, normales)
+    
+    def estado_render(self):
+        # Sin culling: la tira se ve desde ambos lados
+        return (self.textura.id if self.textura else None, True, True, False)
+    
     def _dibujar(self):
-        # Desactivar culling temporalmente para la carretera
-        glDisable(GL_CULL_FACE)
-
+        malla = self._obtener_malla()
 
         if self.textura and self.textura.id:
-            glEnable(GL_TEXTURE_2D)
-            glBindTexture(GL_TEXTURE_2D, self.textura.id)
             glColor3f(1, 1, 1)  # Blanco para no alterar la textura
         else:
             glColor3f(0.2, 0.2, 0.2)
         
-        # Dibujar la carretera
-        glBegin(GL_QUAD_STRIP)
-        for i in range(self.segmentos + 1):
-            t = i / self.segmentos
-            punto = self._calcular_punto(t)
-            
-            # Calcular tangente
-            if i < self.segmentos:
-                t_sig = (i + 0.01) / self.segmentos
-                punto_sig = self._calcular_punto(t_sig)
-                tangente = (punto_sig[0] - punto[0], 0, punto_sig[2] - punto[2])
-            else:
-                tangente = (0, 0, 1)
-            
-            # Calcular normal
-            normal = (-tangente[2], 0, tangente[0])
-            magnitud = math.sqrt(normal[0]**2 + normal[2]**2)
-            if magnitud > 0:
-                normal = (normal[0]/magnitud * self.ancho, 0, normal[2]/magnitud * self.ancho)
-            
-            # Bordes de la carretera
-            borde_izq = (punto[0] + normal[0], punto[1], punto[2] + normal[2])
-            borde_der = (punto[0] - normal[0], punto[1], punto[2] - normal[2])
-            
-            # Agregar coordenadas de textura
-            glTexCoord2f(0, t * 10)  # Repetir textura a lo largo
-            glVertex3f(*borde_izq)
-            glTexCoord2f(1, t * 10)
-            glVertex3f(*borde_der)
-        glEnd()
+        # Dibujar la carretera desde los arrays precalculados
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, malla["vertices"])
+        glTexCoordPointer(2, GL_FLOAT, 0, malla["texcoords"])
+        glDrawArrays(GL_QUAD_STRIP, 0, len(malla["vertices"]))
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
 
-        # Desactivar textura antes de dibujar marcas viales
-        if self.textura and self.textura.id:
-            glDisable(GL_TEXTURE_2D)
+        # Desactivar textura antes de dibujar marcas viales (la carretera no usa display list)
+        self.estado_gl.textura(None)
         
-        # Marcas viales
+        # Marcas viales (todas en una sola llamada)
         glColor3f(1, 1, 1)
-        puntos_centrales = [self._calcular_punto(i/self.segmentos) for i in range(self.segmentos + 1)]
-        
-        for i in range(0, self.segmentos - 1, 4):
-            p1 = puntos_centrales[i]
-            p2 = puntos_centrales[i + 2]
-            
-            p1 = (p1[0], p1[1] + 0.01, p1[2])
-            p2 = (p2[0], p2[1] + 0.01, p2[2])
-            
-            tangente = (p2[0] - p1[0], 0, p2[2] - p1[2])
-            normal = (-tangente[2], 0, tangente[0])
-            magnitud = math.sqrt(normal[0]**2 + normal[2]**2)
-            if magnitud > 0:
-                normal = (normal[0]/magnitud * 0.15, 0, normal[2]/magnitud * 0.15)
-            
-            glBegin(GL_QUADS)
-            glVertex3f(p1[0] + normal[0], p1[1], p1[2] + normal[2])
-            glVertex3f(p1[0] - normal[0], p1[1], p1[2] - normal[2])
-            glVertex3f(p2[0] - normal[0], p2[1], p2[2] - normal[2])
-            glVertex3f(p2[0] + normal[0], p2[1], p2[2] + normal[2])
-            glEnd()
+        glVertexPointer(3, GL_FLOAT, 0, malla["marcas"])
+        glDrawArrays(GL_QUADS, 0, len(malla["marcas"]))
+        glDisableClientState(GL_VERTEX_ARRAY)
 
-        glEnable(GL_CULL_FACE)  # Reactivar culling
+class ConsultaCarretera:
+    """Distancia de puntos del plano XZ a la carretera.
 
-class Arbol(Objeto3D):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.color_tronco = (0.4, 0.2, 0.1)
-        self.color_copa = (0.1, 0.6, 0.2)
+    La curva se aproxima con `muestras` tramos rectos y s[i] guarda la longitud
+    de arco acumulada hasta la muestra i. Una rejilla guarda en cada celda los
+    tramos que pasan a menos de `margen` de ella, así que una consulta solo mide
+    unos pocos tramos. Los puntos más lejanos que `margen` buscan primero entre
+    tramos gruesos (AGRUPACION muestras cada uno) y afinan dentro de los dos
+    más cercanos.
+    """
+    AGRUPACION = 8
     
-    def _dibujar(self):
-        # Tronco
-        glColor3f(*self.color_tronco)
-        glPushMatrix()
-        glRotatef(-90, 1, 0, 0)
-        glutSolidCylinder(0.2, 2, 8, 1)
-        glPopMatrix()
+    def __init__(self, carretera, muestras=128, tamano_celda=3.0, margen=None):
+        self.ancho = carretera.ancho
+        self.margen = margen if margen is not None else carretera.ancho + 1.0
+        self.tamano_celda = tamano_celda
         
-        # Copa
-        glColor3f(*self.color_copa)
+        # Tabla de muestras y longitud de arco
+        self.ts = np.linspace(0.0, 1.0, muestras + 1)
+        self.puntos = carretera._calcular_puntos(self.ts)
+        self.inicio = self.puntos[:-1][:, [0, 2]]
+        self.direccion = self.puntos[1:][:, [0, 2]] - self.inicio
+        self.longitudes = np.linalg.norm(self.direccion, axis=1)
+        self.s = np.concatenate([[0.0], np.cumsum(self.longitudes)])
+        self.longitud_total = float(self.s[-1])
+        
+        # Tramos gruesos para los puntos lejanos
+        gruesos = self.puntos[::self.AGRUPACION][:, [0, 2]]
+        if len(self.inicio) % self.AGRUPACION:
+            gruesos = np.concatenate([gruesos, self.puntos[-1:, [0, 2]]])
+        self.inicio_grueso = gruesos[:-1]
+        self.direccion_gruesa = gruesos[1:] - gruesos[:-1]
+        self._construir_rejilla()
+    
+    def _construir_rejilla(self):
+        extremos = np.concatenate([self.inicio, self.inicio + self.direccion])
+        self.origen = np.floor((extremos.min(axis=0) - self.margen) / self.tamano_celda) * self.tamano_celda
+        maximo = extremos.max(axis=0) + self.margen
+        self.dimensiones = np.ceil((maximo - self.origen) / self.tamano_celda).astype(int) + 1
+        
+        # Un tramo entra en una celda si pasa a menos de margen + media diagonal de su centro,
+        # lo que cubre a cualquier punto de la celda que esté a menos de margen del tramo
+        i, j = np.meshgrid(np.arange(self.dimensiones[0]), np.arange(self.dimensiones[1]), indexing="ij")
+        centros = self.origen + (np.stack([i, j], axis=-1).reshape(-1, 2) + 0.5) * self.tamano_celda
+        alcance = self.margen + self.tamano_celda * math.sqrt(2) / 2
+        todos = np.arange(len(self.inicio), dtype=np.int32)
+        self.listas = {}
+        for celda, centro in enumerate(centros):
+            tramos = todos[self._distancias2(centro, self.inicio, self.direccion) <= alcance * alcance]
+            if len(tramos):
+                self.listas[divmod(celda, int(self.dimensiones[1]))] = tramos.tolist()
+        
+        # Listas rellenadas con -1 para poder indexar todas las consultas a la vez
+        maximo_por_celda = max(len(tramos) for tramos in self.listas.values())
+        self.celdas = np.full((*self.dimensiones, maximo_por_celda), -1, dtype=np.int32)
+        for (i, j), tramos in self.listas.items():
+            self.celdas[i, j, :len(tramos)] = tramos
+        self._segmentos = list(zip(self.inicio.tolist(), self.direccion.tolist()))
+    
+    @staticmethod
+    def _distancias2(punto, inicio, direccion):
+        """Distancia² de un punto a cada tramo"""
+        relativo = punto - inicio
+        u = np.clip(np.sum(relativo * direccion, axis=1) /
+                    np.maximum(np.sum(direccion * direccion, axis=1), 1e-12), 0.0, 1.0)
+        diferencia = relativo - u[:, None] * direccion
+        return np.sum(diferencia * diferencia, axis=1)
+    
+    def en_carretera(self, x, z):
+        """Comprobación rápida para un solo punto, sin NumPy (se usa en cada paso de física)"""
+        celda = (math.floor((x - self.origen[0]) / self.tamano_celda),
+                 math.floor((z - self.origen[1]) / self.tamano_celda))
+        ancho2 = self.ancho * self.ancho
+        for tramo in self.listas.get(celda, ()):
+            (ax, az), (dx, dz) = self._segmentos[tramo]
+            rx, rz = x - ax, z - az
+            u = min(max((rx * dx + rz * dz) / ((dx * dx + dz * dz) or 1e-12), 0.0), 1.0)
+            rx -= u * dx
+            rz -= u * dz
+            if rx * rx + rz * rz <= ancho2:
+                return True
+        return False
+    
+    def consultar_lote(self, xs, zs):
+        """Punto más cercano, desplazamiento lateral con signo, tangente y si está sobre el asfalto.
+
+        Devuelve un diccionario de arreglos con un elemento por punto consultado.
+        """
+        puntos = np.stack([np.asarray(xs, dtype=np.float64).ravel(),
+                           np.asarray(zs, dtype=np.float64).ravel()], axis=1)
+        celda = np.floor((puntos - self.origen) / self.tamano_celda).astype(int)
+        dentro = np.all((celda >= 0) & (celda < self.dimensiones), axis=1)
+        candidatos = np.full((len(puntos), self.celdas.shape[2]), -1, dtype=np.int32)
+        candidatos[dentro] = self.celdas[celda[dentro, 0], celda[dentro, 1]]
+        tramo, u, distancia2 = self._mas_cercano(puntos, candidatos)
+        
+        # Fuera del margen la rejilla no garantiza el tramo correcto
+        lejos = np.flatnonzero(distancia2 > self.margen * self.margen)
+        if len(lejos):
+            tramo[lejos], u[lejos], distancia2[lejos] = self._mas_cercano(
+                puntos[lejos], self._candidatos_lejanos(puntos[lejos]))
+        
+        longitud = self.longitudes[tramo]
+        tangente = self.direccion[tramo] / np.maximum(longitud, 1e-12)[:, None]
+        cercano = self.inicio[tramo] + u[:, None] * self.direccion[tramo]
+        distancia = np.sqrt(distancia2)
+        # Positivo hacia la izquierda del sentido de la curva (normal (-tz, tx))
+        lado = (puntos[:, 0] - cercano[:, 0]) * -tangente[:, 1] + (puntos[:, 1] - cercano[:, 1]) * tangente[:, 0]
+        y = self.puntos[tramo, 1] + u * (self.puntos[tramo + 1, 1] - self.puntos[tramo, 1])
+        return {
+            "punto": np.stack([cercano[:, 0], y, cercano[:, 1]], axis=1),
+            "lateral": np.where(lado >= 0, distancia, -distancia),
+            "tangente": np.stack([tangente[:, 0], np.zeros(len(tangente)), tangente[:, 1]], axis=1),
+            "en_carretera": distancia <= self.ancho,
+            "s": self.s[tramo] + u * longitud,
+            "t": self.ts[tramo] + u * (self.ts[tramo + 1] - self.ts[tramo])
+        }
+    
+    def _candidatos_lejanos(self, puntos):
+        """Tramos finos de los dos tramos gruesos más cercanos (y sus vecinos en los extremos)"""
+        rx = puntos[:, 0, None] - self.inicio_grueso[:, 0]
+        rz = puntos[:, 1, None] - self.inicio_grueso[:, 1]
+        dx, dz = self.direccion_gruesa[:, 0], self.direccion_gruesa[:, 1]
+        u = np.clip((rx * dx + rz * dz) / np.maximum(dx * dx + dz * dz, 1e-12), 0.0, 1.0)
+        rx -= u * dx
+        rz -= u * dz
+        dos_mejores = np.argsort(rx * rx + rz * rz, axis=1)[:, :2]
+        desplazamientos = np.arange(-1, self.AGRUPACION + 1)
+        candidatos = (dos_mejores[:, :, None] * self.AGRUPACION + desplazamientos).reshape(len(puntos), -1)
+        return np.where((candidatos >= 0) & (candidatos < len(self.inicio)), candidatos, -1)
+    
+    def _mas_cercano(self, puntos, candidatos):
+        """Tramo, parámetro sobre el tramo y distancia² al más cercano de los candidatos (-1 = vacío).
+
+        Se opera por componentes x/z porque las reducciones sobre un eje de
+        tamaño 2 son lentas en NumPy.
+        """
+        validos = candidatos >= 0
+        indices = np.where(validos, candidatos, 0)
+        inicio, direccion = self.inicio[indices], self.direccion[indices]
+        rx = puntos[:, 0, None] - inicio[..., 0]
+        rz = puntos[:, 1, None] - inicio[..., 1]
+        dx, dz = direccion[..., 0], direccion[..., 1]
+        u = np.clip((rx * dx + rz * dz) / np.maximum(dx * dx + dz * dz, 1e-12), 0.0, 1.0)
+        rx -= u * dx
+        rz -= u * dz
+        distancia2 = rx * rx + rz * rz
+        distancia2[~validos] = np.inf
+        mejor = np.argmin(distancia2, axis=1)
+        filas = np.arange(len(puntos))
+        return indices[filas, mejor], u[filas, mejor], distancia2[filas, mejor]
+    
+    def consultar(self, x, z):
+        """Versión para un solo punto con valores de Python"""
+        resultado = self.consultar_lote([x], [z])
+        return {
+            "punto": tuple(resultado["punto"][0].tolist()),
+            "lateral": float(resultado["lateral"][0]),
+            "tangente": tuple(resultado["tangente"][0].tolist()),
+            "en_carretera": bool(resultado["en_carretera"][0]),
+            "s": float(resultado["s"][0]),
+            "t": float(resultado["t"][0])
+        }
+    
+    def punto_en_longitud(self, s):
+        """Punto de la curva a s unidades de longitud desde el inicio (búsqueda binaria)"""
+        s = min(max(s, 0.0), self.longitud_total)
+        tramo = min(int(np.searchsorted(self.s, s, side="right")) - 1, len(self.longitudes) - 1)
+        u = (s - self.s[tramo]) / max(self.longitudes[tramo], 1e-12)
+        return tuple((self.puntos[tramo] + u * (self.puntos[tramo + 1] - self.puntos[tramo])).tolist())
+
+
+class Arbol(Objeto3D):
+    __slots__ = ()
+    COLUMNAS_COLOR = (1, 2)
+    color_tronco = _propiedad_color(1, "Color del tronco")
+    color_copa = _propiedad_color(2, "Color de la copa")
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.color_tronco = (0.4, 0.2, 0.1)
+        self.color_copa = (0.1, 0.6, 0.2)
+    
+    por_lotes = True
+    proyecta_sombra = True
+    
+    def clave_forma(self):
+        return (self.nivel_detalle,)
+    
+    def colores_partes(self):
+        return [self.color_tronco, self.color_copa]
+    
+    def _esfera_local(self):
+        return (0, 1.5, 0), 1.85
+    
+    def volumen_colision(self):
+        # Solo el tronco: la copa queda por encima del auto
+        return ("circulo", 0.2)
+    
+    def _construir_malla(self):
+        lados, pisos = self.TESELACIONES[self.nivel_detalle]
+        tronco = Malla.cilindro(0.2, 2, lados, parte=0).transformada(matriz_rotacion(-90, 1, 0, 0))
+        copa = Malla.esfera(1, lados, pisos, parte=1).transformada(matriz_traslacion(0, 2, 0))
+        return Malla.combinar([tronco, copa])
+    
+    def _dibujar(self):
+        lados, pisos = self.TESELACIONES[self.nivel_detalle]
+        
+        # Tronco
+        glColor3f(*self.color_tronco)
+        glPushMatrix()
+        glRotatef(-90, 1, 0, 0)
+        glutSolidCylinder(0.2, 2, lados, 1)
+        glPopMatrix()
+        
+        # Copa
+        glColor3f(*self.color_copa)
         glPushMatrix()
         glTranslatef(0, 2, 0)
-        glutSolidSphere(1, 8, 8)
+        glutSolidSphere(1, lados, pisos)
         glPopMatrix()
 
 class Suelo(Objeto3D):
-    def __init__(self, textura=None, **kwargs):
+    def __init__(self, textura=None, tamano=200, **kwargs):
         super().__init__(**kwargs)
         self.textura = textura
+        self.tamano = tamano  # Lado del cuadrado, centrado en la posición
         self.color = (0.5, 0.7, 0.3)  # Verde hierba
     
+    def clave_forma(self):
+        return (self.textura.id if self.textura else None, self.tamano)
+    
+    def estado_render(self):
+        return (self.textura.id if self.textura else None, True, True, False)
+    
     def _dibujar(self):
         if self.textura and self.textura.id:
-            glEnable(GL_TEXTURE_2D)
-            glBindTexture(GL_TEXTURE_2D, self.textura.id)
             glColor3f(1, 1, 1)
         else:
             glColor3f(*self.color)
         
+        # La textura se repite cada 10 unidades
+        mitad = self.tamano / 2
+        repeticiones = self.tamano / 10
         glBegin(GL_QUADS)
-        glTexCoord2f(0, 0); glVertex3f(-100, 0, 100)
-        glTexCoord2f(20, 0); glVertex3f(100, 0, 100)
-        glTexCoord2f(20, 20); glVertex3f(100, 0, -100)
-        glTexCoord2f(0, 20); glVertex3f(-100, 0, -100)
+        glTexCoord2f(0, 0); glVertex3f(-mitad, 0, mitad)
+        glTexCoord2f(repeticiones, 0); glVertex3f(mitad, 0, mitad)
+        glTexCoord2f(repeticiones, repeticiones); glVertex3f(mitad, 0, -mitad)
+        glTexCoord2f(0, repeticiones); glVertex3f(-mitad, 0, -mitad)
         glEnd()
-        
-        if self.textura and self.textura.id:
-            glDisable(GL_TEXTURE_2D)
 
 class Inicial3D(Objeto3D):
     def __init__(self, **kwargs):
@@ -609,9 +1856,10 @@ class Inicial3D(Objeto3D):
         self.color = (1, 1, 0)
         self.grosor = 0.2
     
+    def estado_render(self):
+        return (None, False, False, False)
+    
     def _dibujar(self):
-
-        glDisable(GL_LIGHTING)
         glColor3f(*self.color)
         glLineWidth(5)
         
@@ -683,18 +1931,2081 @@ class Inicial3D(Objeto3D):
         glVertex3f(0.3, 0.1, self.grosor)
         glVertex3f(0.3, 0.1, 0)
         glEnd()
+
+# ------------------------- NIVEL DE DETALLE -------------------------
+class SelectorLOD:
+    """Elige el nivel de detalle de cada objeto según su tamaño en pantalla.
+
+    El tamaño proyectado (en píxeles) se convierte en un nivel continuo; el
+    nivel entero solo cambia cuando ese valor sale del nivel actual con un
+    margen (histéresis), así los objetos no parpadean entre dos niveles.
+    """
+    def __init__(self, histeresis=0.25):
+        self.histeresis = histeresis
+        self.activo = True
+        self.pixeles_teselacion = 10.0  # Tamaño que corresponde al nivel 0 de teselación
+        self.pixeles_fractal = 4.0  # Tamaño mínimo del detalle más pequeño de un fractal
+        self.nivel_maximo_fractal = 6
+    
+    def actualizar(self, objetos, visibles, centros, radios, posicion_camara,
+                   pixeles_por_unidad, perspectiva=True):
+        """Ajusta nivel_detalle (y nivel_lod en fractales) de los objetos visibles"""
+        indices = np.flatnonzero(visibles)
+        if not self.activo or len(indices) == 0:
+            return
         
-        glEnable(GL_LIGHTING)
+        tamanos = 2 * radios[indices] * pixeles_por_unidad
+        if perspectiva:
+            distancias = np.linalg.norm(centros[indices] - posicion_camara, axis=1)
+            tamanos /= np.maximum(distancias, 0.1)
+        
+        maximo_teselacion = len(Objeto3D.TESELACIONES) - 1
+        continuos = np.log2(np.maximum(tamanos, 1e-6) / self.pixeles_teselacion)
+        continuos = np.clip(continuos, 0, maximo_teselacion + 0.999)
+        for i, tamano, continuo in zip(indices, tamanos, continuos):
+            obj = objetos[i]
+            obj.nivel_detalle = self._con_histeresis(obj.nivel_detalle, continuo)
+            if isinstance(obj, Fractal):
+                # Recursión hasta que el detalle más pequeño mida unos pocos píxeles
+                nivel = math.log(max(tamano, 1e-6) / self.pixeles_fractal) / math.log(obj.FACTOR_SUBDIVISION)
+                nivel = min(max(nivel, 0.0), self.nivel_maximo_fractal + 0.999)
+                obj.nivel_lod = self._con_histeresis(obj.nivel_lod, nivel)
+    
+    def _con_histeresis(self, actual, continuo):
+        """Nivel entero para un valor continuo, cambiando solo con margen suficiente"""
+        if actual is None or continuo >= actual + 1 + self.histeresis or continuo < actual - self.histeresis:
+            return int(math.floor(continuo))
+        return actual
+
+
+# ------------------------- CULLING -------------------------
+class Frustum:
+    """Los seis planos de la pirámide de visión, extraídos de proyección * vista"""
+    def __init__(self, matriz):
+        m = np.asarray(matriz, dtype=np.float64)
+        planos = np.array([m[3] + m[0], m[3] - m[0],   # izquierdo, derecho
+                           m[3] + m[1], m[3] - m[1],   # inferior, superior
+                           m[3] + m[2], m[3] - m[2]])  # cercano, lejano
+        planos /= np.linalg.norm(planos[:, :3], axis=1, keepdims=True)
+        self.planos = planos
+    
+    def esferas_visibles(self, centros, radios):
+        """Máscara booleana de las esferas que tocan el frustum"""
+        centros = np.asarray(centros, dtype=np.float64).reshape(-1, 3)
+        distancias = centros @ self.planos[:, :3].T + self.planos[:, 3]
+        return np.all(distancias >= -np.asarray(radios, dtype=np.float64)[:, None], axis=1)
+
+
+# ------------------------- CÁMARA -------------------------
+class Camara:
+    """Cámara que sigue al auto, con sus matrices calculadas en NumPy.
+
+    Las matrices solo se recalculan cuando cambia la pose seguida, el modo de
+    vista o el tamaño de la ventana, y se cargan con glLoadMatrixf. El
+    culling, el LOD y la selección usan estas mismas matrices sin glGet*.
+    La vista va en la matriz de proyección y el modelview queda en la
+    identidad, así que las coordenadas del ojo son las del mundo.
+    """
+    CERCA = 0.1
+    LEJOS_PERSPECTIVA = 200.0
+    LEJOS_ORTOGONAL = 100.0
+    
+    def __init__(self, fov=60, distancia=8, altura=3.0, offset_y=1.5, zoom_ortogonal=45):
+        self.fov = fov
+        self.distancia = distancia
+        self.altura = altura
+        self.offset_y = offset_y  # Altura del punto al que se mira sobre el auto
+        self.zoom_ortogonal = zoom_ortogonal
+        self.modo = 'perspectiva'
+        self.ancho, self.alto = 1, 1
+        self.posicion = (0.0, 0.0, 0.0)
+        self.proyeccion = np.identity(4)
+        self.vista = np.identity(4)
+        self.matriz = np.identity(4)  # Proyección * vista
+        self.matriz_interfaz = np.identity(4)  # Ortogonal en píxeles para la barra (Y hacia abajo)
+        self.recalculos = 0
+        self._clave = None
+        self._clave_interfaz = None
+        self._matriz_gl = np.identity(4, dtype=np.float32)
+        self._interfaz_gl = np.identity(4, dtype=np.float32)
+        self._inversa = None
+        self._frustum = None
+    
+    def actualizar(self, pose, modo, ancho, alto):
+        """Recalcula las matrices si cambió algo; devuelve True si se recalcularon"""
+        clave = (tuple(pose), modo, ancho, alto,
+                 self.fov, self.distancia, self.altura, self.offset_y, self.zoom_ortogonal)
+        if clave == self._clave:
+            return False
+        self._clave = clave
+        self.modo, self.ancho, self.alto = modo, ancho, alto
+        auto_x, auto_y, auto_z, auto_angulo = pose
+        aspecto = ancho / alto
+        
+        if modo == 'perspectiva':
+            self.proyeccion = matriz_perspectiva(self.fov, aspecto, self.CERCA, self.LEJOS_PERSPECTIVA)
+            radianes = math.radians(auto_angulo)
+            self.posicion = (auto_x - math.sin(radianes) * self.distancia,
+                             auto_y + self.altura,
+                             auto_z - math.cos(radianes) * self.distancia)
+            mirar = (auto_x + math.sin(radianes) * 5, auto_y + self.offset_y, auto_z + math.cos(radianes) * 5)
+            self.vista = matriz_mirar(self.posicion, mirar, (0, 1, 0))
+        else:
+            zoom = self.zoom_ortogonal
+            self.proyeccion = matriz_ortogonal(-zoom * aspecto, zoom * aspecto, -zoom, zoom,
+                                               self.CERCA, self.LEJOS_ORTOGONAL)
+            # Posición fija mirando hacia abajo
+            self.posicion = (0.0, 15.0, 0.0)
+            self.vista = matriz_mirar(self.posicion, (0, 0, -1), (0, 1, 0))
+        
+        self.matriz = self.proyeccion @ self.vista
+        # OpenGL espera las matrices por columnas
+        self._matriz_gl = np.ascontiguousarray(self.matriz.T, dtype=np.float32)
+        self._inversa = None
+        self._frustum = None
+        self.recalculos += 1
+        
+        if self._clave_interfaz != (ancho, alto):
+            self._clave_interfaz = (ancho, alto)
+            self.matriz_interfaz = matriz_ortogonal(0, ancho, alto, 0, -1, 1)
+            self._interfaz_gl = np.ascontiguousarray(self.matriz_interfaz.T, dtype=np.float32)
+        return True
+    
+    def aplicar(self):
+        """Carga proyección * vista en GL_PROJECTION y deja el modelview en la identidad"""
+        glMatrixMode(GL_PROJECTION)
+        glLoadMatrixf(self._matriz_gl)
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+    
+    def aplicar_interfaz(self):
+        """Carga en GL_PROJECTION la ortogonal en píxeles (el llamador guarda la anterior)"""
+        glLoadMatrixf(self._interfaz_gl)
+    
+    def inversa(self):
+        """Inversa de proyección * vista (para convertir píxeles en rayos)"""
+        if self._inversa is None:
+            self._inversa = np.linalg.inv(self.matriz)
+        return self._inversa
+    
+    def frustum(self):
+        if self._frustum is None:
+            self._frustum = Frustum(self.matriz)
+        return self._frustum
+    
+    def pixeles_por_unidad(self):
+        """Píxeles que mide una unidad del mundo (a distancia 1 en perspectiva)"""
+        if self.modo == 'perspectiva':
+            return self.alto / (2 * math.tan(math.radians(self.fov) / 2))
+        return self.alto / (2 * self.zoom_ortogonal)
+
+
+# ------------------------- RENDER POR LOTES -------------------------
+class LoteInstancias:
+    """Todas las instancias de una misma malla empaquetadas en un vertex buffer.
+
+    Las transformaciones (posición, rotación, escala) y los colores de las
+    instancias se toman de sus filas de AlmacenEscena y se aplican a la malla
+    con NumPy, de modo que el grupo completo se dibuja con una sola llamada a
+    glDrawArrays.
+    El buffer solo se vuelve a subir cuando entra o sale una instancia o
+    cuando se escribe alguna de sus filas (ver AlmacenEscena.marcar).
+    """
+    # Posición (3), normal (3), color (3) y coordenadas de textura (2)
+    FLOATS_POR_VERTICE = 11
+    
+    def __init__(self, malla, columnas_color=(0,)):
+        self.malla = malla
+        self.columnas_color = np.asarray(columnas_color)  # Columnas de AlmacenEscena.colores por parte
+        self.objetos = []  # Instancias, en el orden del buffer
+        self._indices = {}  # objeto -> posición en self.objetos
+        self._filas = np.zeros(16, dtype=np.intp)  # Fila en el almacén de cada instancia
+        self._subido = -1  # AlmacenEscena.reloj al subir el buffer (-1: hay que subirlo)
+        self.vbo = None
+        self.num_vertices = 0
+        self.version = 0  # Aumenta cada vez que se vuelve a subir el buffer
+    
+    def __len__(self):
+        return len(self.objetos)
+    
+    @property
+    def filas(self):
+        return self._filas[:len(self.objetos)]
+    
+    def agregar(self, obj):
+        self.agregar_lote([obj])
+    
+    def agregar_lote(self, objetos):
+        inicio = len(self.objetos)
+        fin = inicio + len(objetos)
+        if fin > len(self._filas):
+            filas = np.zeros(max(fin, 2 * len(self._filas)), dtype=np.intp)
+            filas[:inicio] = self._filas[:inicio]
+            self._filas = filas
+        self._filas[inicio:fin] = AlmacenEscena.filas_de(objetos)
+        self._indices.update(zip(objetos, range(inicio, fin)))
+        self.objetos.extend(objetos)
+        self._subido = -1
+    
+    def quitar(self, obj):
+        """Quita una instancia en O(1) poniendo la última en su lugar"""
+        indice = self._indices.pop(obj)
+        ultimo = self.objetos.pop()
+        if ultimo is not obj:
+            self.objetos[indice] = ultimo
+            self._indices[ultimo] = indice
+            self._filas[indice] = self._filas[len(self.objetos)]
+        self._subido = -1
+    
+    def actualizar(self):
+        """Vuelve a subir el buffer si cambiaron las instancias o alguna de sus filas"""
+        almacen = Objeto3D.almacen
+        filas = self.filas
+        if self._subido >= 0 and (not len(filas) or almacen.modificada[filas].max() <= self._subido):
+            return
+        self._subido = almacen.reloj
+        transformaciones = almacen.transformaciones[filas].astype(np.float32)
+        if self.malla.textura_id:
+            # El color lo pone la textura (ver Montana.colores_partes)
+            colores = np.ones((len(filas), len(self.columnas_color), 3), dtype=np.float32)
+        else:
+            colores = almacen.colores[filas[:, None], self.columnas_color]
+        
+        datos = self._empaquetar(transformaciones, colores)
+        if self.vbo is None:
+            self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, datos.nbytes, datos, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.num_vertices = len(datos)
+        self.version += 1
+    
+    def _vertices_mundo(self, transformaciones):
+        """Vértices de la malla para cada instancia (N, V, 3), con sus rotaciones y escalas"""
+        posiciones = transformaciones[:, 0:3].astype(np.float64)
+        rotaciones = matrices_rotacion(transformaciones[:, 3:6])
+        escalas = transformaciones[:, 6:9].astype(np.float64)
+        
+        # Escalar, rotar y trasladar cada vértice de cada instancia
+        vertices = self.malla.vertices[None, :, :] * escalas[:, None, :]
+        vertices = np.einsum('nij,nvj->nvi', rotaciones, vertices) + posiciones[:, None, :]
+        return vertices, rotaciones, escalas
+    
+    def _empaquetar(self, transformaciones, colores):
+        vertices, rotaciones, escalas = self._vertices_mundo(transformaciones)
+        
+        # Las normales usan la inversa de la escala (inversa transpuesta de R*S)
+        escalas_seguras = np.where(escalas == 0, 1.0, escalas)
+        normales = self.malla.normales[None, :, :] / escalas_seguras[:, None, :]
+        normales = np.einsum('nij,nvj->nvi', rotaciones, normales)
+        normales /= np.maximum(np.linalg.norm(normales, axis=2, keepdims=True), 1e-12)
+        
+        n, v = len(transformaciones), len(self.malla.vertices)
+        datos = np.empty((n, v, self.FLOATS_POR_VERTICE), dtype=np.float32)
+        datos[:, :, 0:3] = vertices
+        datos[:, :, 3:6] = normales
+        datos[:, :, 6:9] = colores[:, self.malla.partes]
+        datos[:, :, 9:11] = self.malla.texcoords
+        return datos.reshape(-1, self.FLOATS_POR_VERTICE)
+    
+    def dibujar(self, visibles=None):
+        """Dibuja el lote; `visibles` es una máscara opcional por instancia"""
+        if not self.num_vertices:
+            return
+        if visibles is not None:
+            instancias = np.flatnonzero(visibles)
+            if len(instancias) == 0:
+                return
+            if len(instancias) == len(visibles):
+                visibles = None
+        textura_id = self.malla.textura_id
+        Objeto3D.estado_gl.aplicar(self.estado_render())
+        
+        paso = self.FLOATS_POR_VERTICE * 4
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, paso, ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT, paso, ctypes.c_void_p(12))
+        glColorPointer(3, GL_FLOAT, paso, ctypes.c_void_p(24))
+        if textura_id:
+            glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+            glTexCoordPointer(2, GL_FLOAT, paso, ctypes.c_void_p(36))
+        
+        self._dibujar_instancias(None if visibles is None else instancias)
+        
+        if textura_id:
+            glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+    
+    def _dibujar_instancias(self, instancias=None):
+        """Emite las instancias indicadas (todas con None) del buffer ya enlazado"""
+        if instancias is None:
+            glDrawArrays(GL_TRIANGLES, 0, self.num_vertices)
+        else:
+            # Cada instancia ocupa un tramo contiguo del buffer
+            vertices_malla = len(self.malla.vertices)
+            primeros = (instancias * vertices_malla).astype(np.int32)
+            cantidades = np.full(len(instancias), vertices_malla, dtype=np.int32)
+            glMultiDrawArrays(GL_TRIANGLES, primeros, cantidades, len(instancias))
+    
+    def estado_render(self):
+        return (self.malla.textura_id, self.malla.doble_cara, True, False)
+    
+    def liberar(self):
+        if self.vbo is not None:
+            glDeleteBuffers(1, [self.vbo])
+            self.vbo = None
+
+
+class GruposLotes:
+    """Objetos repartidos en lotes según (clase, clave), mantenidos al cambiar la escena.
+
+    Los grupos no se rehacen en cada cuadro: la escena avisa con agregar,
+    quitar y forma_cambiada, y cada lote vuelve a subir su buffer solo si
+    cambiaron sus instancias. Las subclases deciden la clave y el lote.
+    """
+    def __init__(self):
+        self.lotes = {}  # (clase, clave) -> lote
+        self.lote_de = {}  # objeto -> clave de su lote
+    
+    def _clave(self, obj):
+        """Clave del lote del objeto, o None si no va en ningún lote"""
+        raise NotImplementedError("Debes implementar este método en la subclase")
+    
+    def _crear_lote(self, obj):
+        raise NotImplementedError("Debes implementar este método en la subclase")
+    
+    def agregar(self, obj):
+        clave = self._clave(obj)
+        if clave is None:
+            return
+        lote = self.lotes.get(clave)
+        if lote is None:
+            lote = self.lotes[clave] = self._crear_lote(obj)
+        lote.agregar(obj)
+        self.lote_de[obj] = clave
+    
+    def agregar_lote(self, objetos):
+        """Como agregar para muchos objetos; devuelve los que no van en ningún lote"""
+        grupos = {}
+        for obj in objetos:
+            grupos.setdefault(self._clave(obj), []).append(obj)
+        sin_lote = grupos.pop(None, [])
+        for clave, grupo in grupos.items():
+            lote = self.lotes.get(clave)
+            if lote is None:
+                lote = self.lotes[clave] = self._crear_lote(grupo[0])
+            lote.agregar_lote(grupo)
+            self.lote_de.update(dict.fromkeys(grupo, clave))
+        return sin_lote
+    
+    def quitar(self, obj):
+        clave = self.lote_de.pop(obj, None)
+        if clave is None:
+            return
+        lote = self.lotes[clave]
+        lote.quitar(obj)
+        if not len(lote):
+            self.lotes.pop(clave).liberar()
+    
+    def forma_cambiada(self, obj):
+        """Pasa el objeto a otro lote si su clave ya no es la de su lote actual"""
+        if self._clave(obj) != self.lote_de.get(obj):
+            self.quitar(obj)
+            self.agregar(obj)
+    
+    def vaciar(self):
+        for lote in self.lotes.values():
+            lote.liberar()
+        self.lotes.clear()
+        self.lote_de.clear()
+
+
+class RenderizadorLotes(GruposLotes):
+    """Agrupa los objetos de la escena por tipo y forma y los dibuja por lotes"""
+    def __init__(self):
+        super().__init__()
+        self.sueltos = {}  # Objetos que se dibujan uno a uno (como conjunto ordenado)
+        self.activo = True
+    
+    def _clave(self, obj):
+        forma = obj.clave_forma() if obj.por_lotes else None
+        return None if forma is None else (type(obj), forma)
+    
+    def _crear_lote(self, obj):
+        return LoteInstancias(obj._construir_malla(), type(obj).COLUMNAS_COLOR)
+    
+    def agregar(self, obj):
+        super().agregar(obj)
+        if obj not in self.lote_de:
+            self.sueltos[obj] = None
+    
+    def agregar_lote(self, objetos):
+        sin_lote = super().agregar_lote(objetos)
+        self.sueltos.update(dict.fromkeys(sin_lote))
+        return sin_lote
+    
+    def quitar(self, obj):
+        self.sueltos.pop(obj, None)
+        super().quitar(obj)
+    
+    def vaciar(self):
+        super().vaciar()
+        self.sueltos.clear()
+    
+    def dibujar(self, visibles, cola=None):
+        """Dibuja los lotes y devuelve los objetos sueltos visibles.
+
+        `visibles` es una máscara indexada por fila de Objeto3D.almacen; los
+        objetos no visibles siguen en su lote (para no volver a subirlo) pero
+        no se dibujan. Con una ColaRender los lotes se encolan en vez de
+        dibujarse en el momento.
+        """
+        if not self.activo:
+            return [obj for obj in (*self.lote_de, *self.sueltos) if visibles[obj._fila]]
+        for lote in self.lotes.values():
+            lote.actualizar()
+            visibles_lote = visibles[lote.filas]
+            if cola is None:
+                lote.dibujar(visibles_lote)
+            else:
+                cola.agregar(lote.estado_render(), lambda lote=lote, v=visibles_lote: lote.dibujar(v))
+        return [obj for obj in self.sueltos if visibles[obj._fila]]
+
+
+# ------------------------- SOMBRAS -------------------------
+class LoteSombras(LoteInstancias):
+    """Malla de sombra de todas las instancias de un tipo, solo con posiciones en el mundo"""
+    FLOATS_POR_VERTICE = 3
+    
+    def _empaquetar(self, transformaciones, colores):
+        vertices = self._vertices_mundo(transformaciones)[0]
+        return vertices.reshape(-1, 3).astype(np.float32)
+    
+    def dibujar(self, visibles=None):
+        if not self.num_vertices:
+            return
+        instancias = None
+        if visibles is not None:
+            instancias = np.flatnonzero(visibles)
+            if len(instancias) == 0:
+                return
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(0))
+        self._dibujar_instancias(instancias)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+
+class MapaSombras:
+    """Mapa de profundidad visto desde la luz para sombrear toda la escena.
+    
+    La profundidad de los objetos que proyectan sombra se dibuja en una
+    textura de `resolucion`² desde la luz puntual, mirando hacia abajo y
+    cubriendo un círculo de radio `alcance` alrededor de su vertical. Solo
+    se vuelve a dibujar cuando cambia la luz o algún lote de sombras.
+    Después la escena se repite una vez con la textura en la unidad 1:
+    el texgen lleva cada punto del mundo al espacio de la luz, la comparación
+    de profundidad dice si está a la sombra y el combinador de texturas
+    convierte ese resultado en un negro semitransparente.
+    """
+    # Lleva de [-1, 1] (espacio de recorte de la luz) a [0, 1] (coordenadas de textura)
+    SESGO = np.array([[0.5, 0, 0, 0.5], [0, 0.5, 0, 0.5], [0, 0, 0.5, 0.5], [0, 0, 0, 1.0]])
+    
+    def __init__(self, resolucion=1024, alcance=60.0):
+        self.resolucion = resolucion
+        self.alcance = alcance
+        self.textura = None
+        self.fbo = None
+        self.matriz_luz = None  # Proyección * vista de la luz
+        self._firma = None  # (luz, versiones de los lotes) del último mapa dibujado
+        self.renders = 0
+    
+    def _crear(self):
+        self.textura = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.textura)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT24, self.resolucion, self.resolucion, 0,
+                     GL_DEPTH_COMPONENT, GL_UNSIGNED_INT, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        # Fuera del mapa la profundidad es máxima: todo iluminado
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
+        glTexParameterfv(GL_TEXTURE_2D, GL_TEXTURE_BORDER_COLOR, [1.0, 1.0, 1.0, 1.0])
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_COMPARE_MODE, GL_COMPARE_R_TO_TEXTURE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_COMPARE_FUNC, GL_LEQUAL)
+        glTexParameteri(GL_TEXTURE_2D, GL_DEPTH_TEXTURE_MODE, GL_ALPHA)  # 1 iluminado, 0 a la sombra
+        glBindTexture(GL_TEXTURE_2D, 0)
+        
+        anterior = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.textura, 0)
+        glDrawBuffer(GL_NONE)
+        glReadBuffer(GL_NONE)
+        estado = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        glBindFramebuffer(GL_FRAMEBUFFER, anterior)
+        if estado != GL_FRAMEBUFFER_COMPLETE:
+            self.liberar()
+            raise RuntimeError(f"Framebuffer del mapa de sombras incompleto (estado {estado})")
+    
+    def calcular_matriz_luz(self, luz_pos):
+        """Proyección * vista desde la luz, mirando hacia el suelo"""
+        x, y, z = luz_pos[:3]
+        altura = max(y, 0.5)
+        fov = min(2 * math.degrees(math.atan(self.alcance / altura)), 170.0)
+        proyeccion = matriz_perspectiva(fov, 1.0, 0.25, altura + 1.0)
+        vista = matriz_mirar((x, altura, z), (x, 0.0, z), (0.0, 0.0, -1.0))
+        return proyeccion @ vista
+    
+    def actualizar(self, lotes, luz_pos, estado_gl):
+        """Vuelve a dibujar el mapa si cambió la luz o algún lote; devuelve si lo hizo"""
+        if self.fbo is None:
+            self._crear()
+        firma = (tuple(luz_pos), self.resolucion,
+                 tuple((clave, lote.version) for clave, lote in lotes.items()))
+        if firma == self._firma:
+            return False
+        self._firma = firma
+        self.matriz_luz = self.calcular_matriz_luz(luz_pos)
+        
+        anterior = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        vista_anterior = glGetIntegerv(GL_VIEWPORT)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.resolucion, self.resolucion)
+        glClear(GL_DEPTH_BUFFER_BIT)
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadMatrixf(self.matriz_luz.T.astype(np.float32))
+        glMatrixMode(GL_MODELVIEW)
+        
+        # Solo profundidad; el desplazamiento evita que las superficies se sombreen a sí mismas
+        estado_gl.aplicar((None, True, False, False))
+        estado_gl.capacidad(GL_POLYGON_OFFSET_FILL, True)
+        glPolygonOffset(2.0, 4.0)
+        for lote in lotes.values():
+            lote.dibujar()
+        estado_gl.capacidad(GL_POLYGON_OFFSET_FILL, False)
+        
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glBindFramebuffer(GL_FRAMEBUFFER, anterior)
+        glViewport(*vista_anterior)
+        self.renders += 1
+        return True
+    
+    def oscurecer(self, cola, estado_gl, color):
+        """Repite la cola de opacos oscureciendo los puntos que la luz no ve"""
+        # El modelview es la identidad (la vista va en la proyección), así que los
+        # planos del texgen quedan en coordenadas del mundo
+        planos = (self.SESGO @ self.matriz_luz).astype(np.float32)
+        glActiveTexture(GL_TEXTURE1)
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, self.textura)
+        for coordenada, generador, plano in zip((GL_S, GL_T, GL_R, GL_Q),
+                                                (GL_TEXTURE_GEN_S, GL_TEXTURE_GEN_T,
+                                                 GL_TEXTURE_GEN_R, GL_TEXTURE_GEN_Q), planos):
+            glTexGeni(coordenada, GL_TEXTURE_GEN_MODE, GL_EYE_LINEAR)
+            glTexGenfv(coordenada, GL_EYE_PLANE, plano)
+            glEnable(generador)
+        # Color constante; alfa = alfa constante * (1 - iluminado)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_COMBINE)
+        glTexEnvfv(GL_TEXTURE_ENV, GL_TEXTURE_ENV_COLOR, color)
+        glTexEnvi(GL_TEXTURE_ENV, GL_COMBINE_RGB, GL_REPLACE)
+        glTexEnvi(GL_TEXTURE_ENV, GL_SOURCE0_RGB, GL_CONSTANT)
+        glTexEnvi(GL_TEXTURE_ENV, GL_OPERAND0_RGB, GL_SRC_COLOR)
+        glTexEnvi(GL_TEXTURE_ENV, GL_COMBINE_ALPHA, GL_MODULATE)
+        glTexEnvi(GL_TEXTURE_ENV, GL_SOURCE0_ALPHA, GL_CONSTANT)
+        glTexEnvi(GL_TEXTURE_ENV, GL_OPERAND0_ALPHA, GL_SRC_ALPHA)
+        glTexEnvi(GL_TEXTURE_ENV, GL_SOURCE1_ALPHA, GL_TEXTURE)
+        glTexEnvi(GL_TEXTURE_ENV, GL_OPERAND1_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glActiveTexture(GL_TEXTURE0)
+        
+        # Misma geometría que la primera pasada: pasa con GL_LEQUAL sin escribir profundidad
+        estado_gl.fijar(GL_BLEND, True)
+        estado_gl.fijar(GL_LIGHTING, False)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glDepthFunc(GL_LEQUAL)
+        glDepthMask(GL_FALSE)
+        cola.ejecutar(estado_gl)
+        glDepthMask(GL_TRUE)
+        glDepthFunc(GL_LESS)
+        estado_gl.soltar()
+        estado_gl.capacidad(GL_BLEND, False)
+        
+        glActiveTexture(GL_TEXTURE1)
+        for generador in (GL_TEXTURE_GEN_S, GL_TEXTURE_GEN_T, GL_TEXTURE_GEN_R, GL_TEXTURE_GEN_Q):
+            glDisable(generador)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glDisable(GL_TEXTURE_2D)
+        glActiveTexture(GL_TEXTURE0)
+    
+    def liberar(self):
+        if self.fbo is not None:
+            glDeleteFramebuffers(1, [self.fbo])
+            self.fbo = None
+        if self.textura is not None:
+            glDeleteTextures([self.textura])
+            self.textura = None
+        self._firma = None
+
+
+class SistemaSombras(GruposLotes):
+    """Sombras de todos los objetos, proyectadas desde la luz.
+    
+    Las mallas simplificadas de cada tipo se guardan ya transformadas al mundo
+    en un LoteSombras, que solo se vuelve a subir cuando una instancia cambia
+    (los grupos se mantienen como en RenderizadorLotes);
+    en cada cuadro basta con una matriz de proyección hacia el plano del suelo
+    y una llamada de dibujo por tipo. En modo "stencil" cada píxel se oscurece
+    una sola vez aunque se solapen varias sombras. En modo "mapa" los mismos
+    lotes se dibujan en un MapaSombras y las sombras caen también sobre los
+    objetos.
+    """
+    MODOS = ("plano", "stencil", "mapa")
+    ALTURA = 0.03  # Justo por encima de las marcas viales
+    COLOR = (0.0, 0.0, 0.0, 0.4)
+    
+    def __init__(self, modo="plano", resolucion=1024):
+        super().__init__()  # lotes: (clase, clave_sombra) -> LoteSombras
+        self.modo = modo
+        self.mapa = MapaSombras(resolucion)
+        self._stencil_disponible = None
+    
+    @classmethod
+    def matriz_proyeccion(cls, luz_pos):
+        """Matriz 4x4 que aplasta cada punto sobre el plano y=ALTURA desde la luz puntual"""
+        plano = np.array([0.0, 1.0, 0.0, -cls.ALTURA])
+        luz = np.asarray(luz_pos, dtype=np.float64)
+        return np.dot(plano, luz) * np.identity(4) - np.outer(luz, plano)
+    
+    def _usar_stencil(self):
+        if self.modo != "stencil":
+            return False
+        if self._stencil_disponible is None:
+            self._stencil_disponible = glGetIntegerv(GL_STENCIL_BITS) > 0
+            if not self._stencil_disponible:
+                print("El framebuffer no tiene stencil: sombras en modo plano")
+        return self._stencil_disponible
+    
+    def _clave(self, obj):
+        return (type(obj), obj.clave_sombra()) if obj.proyecta_sombra else None
+    
+    def _crear_lote(self, obj):
+        return LoteSombras(obj._construir_malla_sombra())
+    
+    def _actualizar_lotes(self, visibles, luz_pos):
+        """Sube los lotes que cambiaron y devuelve la máscara de instancias a dibujar de cada uno"""
+        transformaciones = Objeto3D.almacen.transformaciones
+        mascaras = {}
+        for clave, lote in self.lotes.items():
+            lote.actualizar()
+            filas = lote.filas
+            # Solo proyectan los objetos visibles por debajo de la luz
+            mascaras[clave] = visibles[filas] & (transformaciones[filas, 1] < luz_pos[1])
+        return mascaras
+    
+    def dibujar(self, visibles, luz_pos, estado_gl, cola=None):
+        """Dibuja las sombras; el modo "mapa" repite la cola de opacos del cuadro.
+
+        `visibles` es una máscara indexada por fila de Objeto3D.almacen.
+        """
+        mascaras = self._actualizar_lotes(visibles, luz_pos)
+        if self.modo == "mapa" and cola is not None:
+            try:
+                self.mapa.actualizar(self.lotes, luz_pos, estado_gl)
+            except (RuntimeError, GLError) as error:
+                print(f"Mapa de sombras no disponible ({error}): sombras en modo plano")
+                self.modo = "plano"
+            else:
+                self.mapa.oscurecer(cola, estado_gl, self.COLOR)
+                return
+        if not mascaras:
+            return
+        
+        # Estado común a todas las sombras: sin textura ni luz, semitransparentes
+        estado_gl.aplicar((None, False, False, True))
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        estado_gl.capacidad(GL_POLYGON_OFFSET_FILL, True)  # Evitar z-fighting con el suelo
+        glPolygonOffset(-1.0, -1.0)
+        glDepthMask(GL_FALSE)
+        glColor4f(*self.COLOR)
+        stencil = self._usar_stencil()
+        if stencil:
+            glClear(GL_STENCIL_BUFFER_BIT)
+            estado_gl.capacidad(GL_STENCIL_TEST, True)
+            glStencilFunc(GL_EQUAL, 0, 0xFF)
+            glStencilOp(GL_KEEP, GL_KEEP, GL_INCR)
+        
+        glPushMatrix()
+        glMultMatrixf(self.matriz_proyeccion(luz_pos).T.astype(np.float32))
+        for clave, mascara in mascaras.items():
+            self.lotes[clave].dibujar(mascara)
+        glPopMatrix()
+        
+        if stencil:
+            estado_gl.capacidad(GL_STENCIL_TEST, False)
+        glDepthMask(GL_TRUE)
+        estado_gl.capacidad(GL_POLYGON_OFFSET_FILL, False)
+        estado_gl.capacidad(GL_BLEND, False)
+    
+    def liberar(self):
+        self.vaciar()
+        self.mapa.liberar()
+
+
+# ------------------------- ÍNDICE ESPACIAL -------------------------
+class IndiceEspacial:
+    """Rejilla uniforme sobre el plano XZ para buscar objetos por cercanía.
+
+    Cada objeto se guarda en la celda que contiene su posición, así que una
+    búsqueda en un radio solo revisa las celdas que toca ese radio.
+    radio_maximo es la mayor distancia de la posición de un objeto a su
+    esfera envolvente (solo crece), para buscar objetos grandes desde lejos.
+    """
+    def __init__(self, tamano_celda=8.0):
+        self.tamano_celda = tamano_celda
+        self.celdas = {}  # (i, j) -> set de objetos
+        self.celda_de = {}  # objeto -> (i, j)
+        self.radio_maximo = 0.0
+    
+    def __len__(self):
+        return len(self.celda_de)
+    
+    def _celda(self, x, z):
+        return (math.floor(x / self.tamano_celda), math.floor(z / self.tamano_celda))
+    
+    @staticmethod
+    def _alcance(objeto):
+        centro, radio = objeto.esfera_envolvente()
+        return radio + math.dist(centro, objeto.posicion)
+    
+    def agregar(self, objeto):
+        self.radio_maximo = max(self.radio_maximo, self._alcance(objeto))
+        celda = self._celda(objeto.posicion[0], objeto.posicion[2])
+        self.celdas.setdefault(celda, set()).add(objeto)
+        self.celda_de[objeto] = celda
+    
+    def agregar_lote(self, objetos):
+        """Añade muchos objetos calculando sus celdas con NumPy"""
+        if not objetos:
+            return
+        filas = AlmacenEscena.filas_de(objetos)
+        centros, radios = Objeto3D.almacen.esferas_de(objetos, filas)
+        posiciones = Objeto3D.almacen.transformaciones[filas, 0:3]
+        alcances = radios + np.linalg.norm(centros - posiciones, axis=1)
+        self.radio_maximo = max(self.radio_maximo, float(alcances.max()))
+        celdas = np.floor(posiciones[:, [0, 2]] / self.tamano_celda).astype(np.int64)
+        for obj, celda in zip(objetos, map(tuple, celdas.tolist())):
+            self.celdas.setdefault(celda, set()).add(obj)
+            self.celda_de[obj] = celda
+    
+    def quitar(self, objeto):
+        celda = self.celda_de.pop(objeto, None)
+        if celda is None:
+            return
+        ocupantes = self.celdas[celda]
+        ocupantes.discard(objeto)
+        if not ocupantes:
+            del self.celdas[celda]
+    
+    def mover(self, objeto):
+        """Actualiza la celda de un objeto cuya posición (o tamaño) cambió"""
+        self.radio_maximo = max(self.radio_maximo, self._alcance(objeto))
+        celda = self._celda(objeto.posicion[0], objeto.posicion[2])
+        if self.celda_de.get(objeto) != celda:
+            self.quitar(objeto)
+            self.agregar(objeto)
+    
+    def cerca(self, x, z, radio):
+        """Objetos de las celdas que tocan el círculo (x, z, radio)"""
+        i_min, j_min = self._celda(x - radio, z - radio)
+        i_max, j_max = self._celda(x + radio, z + radio)
+        for i in range(i_min, i_max + 1):
+            for j in range(j_min, j_max + 1):
+                yield from self.celdas.get((i, j), ())
+
+
+# ------------------------- SELECCIÓN -------------------------
+class SeleccionRayos:
+    """Picking con rayos calculados en NumPy, sin leer nada de la GPU.
+
+    Un clic se convierte en un rayo con la inversa de proyección * vista de la
+    Camara (la del último cuadro dibujado) y se intersecta con el
+    suelo (para colocar objetos) o con los objetos cercanos al rayo en el
+    índice espacial: primero sus esferas envolventes y después los triángulos
+    de su malla, así que el objeto elegido es el que de verdad está bajo el
+    cursor.
+    """
+    def __init__(self, camara):
+        self.camara = camara
+        self._mallas = {}  # (clase, clave_sombra) -> vértices (T, 3, 3) de la malla de selección
+
+    def rayo(self, x, y):
+        """Origen (en el plano cercano), dirección unitaria y largo hasta el plano lejano
+        del rayo que pasa por el píxel (x, y) de la ventana"""
+        camara = self.camara
+        if camara.recalculos == 0:
+            return None
+        inversa = camara.inversa()
+        ndc_x = 2.0 * (x + 0.5) / camara.ancho - 1.0
+        ndc_y = 1.0 - 2.0 * (y + 0.5) / camara.alto
+        cerca = inversa @ (ndc_x, ndc_y, -1.0, 1.0)
+        lejos = inversa @ (ndc_x, ndc_y, 1.0, 1.0)
+        cerca, lejos = cerca[:3] / cerca[3], lejos[:3] / lejos[3]
+        direccion = lejos - cerca
+        largo = float(np.linalg.norm(direccion))
+        return cerca, direccion / largo, largo
+
+    @staticmethod
+    def _distancia_suelo(origen, direccion, altura=0.0):
+        if abs(direccion[1]) < 1e-12:
+            return None
+        t = (altura - origen[1]) / direccion[1]
+        return t if t >= 0 else None
+
+    def punto_suelo(self, x, y, altura=0.0):
+        """Punto del plano y = altura bajo el cursor, o None si el rayo no lo toca"""
+        rayo = self.rayo(x, y)
+        if rayo is None:
+            return None
+        origen, direccion, largo = rayo
+        t = self._distancia_suelo(origen, direccion, altura)
+        if t is None or t > largo:
+            return None
+        return tuple((origen + t * direccion).tolist())
+
+    def objeto_en(self, x, y, indice):
+        """Objeto más cercano que toca el rayo del píxel (x, y) y su distancia, o (None, None).
+
+        El suelo tapa lo que quede por debajo de él.
+        """
+        rayo = self.rayo(x, y)
+        if rayo is None:
+            return None, None
+        origen, direccion, largo = rayo
+        t_suelo = self._distancia_suelo(origen, direccion)
+        limite = largo if t_suelo is None else min(largo, t_suelo)
+
+        candidatos = self._candidatos(origen, direccion, limite, indice)
+        if not candidatos:
+            return None, None
+        esferas = [obj.esfera_envolvente() for obj in candidatos]
+        centros = np.array([centro for centro, radio in esferas], dtype=np.float64)
+        radios = np.array([radio for centro, radio in esferas], dtype=np.float64)
+
+        # Rayo contra las esferas envolventes: distancia de entrada de cada una
+        hacia_centro = centros - origen
+        proyeccion = hacia_centro @ direccion
+        distancia2 = np.einsum('ij,ij->i', hacia_centro, hacia_centro) - proyeccion * proyeccion
+        cruza = distancia2 <= radios * radios
+        mitad_cuerda = np.sqrt(np.maximum(radios * radios - distancia2, 0.0))
+        entrada = np.maximum(proyeccion - mitad_cuerda, 0.0)
+        cruza &= (proyeccion + mitad_cuerda >= 0) & (entrada <= limite)
+
+        # Mallas en orden de entrada hasta que la esfera siguiente empieza detrás del mejor impacto
+        mejor, mejor_t = None, limite
+        for i in np.flatnonzero(cruza)[np.argsort(entrada[cruza])].tolist():
+            if entrada[i] >= mejor_t:
+                break
+            t = self._distancia_malla(candidatos[i], origen, direccion)
+            if t is not None and t < mejor_t:
+                mejor, mejor_t = candidatos[i], t
+        return (mejor, mejor_t) if mejor is not None else (None, None)
+
+    @staticmethod
+    def _candidatos(origen, direccion, limite, indice):
+        """Objetos del índice cuya esfera envolvente puede tocar el tramo del rayo"""
+        # Se recorre la proyección del tramo sobre XZ en pasos de una celda
+        paso = indice.tamano_celda
+        horizontal = math.hypot(direccion[0], direccion[2]) * limite
+        pasos = int(horizontal // paso) + 1
+        alcance = paso / 2 + indice.radio_maximo
+        vistos = {}
+        for k in range(pasos + 1):
+            t = limite * min(k * paso / horizontal, 1.0) if horizontal > 0 else 0.0
+            for obj in indice.cerca(origen[0] + direccion[0] * t, origen[2] + direccion[2] * t, alcance):
+                vistos[obj] = None
+        return list(vistos)
+
+    def _distancia_malla(self, objeto, origen, direccion):
+        """Distancia a lo largo del rayo al primer triángulo del objeto (None si no lo toca)"""
+        clave = objeto.clave_sombra()
+        triangulos = self._mallas.get((type(objeto), clave)) if clave is not None else None
+        if triangulos is None:
+            malla = objeto.malla_seleccion()
+            if malla is None:
+                # Sin malla basta con la esfera envolvente
+                centro, radio = objeto.esfera_envolvente()
+                hacia_centro = np.asarray(centro) - origen
+                proyeccion = float(hacia_centro @ direccion)
+                distancia2 = float(hacia_centro @ hacia_centro) - proyeccion * proyeccion
+                if distancia2 > radio * radio:
+                    return None
+                return max(proyeccion - math.sqrt(radio * radio - distancia2), 0.0)
+            triangulos = malla.vertices.astype(np.float64).reshape(-1, 3, 3)
+            if clave is not None:
+                self._mallas[(type(objeto), clave)] = triangulos
+
+        # El rayo pasa a coordenadas locales (la t es la misma porque la transformación es afín)
+        inversa = np.linalg.inv(objeto.matriz_modelo())
+        origen_local = inversa[:3, :3] @ origen + inversa[:3, 3]
+        direccion_local = inversa[:3, :3] @ direccion
+
+        # Möller-Trumbore para todos los triángulos a la vez (sin descartar caras traseras)
+        a = triangulos[:, 0]
+        borde1 = triangulos[:, 1] - a
+        borde2 = triangulos[:, 2] - a
+        p = np.cross(direccion_local, borde2)
+        determinante = np.einsum('ij,ij->i', borde1, p)
+        valido = np.abs(determinante) > 1e-12
+        inverso = np.where(valido, 1.0 / np.where(valido, determinante, 1.0), 0.0)
+        s = origen_local - a
+        u = np.einsum('ij,ij->i', s, p) * inverso
+        q = np.cross(s, borde1)
+        v = (q @ direccion_local) * inverso
+        t = np.einsum('ij,ij->i', borde2, q) * inverso
+        toca = valido & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+        if not toca.any():
+            return None
+        return float(t[toca].min())
+
+
+# ------------------------- COLISIONES -------------------------
+class CuerposColision:
+    """Volúmenes de colisión del plano XZ en arreglos, con una rejilla ordenada.
+
+    Cada cuerpo es una caja orientada (centro, eje X local y semiejes) o un
+    círculo (centro y radio en semiejes[:, 0]). La rejilla es la lista de
+    claves de celda ordenada, así que los cuerpos de una celda se encuentran
+    con una búsqueda binaria: construirla cuesta O(n log n) y consultar m
+    puntos O(m log n) más los pares encontrados.
+    """
+    def __init__(self, centros, ejes, semiejes, circulos, tamano_celda_minimo=8.0):
+        self.centros = np.asarray(centros, dtype=np.float64).reshape(-1, 2)
+        self.ejes = np.asarray(ejes, dtype=np.float64).reshape(-1, 2)
+        self.semiejes = np.asarray(semiejes, dtype=np.float64).reshape(-1, 2)
+        self.circulos = np.asarray(circulos, dtype=bool).reshape(-1)
+        self.radios = np.where(self.circulos, self.semiejes[:, 0],
+                               np.hypot(self.semiejes[:, 0], self.semiejes[:, 1]))
+        self.radio_maximo = float(self.radios.max()) if len(self.radios) else 0.0
+        # Con celdas de al menos dos radios, un cuerpo solo puede tocar las celdas vecinas de la suya
+        self.tamano_celda = max(tamano_celda_minimo, 2 * self.radio_maximo)
+        celdas = np.floor(self.centros / self.tamano_celda).astype(np.int64)
+        claves = self._claves(celdas[:, 0], celdas[:, 1])
+        self.orden = np.argsort(claves, kind="stable")
+        self.claves = claves[self.orden]
+
+    def __len__(self):
+        return len(self.centros)
+
+    @staticmethod
+    def _claves(i, j):
+        return i * (1 << 32) + j
+
+    @classmethod
+    def de_cajas(cls, x, z, angulos, semiejes):
+        """Cajas orientadas con el ángulo de giro en Y (grados) de cada una"""
+        radianes = np.radians(angulos)
+        ejes = np.stack([np.cos(radianes), -np.sin(radianes)], axis=1)
+        return cls(np.stack([x, z], axis=1), ejes, semiejes, np.zeros(len(radianes), dtype=bool))
+
+    def candidatos(self, x, z, radios):
+        """Pares (consulta, cuerpo) cuyos círculos envolventes se tocan"""
+        if not len(self) or not len(x):
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        alcance = radios + self.radio_maximo
+        i_min = np.floor((x - alcance) / self.tamano_celda).astype(np.int64)
+        j_min = np.floor((z - alcance) / self.tamano_celda).astype(np.int64)
+        i_max = np.floor((x + alcance) / self.tamano_celda).astype(np.int64)
+        j_max = np.floor((z + alcance) / self.tamano_celda).astype(np.int64)
+
+        # Todas las celdas de cada consulta (como mucho filas x columnas)
+        filas = int((i_max - i_min).max()) + 1
+        columnas = int((j_max - j_min).max()) + 1
+        i = i_min[:, None, None] + np.arange(filas)[None, :, None]
+        j = j_min[:, None, None] + np.arange(columnas)[None, None, :]
+        validas = (i <= i_max[:, None, None]) & (j <= j_max[:, None, None])
+        consultas = np.broadcast_to(np.arange(len(x))[:, None, None], validas.shape)[validas]
+        claves = self._claves(i, j)[validas]
+
+        inicio = np.searchsorted(self.claves, claves, side="left")
+        cuenta = np.searchsorted(self.claves, claves, side="right") - inicio
+        consultas = np.repeat(consultas, cuenta)
+        # Índices inicio..inicio+cuenta de cada celda, concatenados
+        desplazamientos = np.arange(cuenta.sum()) - np.repeat(np.cumsum(cuenta) - cuenta, cuenta)
+        cuerpos = self.orden[np.repeat(inicio, cuenta) + desplazamientos]
+
+        dx = self.centros[cuerpos, 0] - x[consultas]
+        dz = self.centros[cuerpos, 1] - z[consultas]
+        limite = radios[consultas] + self.radios[cuerpos]
+        cerca = dx * dx + dz * dz < limite * limite
+        return consultas[cerca], cuerpos[cerca]
+
+
+class SistemaColisiones:
+    """Choques de los autos (cajas orientadas) con los objetos de la escena.
+
+    La fase amplia busca en CuerposColision los cuerpos cercanos a cada auto y la
+    fase estrecha calcula con NumPy, para todos los pares a la vez, la normal y
+    la profundidad de contacto (ejes separadores entre cajas y punto más cercano
+    para los círculos). Cada auto se saca del obstáculo a lo largo de la normal
+    y su rapidez se limita a la parte de la velocidad máxima paralela al
+    obstáculo: de frente se detiene y en un roce se desliza más despacio.
+    """
+    def __init__(self, tamano_celda=8.0):
+        self.tamano_celda = tamano_celda
+        self.activo = True
+        self.estaticos = None  # CuerposColision de los objetos que no se mueven
+        self._sucio = True
+
+    def invalidar(self):
+        """Los objetos de la escena cambiaron: reconstruir los cuerpos estáticos"""
+        self._sucio = True
+
+    def preparar(self, objetos, excluir=()):
+        """Reconstruye los cuerpos estáticos si hace falta (los de `excluir` se mueven)"""
+        if not self._sucio:
+            return
+        centros, ejes, semiejes, circulos = [], [], [], []
+        for obj in objetos:
+            volumen = obj.volumen_colision()
+            if volumen is None or obj in excluir:
+                continue
+            escala_x, escala_z = abs(obj.escala[0]), abs(obj.escala[2])
+            if volumen[0] == "circulo":
+                semiejes.append((volumen[1] * max(escala_x, escala_z), 0.0))
+                circulos.append(True)
+            else:
+                semiejes.append((volumen[1] * escala_x, volumen[2] * escala_z))
+                circulos.append(False)
+            centros.append((obj.posicion[0], obj.posicion[2]))
+            radianes = math.radians(obj.rotacion[1])
+            ejes.append((math.cos(radianes), -math.sin(radianes)))
+        self.estaticos = CuerposColision(centros, ejes, semiejes, circulos, self.tamano_celda)
+        self._sucio = False
+
+    @staticmethod
+    def _contactos(centros_a, ejes_a, semiejes_a, centros_b, ejes_b, semiejes_b, circulos_b):
+        """Para cada par (caja A, cuerpo B): si se tocan, normal hacia A y profundidad"""
+        eje_z_a = np.stack([-ejes_a[:, 1], ejes_a[:, 0]], axis=1)
+        d = centros_b - centros_a
+        pares = len(d)
+        toca = np.zeros(pares, dtype=bool)
+        normales = np.zeros((pares, 2))
+        profundidades = np.zeros(pares)
+
+        cajas = np.flatnonzero(~circulos_b)
+        if len(cajas):
+            ua, va, ha = ejes_a[cajas], eje_z_a[cajas], semiejes_a[cajas]
+            ub, hb = ejes_b[cajas], semiejes_b[cajas]
+            vb = np.stack([-ub[:, 1], ub[:, 0]], axis=1)
+            ejes = np.stack([ua, va, ub, vb], axis=1)  # (P, 4, 2) ejes separadores candidatos
+            def radio_en_ejes(u, v, h):
+                return (h[:, 0:1] * np.abs(np.einsum('pk,pek->pe', u, ejes))
+                        + h[:, 1:2] * np.abs(np.einsum('pk,pek->pe', v, ejes)))
+            distancia = np.einsum('pk,pek->pe', d[cajas], ejes)
+            solape = radio_en_ejes(ua, va, ha) + radio_en_ejes(ub, vb, hb) - np.abs(distancia)
+            minimo = np.argmin(solape, axis=1)
+            filas = np.arange(len(cajas))
+            signo = np.where(distancia[filas, minimo] > 0, -1.0, 1.0)
+            toca[cajas] = (solape > 0).all(axis=1)
+            normales[cajas] = ejes[filas, minimo] * signo[:, None]
+            profundidades[cajas] = solape[filas, minimo]
+
+        circulos = np.flatnonzero(circulos_b)
+        if len(circulos):
+            ua, va, ha = ejes_a[circulos], eje_z_a[circulos], semiejes_a[circulos]
+            radio = semiejes_b[circulos, 0]
+            # Centro del círculo en coordenadas de la caja y su punto más cercano de la caja
+            local = np.stack([np.sum(d[circulos] * ua, axis=1), np.sum(d[circulos] * va, axis=1)], axis=1)
+            diferencia = local - np.clip(local, -ha, ha)
+            distancia = np.hypot(diferencia[:, 0], diferencia[:, 1])
+            fuera = distancia > 1e-9
+            normal_local = -diferencia / np.maximum(distancia, 1e-9)[:, None]
+            profundidad = radio - distancia
+            # Con el centro dentro de la caja se sale por el lado más cercano
+            dentro = np.flatnonzero(~fuera)
+            if len(dentro):
+                margen = ha[dentro] - np.abs(local[dentro])
+                eje = np.argmin(margen, axis=1)
+                normal_local[dentro] = 0.0
+                normal_local[dentro, eje] = np.where(local[dentro, eje] > 0, -1.0, 1.0)
+                profundidad[dentro] = margen[np.arange(len(dentro)), eje] + radio[dentro]
+            toca[circulos] = profundidad > 0
+            normales[circulos] = normal_local[:, 0:1] * ua + normal_local[:, 1:2] * va
+            profundidades[circulos] = profundidad
+        return toca, normales, profundidades
+
+    def resolver(self, x, z, angulos, velocidades, semiejes, dinamicos=None, velocidad_maxima=0.25):
+        """Separa los autos de lo que tocan y limita su velocidad.
+
+        x, z y velocidades se modifican en su sitio; `dinamicos` son otros
+        CuerposColision que se mueven (por ejemplo los demás autos).
+        Devuelve el número de contactos.
+        """
+        if not self.activo or len(x) == 0:
+            return 0
+        radianes = np.radians(angulos)
+        ejes = np.stack([np.cos(radianes), -np.sin(radianes)], axis=1)
+        centros = np.stack([x, z], axis=1)
+        radios = np.hypot(semiejes[:, 0], semiejes[:, 1])
+        correccion = np.zeros((len(x), 2))
+        factor = np.ones(len(x))
+        contactos = 0
+        for cuerpos in (self.estaticos, dinamicos):
+            if cuerpos is None:
+                continue
+            a, b = cuerpos.candidatos(x, z, radios)
+            if not len(a):
+                continue
+            toca, normales, profundidades = self._contactos(
+                centros[a], ejes[a], semiejes[a],
+                cuerpos.centros[b], cuerpos.ejes[b], cuerpos.semiejes[b], cuerpos.circulos[b])
+            a, normales, profundidades = a[toca], normales[toca], profundidades[toca]
+            contactos += len(a)
+            np.add.at(correccion, a, normales * profundidades[:, None])
+            # Solo avanza la parte del movimiento paralela al obstáculo; el límite no
+            # depende de la velocidad actual para que un roce largo no la anule
+            direccion = np.stack([np.sin(radianes[a]), np.cos(radianes[a])], axis=1)
+            direccion *= np.sign(velocidades[a])[:, None]
+            contra = np.clip(-np.sum(direccion * normales, axis=1), 0.0, 1.0)
+            np.minimum.at(factor, a, np.sqrt(1.0 - contra * contra))
+        if contactos:
+            x += correccion[:, 0]
+            z += correccion[:, 1]
+            limite = factor * velocidad_maxima
+            np.clip(velocidades, -limite, limite, out=velocidades)
+        return contactos
+
+
+# ------------------------- SIMULACIÓN -------------------------
+class BucleSimulacion:
+    """Acumulador de paso fijo: la física avanza en pasos de dt sin depender de los FPS.
+
+    El tiempo real transcurrido se acumula y se consume en pasos enteros; lo que
+    sobra queda como fracción (alfa) para interpolar entre los dos últimos estados
+    al dibujar. max_pasos limita la recuperación tras una pausa larga.
+    """
+    def __init__(self, paso, dt, max_pasos=8):
+        self.paso = paso
+        self.dt = dt
+        self.max_pasos = max_pasos
+        self.acumulado = 0.0
+        self.alfa = 1.0
+        self.pasos_totales = 0
+        self._ultimo_tiempo = None
+    
+    def avanzar(self, transcurrido):
+        """Consume transcurrido segundos en pasos fijos y devuelve cuántos se dieron"""
+        self.acumulado += transcurrido
+        pasos = 0
+        while self.acumulado >= self.dt and (self.max_pasos is None or pasos < self.max_pasos):
+            self.paso()
+            self.acumulado -= self.dt
+            pasos += 1
+        if self.acumulado >= self.dt:
+            # Demasiado atraso: se descarta en lugar de intentar alcanzarlo
+            self.acumulado %= self.dt
+        self.alfa = self.acumulado / self.dt
+        self.pasos_totales += pasos
+        return pasos
+    
+    def avanzar_tiempo_real(self):
+        ahora = time.perf_counter()
+        transcurrido = 0.0 if self._ultimo_tiempo is None else ahora - self._ultimo_tiempo
+        self._ultimo_tiempo = ahora
+        return self.avanzar(transcurrido)
+    
+    def ejecutar_pasos(self, cantidad):
+        """Da pasos sin dibujar, para ejecuciones por lotes"""
+        for _ in range(cantidad):
+            self.paso()
+        self.pasos_totales += cantidad
+        self.alfa = 1.0
+
+
+# ------------------------- VEHÍCULOS -------------------------
+class SimulacionVehiculos:
+    """Estado de muchos autos en arreglos NumPy (uno por variable) que avanzan juntos.
+
+    Cada paso aplica a todos los autos a la vez las mismas reglas de aceleración,
+    fricción y giro que Escena.actualizar_auto. Las teclas de cada auto son arreglos
+    booleanos que puede escribir una IA o una repetición grabada.
+    """
+    VELOCIDAD_MAXIMA = 0.25
+    VELOCIDAD_MINIMA = -0.15
+    
+    def __init__(self, aceleracion, velocidad_rotacion, friccion, friccion_angular,
+                 friccion_cesped=1.0, capacidad=64):
+        self.aceleracion = aceleracion
+        self.velocidad_rotacion = velocidad_rotacion
+        self.friccion = friccion
+        self.friccion_angular = friccion_angular
+        self.friccion_cesped = friccion_cesped
+        self.cantidad = 0
+        self.objetos = []  # Auto de la escena de cada fila
+        self._filas = {}  # objeto -> fila
+        self._reservar(capacidad)
+    
+    def _reservar(self, capacidad):
+        anteriores = getattr(self, "x", None)
+        nuevos = {}
+        for nombre in ("x", "y", "z", "angulo", "velocidad", "velocidad_angular",
+                       "x_anterior", "z_anterior", "angulo_anterior", "semieje_x", "semieje_z"):
+            nuevos[nombre] = np.zeros(capacidad, dtype=np.float64)
+        for nombre in ("arriba", "abajo", "izquierda", "derecha"):
+            nuevos[nombre] = np.zeros(capacidad, dtype=bool)
+        for nombre in ("celda_i", "celda_j", "fila_almacen"):
+            nuevos[nombre] = np.zeros(capacidad, dtype=np.int64)
+        for nombre, arreglo in nuevos.items():
+            if anteriores is not None:
+                arreglo[:self.cantidad] = getattr(self, nombre)[:self.cantidad]
+            setattr(self, nombre, arreglo)
+    
+    def __len__(self):
+        return self.cantidad
+    
+    def __contains__(self, objeto):
+        return objeto in self._filas
+    
+    def agregar(self, objeto, angulo=0.0):
+        """Registra un auto de la escena y devuelve su fila"""
+        if self.cantidad == len(self.x):
+            self._reservar(2 * len(self.x))
+        fila = self.cantidad
+        x, y, z = objeto.posicion
+        for nombre, valor in (("x", x), ("y", y), ("z", z), ("angulo", angulo),
+                              ("velocidad", 0.0), ("velocidad_angular", 0.0),
+                              ("x_anterior", x), ("z_anterior", z), ("angulo_anterior", angulo),
+                              ("semieje_x", objeto.ancho / 2), ("semieje_z", objeto.largo / 2),
+                              ("arriba", False), ("abajo", False),
+                              ("izquierda", False), ("derecha", False),
+                              ("celda_i", np.iinfo(np.int64).min), ("celda_j", 0),
+                              ("fila_almacen", objeto._fila)):
+            getattr(self, nombre)[fila] = valor
+        self.objetos.append(objeto)
+        self._filas[objeto] = fila
+        self.cantidad += 1
+        return fila
+    
+    def quitar(self, objeto):
+        """Quita un auto moviendo la última fila a su lugar"""
+        fila = self._filas.pop(objeto)
+        ultima = self.cantidad - 1
+        ultimo = self.objetos.pop()
+        if fila != ultima:
+            for nombre in ("x", "y", "z", "angulo", "velocidad", "velocidad_angular",
+                           "x_anterior", "z_anterior", "angulo_anterior", "semieje_x", "semieje_z",
+                           "arriba", "abajo", "izquierda", "derecha", "celda_i", "celda_j",
+                           "fila_almacen"):
+                arreglo = getattr(self, nombre)
+                arreglo[fila] = arreglo[ultima]
+            self.objetos[fila] = ultimo
+            self._filas[ultimo] = fila
+        self.cantidad = ultima
+    
+    def fila(self, objeto):
+        return self._filas[objeto]
+    
+    def cuerpos(self):
+        """Cajas de colisión de todos los autos en su posición actual (None si no hay)"""
+        n = self.cantidad
+        if n == 0:
+            return None
+        semiejes = np.stack([self.semieje_x[:n], self.semieje_z[:n]], axis=1)
+        return CuerposColision.de_cajas(self.x[:n], self.z[:n], self.angulo[:n], semiejes)
+    
+    def paso(self, k=1.0, consulta_carretera=None, colisiones=None, obstaculos=None):
+        """Avanza todos los autos un paso; k escala los parámetros igual que en actualizar_auto.
+
+        Con un SistemaColisiones los autos chocan con la escena y con `obstaculos`
+        (CuerposColision que se mueven, como el auto del jugador).
+        """
+        n = self.cantidad
+        if n == 0:
+            return
+        x, z, angulo = self.x[:n], self.z[:n], self.angulo[:n]
+        v, w = self.velocidad[:n], self.velocidad_angular[:n]
+        arriba, abajo = self.arriba[:n], self.abajo[:n]
+        izquierda, derecha = self.izquierda[:n], self.derecha[:n]
+        self.x_anterior[:n] = x
+        self.z_anterior[:n] = z
+        self.angulo_anterior[:n] = angulo
+        
+        # Control de velocidad lineal
+        sin_pedal = ~(arriba | abajo)
+        v[sin_pedal] *= self.friccion ** k
+        v[sin_pedal & (np.abs(v) < 0.001)] = 0
+        v[arriba] = np.minimum(v[arriba] + self.aceleracion * k, self.VELOCIDAD_MAXIMA)
+        frena = abajo & ~arriba
+        v[frena] = np.maximum(v[frena] - self.aceleracion * k, self.VELOCIDAD_MINIMA)
+        if consulta_carretera is not None:
+            fuera = ~consulta_carretera.consultar_lote(x, z)["en_carretera"]
+            v[fuera] *= self.friccion_cesped ** k
+        
+        # Control de rotación
+        sin_giro = ~(izquierda | derecha)
+        w[sin_giro] *= self.friccion_angular ** k
+        w[sin_giro & (np.abs(w) < 0.1)] = 0
+        en_movimiento = np.abs(v) > 0.01
+        gira_izquierda = en_movimiento & izquierda
+        gira_derecha = en_movimiento & derecha & ~izquierda
+        w[gira_izquierda] = np.minimum(w[gira_izquierda] + 0.3 * k, self.velocidad_rotacion)
+        w[gira_derecha] = np.maximum(w[gira_derecha] - 0.3 * k, -self.velocidad_rotacion)
+        w[~en_movimiento] *= 0.8 ** k
+        
+        # Aplicar rotación y mover según el ángulo
+        angulo += w * k
+        np.mod(angulo, 360, out=angulo)
+        radianes = np.radians(angulo)
+        x += np.sin(radianes) * v * k
+        z += np.cos(radianes) * v * k
+        
+        if colisiones is not None:
+            semiejes = np.stack([self.semieje_x[:n], self.semieje_z[:n]], axis=1)
+            colisiones.resolver(x, z, angulo, v, semiejes, obstaculos, self.VELOCIDAD_MAXIMA)
+    
+    def sincronizar(self, indice_espacial, alfa=1.0):
+        """Copia la pose (interpolada con alfa) a los objetos Auto y actualiza el índice espacial.
+
+        La pose se escribe de una vez en las filas de los autos en Objeto3D.almacen;
+        solo los autos que cambiaron de celda pasan por IndiceEspacial.mover.
+        """
+        n = self.cantidad
+        if n == 0:
+            return
+        x = self.x_anterior[:n] + (self.x[:n] - self.x_anterior[:n]) * alfa
+        z = self.z_anterior[:n] + (self.z[:n] - self.z_anterior[:n]) * alfa
+        diferencia = (self.angulo[:n] - self.angulo_anterior[:n] + 180) % 360 - 180
+        angulo = (self.angulo_anterior[:n] + diferencia * alfa) % 360
+        
+        transformaciones = Objeto3D.almacen.transformaciones
+        filas = self.fila_almacen[:n]
+        transformaciones[filas, 0:6] = np.stack([x, self.y[:n], z, np.zeros(n), angulo, np.zeros(n)],
+                                                axis=1)
+        Objeto3D.almacen.marcar(filas)
+        
+        celda_i = np.floor(x / indice_espacial.tamano_celda).astype(np.int64)
+        celda_j = np.floor(z / indice_espacial.tamano_celda).astype(np.int64)
+        cambiaron = np.flatnonzero((celda_i != self.celda_i[:n]) | (celda_j != self.celda_j[:n]))
+        for fila in cambiaron.tolist():
+            indice_espacial.mover(self.objetos[fila])
+        self.celda_i[:n] = celda_i
+        self.celda_j[:n] = celda_j
+    
+    def piloto_circular(self, filas=None):
+        """Control simple para los autos colocados: acelerar girando a la izquierda"""
+        filas = slice(0, self.cantidad) if filas is None else filas
+        self.arriba[filas] = True
+        self.abajo[filas] = False
+        self.izquierda[filas] = True
+        self.derecha[filas] = False
+
+
+# ------------------------- PERFILADO -------------------------
+class ContadorLlamadasGL:
+    """Cuenta las llamadas de dibujo sustituyendo las funciones GL del módulo.
+
+    Todo el motor llama a OpenGL a través de los nombres importados en este
+    módulo, así que basta con envolverlos mientras el contador está activo.
+    """
+    FUNCIONES = ("glBegin", "glDrawArrays", "glMultiDrawArrays", "glDrawElements", "glCallList",
+                 "glutSolidCube", "glutSolidSphere", "glutSolidCylinder", "glutSolidCone",
+                 "glutSolidTorus")
+    
+    def __init__(self):
+        self.conteos = dict.fromkeys(self.FUNCIONES, 0)
+        self._originales = {}
+    
+    def activar(self):
+        modulo = globals()
+        for nombre in self.FUNCIONES:
+            if nombre in modulo and nombre not in self._originales:
+                self._originales[nombre] = modulo[nombre]
+                modulo[nombre] = self._envolver(nombre, modulo[nombre])
+    
+    def desactivar(self):
+        modulo = globals()
+        for nombre, original in self._originales.items():
+            modulo[nombre] = original
+        self._originales = {}
+    
+    def _envolver(self, nombre, funcion):
+        conteos = self.conteos
+        def envoltura(*args, **kwargs):
+            conteos[nombre] += 1
+            return funcion(*args, **kwargs)
+        return envoltura
+    
+    def reiniciar(self):
+        for nombre in self.conteos:
+            self.conteos[nombre] = 0
+    
+    def total(self):
+        return sum(self.conteos.values())
+
+
+class Perfilador:
+    """Tiempos por etapa de cada cuadro con un historial circular.
+
+    Los tiempos son de CPU (lo que tarda en enviarse cada etapa, sin glFinish).
+    Las llamadas GL solo se cuentan mientras el conteo está activo, porque
+    envolver las funciones tiene un coste.
+    """
+    ETAPAS = ("vista", "luz", "culling", "cola", "objetos", "sombras", "barra")
+    
+    def __init__(self, historial=240):
+        self.tiempos_cuadro = deque(maxlen=historial)
+        self.intervalos = deque(maxlen=historial)  # Entre inicios de cuadro, para los FPS
+        self.tiempos_etapas = {etapa: deque(maxlen=historial) for etapa in self.ETAPAS}
+        self.llamadas_gl = deque(maxlen=historial)
+        self.visibles = deque(maxlen=historial)
+        self.cambios_estado = deque(maxlen=historial)
+        self.contador = ContadorLlamadasGL()
+        self.contando_llamadas = False
+        self.mostrar_overlay = False
+        self._etapas_cuadro = dict.fromkeys(self.ETAPAS, 0.0)
+        self._inicio_cuadro = None
+    
+    def alternar_overlay(self):
+        self.mostrar_overlay = not self.mostrar_overlay
+        self.activar_conteo(self.mostrar_overlay)
+    
+    def activar_conteo(self, activo=True):
+        if activo and not self.contando_llamadas:
+            self.contador.activar()
+        elif not activo and self.contando_llamadas:
+            self.contador.desactivar()
+            self.llamadas_gl.clear()
+        self.contando_llamadas = activo
+    
+    def iniciar_cuadro(self):
+        ahora = time.perf_counter()
+        if self._inicio_cuadro is not None:
+            self.intervalos.append(ahora - self._inicio_cuadro)
+        self._inicio_cuadro = ahora
+        for etapa in self._etapas_cuadro:
+            self._etapas_cuadro[etapa] = 0.0
+        self.contador.reiniciar()
+    
+    @contextmanager
+    def etapa(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._etapas_cuadro[nombre] += time.perf_counter() - inicio
+    
+    def terminar_cuadro(self, visibles=0, cambios_estado=0):
+        self.tiempos_cuadro.append(time.perf_counter() - self._inicio_cuadro)
+        for etapa, duracion in self._etapas_cuadro.items():
+            self.tiempos_etapas[etapa].append(duracion)
+        if self.contando_llamadas:
+            self.llamadas_gl.append(self.contador.total())
+        self.visibles.append(visibles)
+        self.cambios_estado.append(cambios_estado)
+    
+    def fps(self):
+        if not self.intervalos:
+            return 0.0
+        return len(self.intervalos) / sum(self.intervalos)
+    
+    def histograma(self, etapa=None, intervalos=20):
+        """Histograma (conteos, bordes en ms) del cuadro completo o de una etapa"""
+        tiempos = self.tiempos_cuadro if etapa is None else self.tiempos_etapas[etapa]
+        return np.histogram(np.asarray(tiempos) * 1000, bins=intervalos)
+    
+    def resumen(self):
+        """Estadísticas del historial como diccionario, listas para registrar en un log"""
+        def estadisticas(tiempos):
+            if not tiempos:
+                return {"media": 0.0, "p95": 0.0, "max": 0.0}
+            ms = np.asarray(tiempos) * 1000
+            return {"media": float(ms.mean()), "p95": float(np.percentile(ms, 95)),
+                    "max": float(ms.max())}
+        
+        return {
+            "fps": self.fps(),
+            "cuadro_ms": estadisticas(self.tiempos_cuadro),
+            "etapas_ms": {etapa: estadisticas(tiempos) for etapa, tiempos in self.tiempos_etapas.items()},
+            "llamadas_gl": float(np.mean(self.llamadas_gl)) if self.llamadas_gl else None,
+            "visibles": self.visibles[-1] if self.visibles else 0,
+            "cambios_estado": float(np.mean(self.cambios_estado)) if self.cambios_estado else 0.0
+        }
+
+
+# ------------------------- PERSISTENCIA -------------------------
+# Tipos guardables con el mismo nombre que usan los botones de la barra
+TIPOS_OBJETO = {
+    "arbol": Arbol,
+    "casa": Casa,
+    "montana": Montana,
+    "auto": Auto,
+    "helecho_fractal": HelechoFractal,
+    "sierpinski": TrianguloSierpinski,
+    "cubo_menger": CuboMenger
+}
+
+
+class ArchivoEscena:
+    """Guarda y carga los objetos de la escena y la curva de la carretera.
+
+    Los objetos se pasan por un arreglo estructurado de NumPy (un registro por
+    objeto). El formato binario es una cabecera, los puntos de control y los
+    registros tal cual, así que al cargar se mapean en memoria sin leerlos uno
+    a uno. El formato JSON guarda lo mismo de forma legible.
+    """
+    MAGIA = b"ESC3D\0"
+    VERSION = 1
+    CABECERA = struct.Struct("<6sHII")  # Magia, versión, número de objetos, número de puntos de control
+    REGISTRO = np.dtype([
+        ("tipo", "u1"),
+        ("nivel", "i1"),  # -1 si no es un fractal
+        ("posicion", "<f4", 3),
+        ("rotacion", "<f4", 3),
+        ("escala", "<f4", 3),
+        ("color", "<f4", 3),
+        ("escala_fractal", "<f4")
+    ])
+    TIPOS = list(TIPOS_OBJETO)
+    
+    @classmethod
+    def a_registros(cls, objetos):
+        """Arreglo estructurado con un registro por objeto guardable"""
+        clases = {clase: codigo for codigo, clase in enumerate(TIPOS_OBJETO.values())}
+        guardables = [obj for obj in objetos if type(obj) in clases]
+        registros = np.zeros(len(guardables), dtype=cls.REGISTRO)
+        registros["tipo"] = [clases[type(obj)] for obj in guardables]
+        filas = AlmacenEscena.filas_de(guardables)
+        transformaciones = Objeto3D.almacen.transformaciones[filas]
+        registros["posicion"] = transformaciones[:, 0:3]
+        registros["rotacion"] = transformaciones[:, 3:6]
+        registros["escala"] = transformaciones[:, 6:9]
+        registros["color"] = Objeto3D.almacen.colores[filas, 0]
+        registros["nivel"] = [obj.nivel if isinstance(obj, Fractal) else -1 for obj in guardables]
+        registros["escala_fractal"] = [getattr(obj, "escala_fractal", 1.0) for obj in guardables]
+        return registros
+    
+    @classmethod
+    def guardar(cls, ruta, registros, puntos_control):
+        if ruta.endswith(".json"):
+            cls.guardar_json(ruta, registros, puntos_control)
+        else:
+            cls.guardar_binario(ruta, registros, puntos_control)
+    
+    @classmethod
+    def leer(cls, ruta):
+        """Devuelve (registros, puntos_control) según la extensión del archivo"""
+        if ruta.endswith(".json"):
+            return cls.leer_json(ruta)
+        return cls.leer_binario(ruta)
+    
+    @classmethod
+    def guardar_binario(cls, ruta, registros, puntos_control):
+        puntos = np.asarray(puntos_control, dtype="<f8").reshape(-1, 3)
+        with open(ruta, "wb") as archivo:
+            archivo.write(cls.CABECERA.pack(cls.MAGIA, cls.VERSION, len(registros), len(puntos)))
+            archivo.write(puntos.tobytes())
+            archivo.write(np.ascontiguousarray(registros, dtype=cls.REGISTRO).tobytes())
+    
+    @classmethod
+    def leer_binario(cls, ruta):
+        with open(ruta, "rb") as archivo:
+            magia, version, num_objetos, num_puntos = cls.CABECERA.unpack(archivo.read(cls.CABECERA.size))
+            if magia != cls.MAGIA or version != cls.VERSION:
+                raise ValueError(f"{ruta} no es un archivo de escena compatible")
+            puntos = np.frombuffer(archivo.read(num_puntos * 24), dtype="<f8").reshape(-1, 3)
+        desplazamiento = cls.CABECERA.size + num_puntos * 24
+        if num_objetos == 0:
+            registros = np.zeros(0, dtype=cls.REGISTRO)
+        else:
+            registros = np.memmap(ruta, dtype=cls.REGISTRO, mode="r", offset=desplazamiento,
+                                  shape=(num_objetos,))
+        return registros, [tuple(p) for p in puntos.tolist()]
+    
+    @classmethod
+    def guardar_json(cls, ruta, registros, puntos_control):
+        objetos = []
+        for registro in registros:
+            datos = {
+                "tipo": cls.TIPOS[registro["tipo"]],
+                "posicion": registro["posicion"].tolist(),
+                "rotacion": registro["rotacion"].tolist(),
+                "escala": registro["escala"].tolist(),
+                "color": registro["color"].tolist()
+            }
+            if registro["nivel"] >= 0:
+                datos["nivel"] = int(registro["nivel"])
+                datos["escala_fractal"] = float(registro["escala_fractal"])
+            objetos.append(datos)
+        with open(ruta, "w", encoding="utf-8") as archivo:
+            json.dump({"version": cls.VERSION,
+                       "carretera": {"puntos_control": [list(p) for p in puntos_control]},
+                       "objetos": objetos}, archivo, indent=1, ensure_ascii=False)
+    
+    @classmethod
+    def leer_json(cls, ruta):
+        with open(ruta, encoding="utf-8") as archivo:
+            datos = json.load(archivo)
+        objetos = datos.get("objetos", [])
+        registros = np.zeros(len(objetos), dtype=cls.REGISTRO)
+        for registro, obj in zip(registros, objetos):
+            registro["tipo"] = cls.TIPOS.index(obj["tipo"])
+            registro["posicion"] = obj.get("posicion", (0, 0, 0))
+            registro["rotacion"] = obj.get("rotacion", (0, 0, 0))
+            registro["escala"] = obj.get("escala", (1, 1, 1))
+            registro["color"] = obj.get("color", (1, 1, 1))
+            registro["nivel"] = obj.get("nivel", -1)
+            registro["escala_fractal"] = obj.get("escala_fractal", 1.0)
+        puntos = datos.get("carretera", {}).get("puntos_control")
+        return registros, [tuple(p) for p in puntos] if puntos else None
+    
+    @classmethod
+    def crear_objetos(cls, registros):
+        """Objetos de la escena a partir de los registros, en el mismo orden.
+
+        Por tipo se construye un prototipo; los objetos reservan sus filas del
+        almacén de una vez, que reciben los colores de partes y la esfera del
+        prototipo y las transformaciones de los registros con NumPy. Cada objeto
+        copia los __slots__ del prototipo en lugar de pasar por __init__: los
+        atributos que no se guardan son inmutables (los picos son tuplas) o,
+        como las texturas, se comparten a propósito.
+        """
+        objetos = [None] * len(registros)
+        transformaciones = np.concatenate([np.asarray(registros["posicion"], dtype=np.float64),
+                                           np.asarray(registros["rotacion"], dtype=np.float64),
+                                           np.asarray(registros["escala"], dtype=np.float64)],
+                                          axis=1).reshape(-1, 9)
+        colores = np.asarray(registros["color"], dtype=np.float32).reshape(-1, 3)
+        niveles = registros["nivel"].tolist()
+        escalas_fractal = registros["escala_fractal"].astype(np.float64).tolist()
+        codigos = np.asarray(registros["tipo"])
+        almacen = Objeto3D.almacen
+        
+        for codigo, clase in enumerate(TIPOS_OBJETO.values()):
+            filas = np.flatnonzero(codigos == codigo)
+            if not len(filas):
+                continue
+            prototipo = clase()
+            prototipo._guardar_esfera()
+            atributos = [(nombre, getattr(prototipo, nombre)) for nombre in clase._ranuras()
+                         if hasattr(prototipo, nombre)]
+            filas_almacen = almacen.reservar_lote(len(filas))
+            almacen.copiar_fila(prototipo._fila, filas_almacen)
+            almacen.transformaciones[filas_almacen] = transformaciones[filas]
+            almacen.colores[filas_almacen, 0] = colores[filas]
+            es_fractal = issubclass(clase, Fractal)
+            for fila, fila_almacen in zip(filas.tolist(), filas_almacen.tolist()):
+                obj = clase.__new__(clase)
+                obj._fila = fila_almacen
+                for nombre, valor in atributos:
+                    setattr(obj, nombre, valor)
+                if es_fractal:
+                    obj.nivel = niveles[fila]
+                    obj.escala_fractal = escalas_fractal[fila]
+                objetos[fila] = obj
+        return objetos
+
+
+# ------------------------- MUNDO POR TESELAS -------------------------
+class Tesela:
+    """Objetos y suelo de una celda cuadrada del plano XZ"""
+    def __init__(self, clave, suelo, objetos=None):
+        self.clave = clave
+        self.suelo = suelo
+        self.objetos = set(objetos or ())
+        self.sucia = False  # Hay cambios sin guardar en disco
+
+
+class MundoTeselas:
+    """Mundo dividido en teselas que se cargan de disco alrededor del auto.
+
+    Cada tesela se guarda en su propio archivo con el formato binario de
+    ArchivoEscena. Se cargan las teselas a menos de `radio` celdas del auto y,
+    si la memoria estimada supera el presupuesto, se descargan las que hace más
+    tiempo que no se usan (guardando antes las que tienen cambios). Los objetos
+    que se mueven (autos simulados, fractales que cambian de tamaño) pasan a la
+    tesela de su nueva posición con objeto_movido u objetos_movidos.
+    """
+    # Entradas de cada objeto en los diccionarios y conjuntos de la escena, el
+    # índice espacial y el mundo (el objeto y su fila del almacén se miden aparte)
+    BYTES_REFERENCIAS_OBJETO = 512
+    BYTES_POR_TESELA = 4096
+    
+    def __init__(self, escena, directorio, tamano=64.0, radio=1, presupuesto_bytes=64 * 2**20,
+                 textura_suelo=None):
+        self.escena = escena
+        self.directorio = directorio
+        self.tamano = tamano
+        self.radio = radio
+        self.presupuesto_bytes = presupuesto_bytes
+        self.textura_suelo = textura_suelo
+        self.teselas = OrderedDict()  # clave -> Tesela, de la menos a la más usada
+        self.tesela_de = {}  # objeto -> clave
+        self._bytes_objetos = 0  # Memoria de los objetos cargados, ver _bytes_objeto
+        self._centro = None
+        os.makedirs(directorio, exist_ok=True)
+    
+    def clave_de(self, x, z):
+        return (math.floor(x / self.tamano), math.floor(z / self.tamano))
+    
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f"tesela_{clave[0]}_{clave[1]}.bin")
+    
+    def _bytes_objeto(self, objeto):
+        """Memoria de un objeto: la instancia, su fila en Objeto3D.almacen y sus referencias"""
+        return sys.getsizeof(objeto) + Objeto3D.almacen.bytes_por_fila() + self.BYTES_REFERENCIAS_OBJETO
+    
+    def memoria_estimada(self):
+        """Bytes aproximados de las teselas cargadas y sus objetos.
+
+        Las texturas y las display lists no se cuentan: son las mismas para
+        todas las teselas (se comparten por textura y por forma), así que
+        descargar teselas no las libera.
+        """
+        return len(self.teselas) * self.BYTES_POR_TESELA + self._bytes_objetos
+    
+    def actualizar(self, x, z):
+        """Carga las teselas alrededor de (x, z) y descarga las sobrantes; barato si no cambió la celda"""
+        centro = self.clave_de(x, z)
+        if centro == self._centro:
+            return
+        self._centro = centro
+        
+        necesarias = [(centro[0] + di, centro[1] + dj)
+                      for di in range(-self.radio, self.radio + 1)
+                      for dj in range(-self.radio, self.radio + 1)]
+        for clave in necesarias:
+            if clave not in self.teselas:
+                self._cargar(clave)
+            self.teselas.move_to_end(clave)
+        
+        # Descargar de la menos usada a la más usada, sin tocar las necesarias
+        protegidas = set(necesarias)
+        for clave in list(self.teselas):
+            if self.memoria_estimada() <= self.presupuesto_bytes:
+                break
+            if clave not in protegidas:
+                self._descargar(clave)
+    
+    def _cargar(self, clave):
+        ruta = self._ruta(clave)
+        objetos = []
+        if os.path.exists(ruta):
+            registros, _ = ArchivoEscena.leer_binario(ruta)
+            objetos = ArchivoEscena.crear_objetos(registros)
+        centro = ((clave[0] + 0.5) * self.tamano, 0, (clave[1] + 0.5) * self.tamano)
+        suelo = Suelo(textura=self.textura_suelo, tamano=self.tamano, pos=centro)
+        self.teselas[clave] = Tesela(clave, suelo, objetos)
+        for obj in objetos:
+            self.tesela_de[obj] = clave
+            self._bytes_objetos += self._bytes_objeto(obj)
+        self.escena._insertar_objetos(objetos)
+    
+    def _descargar(self, clave):
+        tesela = self.teselas.pop(clave)
+        if tesela.sucia:
+            self._guardar(tesela)
+        for obj in tesela.objetos:
+            del self.tesela_de[obj]
+            self._bytes_objetos -= self._bytes_objeto(obj)
+            self.escena._retirar_objeto(obj)
+    
+    def _guardar(self, tesela):
+        # Los autos simulados solo copian su pose a los objetos al dibujar: guardar la del último paso
+        self.escena.simulacion_vehiculos.sincronizar(self.escena.indice_espacial)
+        registros = ArchivoEscena.a_registros(list(tesela.objetos))
+        ArchivoEscena.guardar_binario(self._ruta(tesela.clave), registros, [])
+        tesela.sucia = False
+    
+    def guardar_todo(self):
+        """Escribe en disco las teselas cargadas con cambios"""
+        for tesela in self.teselas.values():
+            if tesela.sucia:
+                self._guardar(tesela)
+    
+    def objeto_agregado(self, objeto):
+        clave = self.clave_de(objeto.posicion[0], objeto.posicion[2])
+        if clave not in self.teselas:
+            self._cargar(clave)
+        tesela = self.teselas[clave]
+        tesela.objetos.add(objeto)
+        tesela.sucia = True
+        self.tesela_de[objeto] = clave
+        self._bytes_objetos += self._bytes_objeto(objeto)
+    
+    def objeto_quitado(self, objeto):
+        clave = self.tesela_de.pop(objeto, None)
+        if clave is not None:
+            tesela = self.teselas[clave]
+            tesela.objetos.discard(objeto)
+            tesela.sucia = True
+            self._bytes_objetos -= self._bytes_objeto(objeto)
+    
+    def objeto_movido(self, objeto):
+        """Pasa un objeto a la tesela de su posición actual si cambió de tesela"""
+        self._mover_a(objeto, self.clave_de(objeto.posicion[0], objeto.posicion[2]))
+    
+    def objetos_movidos(self, objetos, x, z):
+        """objeto_movido para muchos objetos, con sus posiciones nuevas en arreglos x, z"""
+        i = np.floor(np.asarray(x) / self.tamano).astype(np.int64).tolist()
+        j = np.floor(np.asarray(z) / self.tamano).astype(np.int64).tolist()
+        # Copia de la lista: cargar la tesela de destino puede añadir autos a la simulación
+        for objeto, clave in zip(list(objetos), zip(i, j)):
+            self._mover_a(objeto, clave)
+    
+    def _mover_a(self, objeto, clave):
+        anterior = self.tesela_de.get(objeto)
+        if anterior is None or anterior == clave:
+            return
+        # La tesela de destino se carga para no sobrescribir su archivo al guardarla
+        if clave not in self.teselas:
+            self._cargar(clave)
+        origen = self.teselas[anterior]
+        origen.objetos.discard(objeto)
+        origen.sucia = True
+        destino = self.teselas[clave]
+        destino.objetos.add(objeto)
+        destino.sucia = True
+        self.tesela_de[objeto] = clave
+    
+    def suelos(self):
+        return [tesela.suelo for tesela in self.teselas.values()]
+    
+    @classmethod
+    def dividir_escena(cls, ruta_escena, directorio, tamano=64.0):
+        """Reparte los objetos de un archivo de escena en archivos de tesela"""
+        registros, _ = ArchivoEscena.leer(ruta_escena)
+        os.makedirs(directorio, exist_ok=True)
+        claves = np.floor(np.asarray(registros["posicion"])[:, [0, 2]] / tamano).astype(np.int64)
+        unicas, grupo = np.unique(claves, axis=0, return_inverse=True)
+        orden = np.argsort(grupo.ravel(), kind="stable")
+        limites = np.searchsorted(grupo.ravel()[orden], np.arange(len(unicas) + 1))
+        for n, (i, j) in enumerate(unicas.tolist()):
+            filas = orden[limites[n]:limites[n + 1]]
+            ruta = os.path.join(directorio, f"tesela_{i}_{j}.bin")
+            ArchivoEscena.guardar_binario(ruta, np.asarray(registros)[filas], [])
+        return len(unicas)
+
+
+# ------------------------- INTERFAZ -------------------------
+class BarraHerramientas:
+    """Barra de botones 2D compilada en una display list.
+
+    La lista (fondo, botones y etiquetas) solo se vuelve a compilar cuando
+    cambia el botón seleccionado o el tamaño de la ventana; cada cuadro basta
+    un glCallList. Los clics se resuelven con los rectángulos de los botones
+    ordenados por su borde izquierdo y una búsqueda binaria.
+    """
+    ALTO = 90
+    ANCHO_BOTON = 70
+    # El botón se dibuja de y - 20 a y + 30 respecto a su "y"
+    ARRIBA_BOTON = 20
+    ABAJO_BOTON = 30
+    COLOR_FONDO = (0.2, 0.2, 0.25)
+    COLOR_BOTON = (0.4, 0.4, 0.5)
+    COLOR_SELECCIONADO = (0.3, 0.5, 0.8)
+    
+    def __init__(self, botones):
+        self.botones = botones
+        self.lista = None
+        self.compilaciones = 0
+        self._clave = None
+        # Rectángulos (x0, y0, x1, y1, orden en botones) ordenados por x0
+        self.rectangulos = sorted(
+            (boton["x"], boton["y"] - self.ARRIBA_BOTON,
+             boton["x"] + self.ANCHO_BOTON, boton["y"] + self.ABAJO_BOTON, i)
+            for i, boton in enumerate(botones))
+        self._inicios = [rect[0] for rect in self.rectangulos]
+        self._ancho_maximo = max((rect[2] - rect[0] for rect in self.rectangulos), default=0)
+    
+    def contiene(self, x, y):
+        """True si el punto (en píxeles de la ventana) cae sobre la barra"""
+        return 0 <= y <= self.ALTO
+    
+    def boton_en(self, x, y):
+        """Botón bajo el punto o None; si dos se solapan gana el primero de la lista"""
+        elegido = None
+        i = bisect.bisect_right(self._inicios, x) - 1
+        # Solo pueden contener x los rectángulos que empiezan a menos de un ancho a su izquierda
+        while i >= 0 and self._inicios[i] >= x - self._ancho_maximo:
+            x0, y0, x1, y1, orden = self.rectangulos[i]
+            if x <= x1 and y0 <= y <= y1 and (elegido is None or orden < elegido):
+                elegido = orden
+            i -= 1
+        return None if elegido is None else self.botones[elegido]
+    
+    def dibujar(self, seleccionado, ancho, alto):
+        """Dibuja la barra (en la proyección 2D actual), recompilándola si hace falta"""
+        clave = (seleccionado, ancho, alto)
+        if clave != self._clave:
+            if self.lista is None:
+                self.lista = glGenLists(1)
+            glNewList(self.lista, GL_COMPILE)
+            try:
+                self._dibujar(seleccionado, ancho)
+            finally:
+                glEndList()
+            self._clave = clave
+            self.compilaciones += 1
+        glCallList(self.lista)
+    
+    def invalidar(self):
+        """Fuerza a recompilar (por ejemplo con un contexto OpenGL nuevo)"""
+        self.lista = None
+        self._clave = None
+    
+    def _dibujar(self, seleccionado, ancho):
+        glColor3f(*self.COLOR_FONDO)
+        glBegin(GL_QUADS)
+        glVertex2f(0, 0)
+        glVertex2f(ancho, 0)
+        glVertex2f(ancho, self.ALTO)
+        glVertex2f(0, self.ALTO)
+        glEnd()
+        
+        for boton in self.botones:
+            if seleccionado == boton["tipo"]:
+                glColor3f(*self.COLOR_SELECCIONADO)
+            else:
+                glColor3f(*boton.get("color", self.COLOR_BOTON))
+            x, y = boton["x"], boton["y"]
+            glBegin(GL_QUADS)
+            glVertex2f(x, y - self.ARRIBA_BOTON)
+            glVertex2f(x + self.ANCHO_BOTON, y - self.ARRIBA_BOTON)
+            glVertex2f(x + self.ANCHO_BOTON, y + self.ABAJO_BOTON)
+            glVertex2f(x, y + self.ABAJO_BOTON)
+            glEnd()
+            
+            # Etiqueta en blanco
+            glColor3f(1, 1, 1)
+            glRasterPos2f(x + 10, y + 10)
+            for char in boton["texto"]:
+                glutBitmapCharacter(GLUT_BITMAP_HELVETICA_12, ord(char))
+
+
+# ------------------------- ILUMINACIÓN -------------------------
+class EstadoIluminacion:
+    """Luces y color del cielo del ciclo día/noche según la posición X del auto.
+
+    Todo se calcula una vez por cada posición (si el auto no se mueve en X no
+    se recalcula nada) y aplicar() solo envía a OpenGL los valores que
+    cambiaron desde el último envío.
+    """
+    INICIO_TRANSICION = -20.0
+    FIN_TRANSICION = 20.0
+    # Curva coseno de la transición (factor de noche) muestreada en [0, 1]
+    MUESTRAS_CURVA = 1024
+    CURVA = (1.0 - np.cos(np.linspace(0.0, math.pi, MUESTRAS_CURVA + 1))) / 2.0
+
+    DIA = {"difusa": (0.8, 0.8, 0.7), "ambiente": (0.4, 0.4, 0.4), "cielo": (0.53, 0.81, 0.98),
+           "posicion": (0.0, 15.0)}
+    NOCHE = {"difusa": (0.15, 0.15, 0.25), "ambiente": (0.05, 0.05, 0.1), "cielo": (0.02, 0.02, 0.1),
+             "posicion": (3.0, 8.0)}
+    POSICION_LUNA = (-5.0, 12.0, -10.0, 1.0)
+
+    def __init__(self):
+        self._x = None
+        self.factor_noche = None
+        self._enviado = {}  # Último valor enviado a OpenGL de cada parámetro
+
+    @classmethod
+    def factor_noche_en(cls, x):
+        """Factor de noche (0 día, 1 noche) interpolando en la curva precalculada"""
+        t = (x - cls.INICIO_TRANSICION) / (cls.FIN_TRANSICION - cls.INICIO_TRANSICION)
+        if t <= 0.0:
+            return 0.0
+        if t >= 1.0:
+            return 1.0
+        posicion = t * cls.MUESTRAS_CURVA
+        i = int(posicion)
+        fraccion = posicion - i
+        return float(cls.CURVA[i] + (cls.CURVA[i + 1] - cls.CURVA[i]) * fraccion)
+
+    def actualizar(self, x):
+        """Recalcula las luces si cambió la posición X del auto"""
+        if x == self._x:
+            return
+        self._x = x
+        noche = self.factor_noche_en(x)
+        if noche == self.factor_noche:
+            return
+        self.factor_noche = noche
+        dia = 1.0 - noche
+
+        def mezclar(nombre):
+            return tuple(d * dia + n * noche for d, n in zip(self.DIA[nombre], self.NOCHE[nombre]))
+
+        self.difusa = mezclar("difusa") + (1.0,)
+        self.ambiente = mezclar("ambiente") + (1.0,)
+        self.cielo = mezclar("cielo")
+        x_luz, altura_luz = mezclar("posicion")
+        self.posicion = (x_luz, altura_luz, 5.0, 1.0)
+        # Segunda luz que simula la luna durante la noche
+        self.luna_activa = noche > 0.3
+        self.luna_difusa = (0.1 * noche, 0.1 * noche, 0.2 * noche, 1.0)
+        self.luna_ambiente = (0.05 * noche, 0.05 * noche, 0.1 * noche, 1.0)
+
+    def _cambio(self, clave, valor):
+        """True (y lo registra) si el valor no es el último enviado para esa clave"""
+        if self._enviado.get(clave) == valor:
+            return False
+        self._enviado[clave] = valor
+        return True
+
+    def aplicar(self):
+        if self._cambio("activas", True):
+            glEnable(GL_LIGHT0)
+            glEnable(GL_COLOR_MATERIAL)
+            glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
+        if self._cambio("difusa", self.difusa):
+            glLightfv(GL_LIGHT0, GL_DIFFUSE, self.difusa)
+        if self._cambio("ambiente", self.ambiente):
+            glLightfv(GL_LIGHT0, GL_AMBIENT, self.ambiente)
+        if self._cambio("cielo", self.cielo):
+            glClearColor(*self.cielo, 1.0)
+        # La posición se transforma por el modelview, que aquí siempre es la identidad
+        if self._cambio("posicion", self.posicion):
+            glLightfv(GL_LIGHT0, GL_POSITION, self.posicion)
+
+        if self._cambio("luna_activa", self.luna_activa):
+            if self.luna_activa:
+                glEnable(GL_LIGHT1)
+            else:
+                glDisable(GL_LIGHT1)
+        if self.luna_activa:
+            if self._cambio("luna_difusa", self.luna_difusa):
+                glLightfv(GL_LIGHT1, GL_DIFFUSE, self.luna_difusa)
+            if self._cambio("luna_ambiente", self.luna_ambiente):
+                glLightfv(GL_LIGHT1, GL_AMBIENT, self.luna_ambiente)
+            if self._cambio("luna_posicion", self.POSICION_LUNA):
+                glLightfv(GL_LIGHT1, GL_POSITION, self.POSICION_LUNA)
+
+    def invalidar(self):
+        """Olvida lo enviado (por ejemplo con un contexto OpenGL nuevo)"""
+        self._enviado.clear()
+
 
 class Escena:
-    def __init__(self, textura_hierba=None, textura_montana=None, textura_asfalto=None):  # AGREGAR textura_asfalto aquí
+    # Duración de un paso de actualizar_auto (el temporizador de GLUT es de 16 ms)
+    PASO_SIMULACION = 0.016
+    
+    def __init__(self, textura_hierba=None, textura_montana=None, textura_asfalto=None, gestor_texturas=None):
         self.ancho = 1024
         self.alto = 768
+        self.gestor_texturas = gestor_texturas  # Sube las texturas que terminan de cargarse
         
         # Configuración de cámara
-        self.cam_distancia = 8
-        self.cam_altura = 3.0
-        self.cam_offset_y = 1.5
+        self.camara = Camara(fov=60, distancia=8, altura=3.0, offset_y=1.5, zoom_ortogonal=45)
         self.modo_vista = 'perspectiva'
         
         # Estado del auto
@@ -704,19 +4015,53 @@ class Escena:
         self.auto_angulo = 0
         self.velocidad_auto = 0
         self.velocidad_angular = 0
+        
+        # Simulación de paso fijo; el auto se dibuja interpolado entre el paso anterior y el actual
+        self.dt = self.PASO_SIMULACION
+        self.bucle_simulacion = BucleSimulacion(self.paso_simulacion, self.dt)
+        self.pose_anterior = self._pose_auto()
 
         # Crear objetos
         self.auto = Auto(pos=(self.auto_pos_x, self.auto_pos_y, self.auto_pos_z))
         self.carretera = Carretera(textura=textura_asfalto)  # Agregar textura
         self.suelo = Suelo(textura=textura_hierba)  # Ya está bien
         self.inicial = Inicial3D(pos=(-6, 2, -5), esc=(0.5, 0.8, 0.5))
-        self.objetos = self._generar_entorno(textura_montana)  # Ya está bien
+        self.objetos = []
+        self._indices_objetos = {}  # objeto -> posición en self.objetos
+        self._filas_objetos = np.zeros(64, dtype=np.intp)  # Fila en Objeto3D.almacen de cada objeto
+        self.indice_espacial = IndiceEspacial()
+        self.colisiones = SistemaColisiones()
+        self.seleccion = SeleccionRayos(self.camara)
+        self.renderizador_lotes = RenderizadorLotes()
+        self.cola_render = ColaRender()
+        self.sistema_sombras = SistemaSombras()
+        self._texturas_subidas = 0  # GestorTexturas.subidas en el último cuadro
+        for obj in self._generar_entorno(textura_montana):
+            self.agregar_objeto(obj)
+        self.iluminacion = EstadoIluminacion()
+        
+        # Culling por frustum y distancia
+        self.culling_activo = True
+        self.distancia_dibujo = 200.0
+        self.estadisticas_culling = {"visibles": 0, "descartados": 0}
+        
+        # Nivel de detalle según la distancia
+        self.selector_lod = SelectorLOD()
+        
+        # Tiempos por etapa (tecla P para ver el overlay)
+        self.perfilador = Perfilador()
 
         # Parámetros de control
         self.aceleracion = 0.008
         self.velocidad_rotacion = 2.0
         self.friccion = 0.95
         self.friccion_angular = 0.9
+        self.friccion_cesped = 0.96  # Penalización por paso fuera del asfalto
+        
+        # Autos colocados con la herramienta: se simulan todos juntos con las mismas reglas
+        self.simulacion_vehiculos = SimulacionVehiculos(self.aceleracion, self.velocidad_rotacion,
+                                                        self.friccion, self.friccion_angular,
+                                                        self.friccion_cesped)
 
         # Estado de teclas
         self.tecla_arriba = False
@@ -728,7 +4073,7 @@ class Escena:
 
 
         self.boton_seleccionado = None
-        self.botones = [
+        self.barra = BarraHerramientas([
             {"texto": "Árbol", "x": 20, "y": 50, "tipo": "arbol"},
             {"texto": "Casa", "x": 90, "y": 50, "tipo": "casa"},
             {"texto": "Montaña", "x": 160, "y": 50, "tipo": "montana"},
@@ -739,380 +4084,353 @@ class Escena:
             {"texto": "Cubo M.", "x": 510, "y": 50, "tipo": "cubo_menger"},
             {"texto": "+Tam", "x": 650, "y": 50, "tipo": "aumentar_tam", "color": (0.3, 0.7, 0.3)},
             {"texto": "-Tam", "x": 710, "y": 50, "tipo": "disminuir_tam", "color": (0.7, 0.3, 0.3)}
-        ]
+        ])
 
 
         # Objeto fractal seleccionado para modificar
         self.fractal_seleccionado = None
+        
+        # Archivo que usan las teclas G (guardar) y C (cargar)
+        self.archivo_escena = "escena.bin"
+        
+        # Mundo por teselas (opcional, ver activar_mundo)
+        self.mundo = None
 
 
 
+    def guardar(self, ruta):
+        """Guarda los objetos y la carretera (JSON si la ruta termina en .json, si no binario)"""
+        ArchivoEscena.guardar(ruta, ArchivoEscena.a_registros(self.objetos), self.carretera.puntos_control)
+    
+    def cargar(self, ruta):
+        """Sustituye los objetos y la carretera por los del archivo"""
+        registros, puntos_control = ArchivoEscena.leer(ruta)
+        # Crear miles de objetos dispara el recolector de ciclos sin que haya nada que recoger
+        recolector_activo = gc.isenabled()
+        gc.disable()
+        try:
+            return self._cargar_registros(registros, puntos_control)
+        finally:
+            if recolector_activo:
+                gc.enable()
+    
+    def _cargar_registros(self, registros, puntos_control):
+        objetos = ArchivoEscena.crear_objetos(registros)
+        
+        self.objetos = []
+        self._indices_objetos = {}
+        self.renderizador_lotes.vaciar()
+        self.sistema_sombras.vaciar()
+        self.indice_espacial = IndiceEspacial(self.indice_espacial.tamano_celda)
+        self.simulacion_vehiculos = SimulacionVehiculos(self.aceleracion, self.velocidad_rotacion,
+                                                        self.friccion, self.friccion_angular,
+                                                        self.friccion_cesped)
+        self.fractal_seleccionado = None
+        if puntos_control:
+            self.carretera.puntos_control = puntos_control
+        
+        self._insertar_objetos(objetos)
+        return len(objetos)
+    
+    def activar_mundo(self, directorio, **opciones):
+        """Pasa a un mundo por teselas guardado en directorio (los objetos actuales se descartan)"""
+        for obj in list(self.objetos):
+            self._retirar_objeto(obj)
+        self.mundo = MundoTeselas(self, directorio, textura_suelo=self.suelo.textura, **opciones)
+        self.mundo.actualizar(self.auto_pos_x, self.auto_pos_z)
+    
+    def _insertar_objetos(self, objetos):
+        """Añade objetos ya creados en bloque, sin avisar al mundo por teselas"""
+        inicio = len(self.objetos)
+        self.objetos.extend(objetos)
+        self._indices_objetos.update(zip(objetos, range(inicio, inicio + len(objetos))))
+        self._anotar_filas(inicio, objetos)
+        self.indice_espacial.agregar_lote(objetos)
+        self.renderizador_lotes.agregar_lote(objetos)
+        self.sistema_sombras.agregar_lote(objetos)
+        self.colisiones.invalidar()
+        for obj in objetos:
+            if isinstance(obj, Auto):
+                fila = self.simulacion_vehiculos.agregar(obj, obj.rotacion[1])
+                self.simulacion_vehiculos.piloto_circular(fila)
+    
     def _generar_entorno(self,textura_montana=None):
         objetos = []
 
         return objetos
     
+    def agregar_objeto(self, objeto):
+        """Añade un objeto a la escena y al índice espacial"""
+        self._indices_objetos[objeto] = len(self.objetos)
+        self._anotar_filas(len(self.objetos), [objeto])
+        self.objetos.append(objeto)
+        self.indice_espacial.agregar(objeto)
+        self.renderizador_lotes.agregar(objeto)
+        self.sistema_sombras.agregar(objeto)
+        self.colisiones.invalidar()
+        if self.mundo:
+            self.mundo.objeto_agregado(objeto)
+    
+    def _anotar_filas(self, inicio, objetos):
+        """Guarda a partir de `inicio` la fila del almacén de cada objeto"""
+        fin = inicio + len(objetos)
+        if fin > len(self._filas_objetos):
+            filas = np.zeros(max(fin, 2 * len(self._filas_objetos)), dtype=np.intp)
+            filas[:inicio] = self._filas_objetos[:inicio]
+            self._filas_objetos = filas
+        self._filas_objetos[inicio:fin] = [obj._fila for obj in objetos]
+    
+    def agregar_vehiculo(self, auto, angulo=0.0):
+        """Añade un auto que conduce solo, simulado por SimulacionVehiculos"""
+        self.agregar_objeto(auto)
+        fila = self.simulacion_vehiculos.agregar(auto, angulo)
+        self.simulacion_vehiculos.piloto_circular(fila)
+    
+    def quitar_objeto(self, objeto):
+        """Quita un objeto en O(1) intercambiándolo con el último de la lista"""
+        self._retirar_objeto(objeto)
+        if self.mundo:
+            self.mundo.objeto_quitado(objeto)
+    
+    def _retirar_objeto(self, objeto):
+        if objeto is self.fractal_seleccionado:
+            self.fractal_seleccionado = None
+        if objeto in self.simulacion_vehiculos:
+            self.simulacion_vehiculos.quitar(objeto)
+        indice = self._indices_objetos.pop(objeto)
+        ultimo = self.objetos.pop()
+        if ultimo is not objeto:
+            self.objetos[indice] = ultimo
+            self._indices_objetos[ultimo] = indice
+            self._filas_objetos[indice] = ultimo._fila
+        self.indice_espacial.quitar(objeto)
+        self.renderizador_lotes.quitar(objeto)
+        self.sistema_sombras.quitar(objeto)
+        self.colisiones.invalidar()
+    
     def _calcular_tangente_en_punto(self, punto_obj):
-        mejor_t = 0
-        mejor_dist = float('inf')
-        
-        for i in range(100):
-            t = i / 99
-            punto_carretera = self.carretera._calcular_punto(t)
-            dist = math.sqrt(
-                (punto_obj[0] - punto_carretera[0])**2 +
-                (punto_obj[1] - punto_carretera[1])**2 +
-                (punto_obj[2] - punto_carretera[2])**2
-            )
-            
-            if dist < mejor_dist:
-                mejor_dist = dist
-                mejor_t = t
-        
-        t_sig = min(mejor_t + 0.01, 1.0)
-        punto_sig = self.carretera._calcular_punto(t_sig)
-        return (
-            punto_sig[0] - punto_obj[0],
-            punto_sig[1] - punto_obj[1],
-            punto_sig[2] - punto_obj[2]
-        )
+        """Tangente unitaria de la carretera en el punto más cercano a punto_obj"""
+        return self.carretera.obtener_consulta().consultar(punto_obj[0], punto_obj[2])["tangente"]
     
     def dibujar(self):
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        
-        self._configurar_vista()
-        self._configurar_luz()
-        
-        # Obtener posición actual de la luz
-        luz_pos = self._obtener_posicion_luz_actual()
-
-        # Dibujar el suelo primero
-        self.suelo.dibujar()
-        
-        # Dibujar la carretera
-        self.carretera.dibujar()
-
-        # Dibujar sombras (con profundidad deshabilitada temporalmente)
-        glDepthMask(GL_FALSE)
-        luz_pos = self._obtener_posicion_luz_actual()
-        for obj in self.objetos:
-            if isinstance(obj, (Arbol, Casa, Montana, Auto)):
-                self._dibujar_sombra_objeto(obj, luz_pos)
-        glDepthMask(GL_TRUE)
- 
-
-        # Dibujar los objetos
-        for obj in self.objetos:
-            obj.dibujar()
-    
-        
-        # Dibujar el auto
-        self.auto.dibujar()
-
-        # Dibujar la inicial
-        self.inicial.dibujar()
-        
-
-        self.dibujar_barra_herramientas()
-
-
+        self.renderizar()
         glutSwapBuffers()
     
-    def _dibujar_sombra_objeto(self, objeto, luz_pos):
-        """Dibuja la sombra de un objeto proyectada sobre el suelo"""
-        # Desactivar luces y texturas para las sombras
-        glDisable(GL_TEXTURE_2D)
-        
-        # Habilitar blending para transparencia
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
-        
-        # Color negro semitransparente para todas las sombras
-        glColor4f(0.0, 0.0, 0.0, 0.4)
-        
-        # Evitar z-fighting con el suelo
-        glEnable(GL_POLYGON_OFFSET_FILL)
-        glPolygonOffset(-1.0, -1.0)
-        
-        # Calcular la proyección de la sombra manualmente
-        glPushMatrix()
-        
-        # Obtener la posición del objeto
-        obj_x, obj_y, obj_z = objeto.posicion
-        
-        # Calcular dónde debe proyectarse la sombra en el suelo (y=0.01)
-        y_suelo = 0.01
-        y_luz = luz_pos[1]
-        y_obj = obj_y
-        
-        # Factor de proyección
-        if y_luz > y_obj:  # Solo proyectar si la luz está arriba del objeto
-            factor = (y_luz - y_suelo) / (y_luz - y_obj)
-            
-            # Posición proyectada de la sombra
-            sombra_x = luz_pos[0] + (obj_x - luz_pos[0]) * factor
-            sombra_z = luz_pos[2] + (obj_z - luz_pos[2]) * factor
-            
-            # Aplicar transformación de sombra
-            glTranslatef(sombra_x, y_suelo, sombra_z)
-            
-            # Escalar en Y para aplastar la sombra
-            escala_sombra = 0.1
-            if isinstance(objeto, Auto):
-                glScalef(1.0, escala_sombra, 1.0)
-            elif isinstance(objeto, Arbol):
-                glScalef(0.8, escala_sombra, 0.8)
-            elif isinstance(objeto, Casa):
-                glScalef(0.9, escala_sombra, 0.9)
-            elif isinstance(objeto, Montana):
-                glScalef(0.7, escala_sombra, 0.7)
-            
-            # Aplicar rotación del objeto original
-            glRotatef(objeto.rotacion[0], 1, 0, 0)
-            glRotatef(objeto.rotacion[1], 0, 1, 0)
-            glRotatef(objeto.rotacion[2], 0, 0, 1)
-            
-            # Dibujar una versión simplificada del objeto como sombra
-            if isinstance(objeto, Auto):
-                self._dibujar_sombra_auto()
-            elif isinstance(objeto, Arbol):
-                self._dibujar_sombra_arbol()
-            elif isinstance(objeto, Casa):
-                self._dibujar_sombra_casa()
-            elif isinstance(objeto, Montana):
-                self._dibujar_sombra_montana()
+    def configurar_paso(self, dt):
+        """Cambia la duración del paso de simulación (la física se escala para no cambiar por segundo)"""
+        self.dt = dt
+        self.bucle_simulacion.dt = dt
+    
+    def _pose_auto(self):
+        return (self.auto_pos_x, self.auto_pos_y, self.auto_pos_z, self.auto_angulo)
+    
+    def paso_simulacion(self):
+        """Un paso fijo de física guardando la pose anterior para interpolar"""
+        self.pose_anterior = self._pose_auto()
+        self.actualizar_auto()
+        if self.mundo:
+            self.mundo.actualizar(self.auto_pos_x, self.auto_pos_z)
+        jugador = CuerposColision.de_cajas(np.array([self.auto_pos_x]), np.array([self.auto_pos_z]),
+                                           np.array([self.auto_angulo]), self._semiejes_auto())
+        self.simulacion_vehiculos.paso(self.dt / self.PASO_SIMULACION, self.carretera.obtener_consulta(),
+                                       self.colisiones, jugador)
+        if self.mundo:
+            # Los autos simulados cambian de tesela al circular
+            simulacion = self.simulacion_vehiculos
+            self.mundo.objetos_movidos(simulacion.objetos, simulacion.x[:simulacion.cantidad],
+                                       simulacion.z[:simulacion.cantidad])
+    
+    def pose_auto_interpolada(self):
+        """Pose del auto entre el paso anterior y el actual según el alfa del bucle"""
+        alfa = self.bucle_simulacion.alfa
+        x0, y0, z0, angulo0 = self.pose_anterior
+        x1, y1, z1, angulo1 = self._pose_auto()
+        # Interpolar el ángulo por el arco más corto (el ángulo se guarda módulo 360)
+        diferencia = (angulo1 - angulo0 + 180) % 360 - 180
+        return (x0 + (x1 - x0) * alfa,
+                y0 + (y1 - y0) * alfa,
+                z0 + (z1 - z0) * alfa,
+                (angulo0 + diferencia * alfa) % 360)
+    
+    def renderizar(self):
+        """Dibuja un cuadro completo en el framebuffer actual (ventana u offscreen)"""
+        perfilador = self.perfilador
+        perfilador.iniciar_cuadro()
+        if self.gestor_texturas:
+            self.gestor_texturas.subir_pendientes()
+            if self.gestor_texturas.subidas != self._texturas_subidas:
+                # Las claves de forma de los objetos con textura incluyen su id
+                self._texturas_subidas = self.gestor_texturas.subidas
+                Objeto3D.almacen.forma_sucia[self._filas_objetos[:len(self.objetos)]] = True
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         
-        glPopMatrix()
+        # El auto y la cámara usan la pose interpolada; la física sigue en auto_pos_*
+        pose = self.pose_auto_interpolada()
+        self.auto.posicion = [pose[0], pose[1], pose[2]]
+        self.auto.rotacion = [0, pose[3], 0]
+        self.simulacion_vehiculos.sincronizar(self.indice_espacial, self.bucle_simulacion.alfa)
         
-        # Restaurar configuración
-        glDisable(GL_POLYGON_OFFSET_FILL)
-        glDisable(GL_BLEND)
+        with perfilador.etapa("vista"):
+            self._configurar_vista(pose)
+        with perfilador.etapa("luz"):
+            self._configurar_luz()
 
-    def _dibujar_sombra_auto(self):
-        """Dibuja una sombra simplificada del auto"""
-        glPushMatrix()
-        glScalef(2.4, 1, 4.0)
-        glutSolidCube(1.0)
-        glPopMatrix()
+        # Descartar los objetos fuera de la vista y elegir su nivel de detalle
+        with perfilador.etapa("culling"):
+            centros, radios = self._esferas_objetos()
+            visibles = self._calcular_visibles(centros, radios)
+            self._actualizar_lod(visibles, centros, radios)
+            self._actualizar_formas()
+            # Los lotes indexan la visibilidad por fila del almacén
+            visibles_filas = np.zeros(len(Objeto3D.almacen.transformaciones), dtype=bool)
+            visibles_filas[self._filas_objetos[:len(self.objetos)]] = visibles
 
-    def _dibujar_sombra_arbol(self):
-        """Dibuja una sombra simplificada del árbol"""
-        # Tronco
-        glPushMatrix()
-        glRotatef(-90, 1, 0, 0)
-        glutSolidCylinder(0.2, 2, 8, 1)
-        glPopMatrix()
-        
-        # Copa
-        glPushMatrix()
-        glTranslatef(0, 2, 0)
-        glutSolidSphere(1, 8, 8)
-        glPopMatrix()
+        # Reunir todo lo opaco y ordenarlo por estado (textura, culling, iluminación)
+        with perfilador.etapa("cola"):
+            cola = self.cola_render
+            suelos = self.mundo.suelos() if self.mundo else [self.suelo]
+            for suelo in suelos:
+                cola.agregar(suelo.estado_render(), suelo.dibujar)
+            cola.agregar(self.carretera.estado_render(), self.carretera.dibujar)
+            # Los objetos repetidos se agrupan en lotes
+            for obj in self.renderizador_lotes.dibujar(visibles_filas, cola):
+                cola.agregar(obj.estado_render(), obj.dibujar)
+            cola.agregar(self.auto.estado_render(), self.auto.dibujar)
+            cola.agregar(self.inicial.estado_render(), self.inicial.dibujar)
 
-    def _dibujar_sombra_casa(self):
-        """Dibuja una sombra simplificada de la casa"""
-        # Paredes
-        glPushMatrix()
-        glScalef(2, 2.5, 2)
-        glutSolidCube(1.0)
-        glPopMatrix()
-        
-        # Techo
-        glPushMatrix()
-        glTranslatef(0, 1.3, 0)
-        glRotatef(-90, 1, 0, 0)
-        glutSolidCone(2.5, 1, 4, 1)
-        glPopMatrix()
+        estado_gl = Objeto3D.estado_gl
+        with perfilador.etapa("objetos"):
+            estado_gl.reiniciar()
+            cola.ejecutar(estado_gl)
 
-    def _dibujar_sombra_montana(self):
-        """Dibuja una sombra simplificada de la montaña"""
-        glPushMatrix()
-        glScalef(8, 3, 8)
-        glutSolidCube(1.0)
-        glPopMatrix()
+        # Sombras semitransparentes sobre lo ya dibujado, un lote por tipo de objeto
+        with perfilador.etapa("sombras"):
+            self.sistema_sombras.dibujar(visibles_filas, self._obtener_posicion_luz_actual(),
+                                         estado_gl, cola)
+        cola.vaciar()
 
-    def _obtener_posicion_luz_actual(self):
-        """Obtiene la posición actual de la luz basada en la transición día/noche"""
-        zona_transicion_inicio = -20.0
-        zona_transicion_fin = 20.0
-        
-        if self.auto_pos_x <= zona_transicion_inicio:
-            factor_noche = 0.0
-        elif self.auto_pos_x >= zona_transicion_fin:
-            factor_noche = 1.0
+        with perfilador.etapa("barra"):
+            self.dibujar_barra_herramientas()
+        perfilador.terminar_cuadro(self.estadisticas_culling["visibles"], estado_gl.cambios)
+    
+    def _actualizar_formas(self):
+        """Cambia de lote los objetos cuya clave de forma o de sombra pudo cambiar"""
+        filas = self._filas_objetos[:len(self.objetos)]
+        forma_sucia = Objeto3D.almacen.forma_sucia
+        for i in np.flatnonzero(forma_sucia[filas]).tolist():
+            self.renderizador_lotes.forma_cambiada(self.objetos[i])
+            self.sistema_sombras.forma_cambiada(self.objetos[i])
+        forma_sucia[filas] = False
+    
+    def _esferas_objetos(self):
+        """Centros (N, 3) y radios (N,) de las esferas envolventes de los objetos"""
+        return Objeto3D.almacen.esferas_de(self.objetos, self._filas_objetos[:len(self.objetos)])
+    
+    def _calcular_visibles(self, centros, radios):
+        """Máscara de los objetos dentro del frustum y de la distancia de dibujo"""
+        if not self.culling_activo or not self.objetos:
+            visibles = np.ones(len(self.objetos), dtype=bool)
         else:
-            factor_noche = (self.auto_pos_x - zona_transicion_inicio) / (zona_transicion_fin - zona_transicion_inicio)
-            factor_noche = (1.0 - math.cos(factor_noche * math.pi)) / 2.0
-        
-        factor_dia = 1.0 - factor_noche
-        
-        # Calcular posición de luz
-        altura_luz = 15.0 * factor_dia + 8.0 * factor_noche
-        pos_x_luz = 0.0 * factor_dia + 3.0 * factor_noche
+            visibles = self.camara.frustum().esferas_visibles(centros, radios)
+            if self.modo_vista == 'perspectiva':
+                distancias = np.linalg.norm(centros - self.camara.posicion, axis=1) - radios
+                visibles &= distancias <= self.distancia_dibujo
         
-        return [pos_x_luz, altura_luz, 5.0, 1.0]
+        num_visibles = int(np.count_nonzero(visibles))
+        self.estadisticas_culling = {
+            "visibles": num_visibles,
+            "descartados": len(self.objetos) - num_visibles
+        }
+        return visibles
     
-    def _configurar_vista(self):
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        
-        aspect = self.ancho / self.alto
-        
-        if self.modo_vista == 'perspectiva':
-            gluPerspective(60, aspect, 0.1, 200.0)
-            
-            radianes = math.radians(self.auto_angulo)
-            
-            cam_x = self.auto_pos_x - math.sin(radianes) * self.cam_distancia
-            cam_z = self.auto_pos_z - math.cos(radianes) * self.cam_distancia
-            cam_y = self.auto_pos_y + self.cam_altura
-            
-            mirar_x = self.auto_pos_x + math.sin(radianes) * 5
-            mirar_z = self.auto_pos_z + math.cos(radianes) * 5
-            mirar_y = self.auto_pos_y + self.cam_offset_y
-            
-            gluLookAt(cam_x, cam_y, cam_z,
-                    mirar_x, mirar_y, mirar_z,
-                    0, 1, 0)
-        else: # Vista ortogonal
-        # Ajusta estos valores según lo que necesites
-            zoom = 45  # Puedes ajustar este valor para hacer zoom
-            glOrtho(-zoom * aspect, zoom * aspect, -zoom, zoom, 0.1, 100.0)
-            
-            # Posición fija de la cámara en vista ortogonal
-            cam_x = 0
-            cam_y = 15  # Altura de la cámara
-            cam_z = 0
-            
-            gluLookAt(cam_x, cam_y, cam_z,
-                    cam_x, 0, cam_z - 1,  # Mira hacia abajo
-                    0, 1, 0)  # Vector "arriba"
-        
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+    def _actualizar_lod(self, visibles, centros, radios):
+        self.selector_lod.actualizar(self.objetos, visibles, centros, radios, self.camara.posicion,
+                                     self.camara.pixeles_por_unidad(), self.modo_vista == 'perspectiva')
+    
+    def _obtener_posicion_luz_actual(self):
+        """Posición de la luz según la transición día/noche"""
+        self.iluminacion.actualizar(self.auto_pos_x)
+        return self.iluminacion.posicion
+    
+    def _configurar_vista(self, pose=None):
+        """Carga la cámara que sigue al auto (solo se recalcula si cambió algo)"""
+        self.camara.actualizar(pose or self._pose_auto(), self.modo_vista, self.ancho, self.alto)
+        self.camara.aplicar()
     
     def _configurar_luz(self):
-        glEnable(GL_LIGHTING)
-        glEnable(GL_LIGHT0)
-        
-        zona_transicion_inicio = -20.0
-        zona_transicion_fin = 20.0
-        ancho_transicion = zona_transicion_fin - zona_transicion_inicio
-        
-        if self.auto_pos_x <= zona_transicion_inicio:
-            factor_noche = 0.0
-        elif self.auto_pos_x >= zona_transicion_fin:
-            factor_noche = 1.0
-        else:
-            factor_noche = (self.auto_pos_x - zona_transicion_inicio) / ancho_transicion
-            factor_noche = (1.0 - math.cos(factor_noche * math.pi)) / 2.0
-        
-        factor_dia = 1.0 - factor_noche
-        
-        # Colores del día
-        luz_dia_difusa = [0.8, 0.8, 0.7, 1.0]
-        luz_dia_ambiente = [0.4, 0.4, 0.4, 1.0]
-        cielo_dia = [0.53, 0.81, 0.98]
-        
-        # Colores de la noche
-        luz_noche_difusa = [0.15, 0.15, 0.25, 1.0]
-        luz_noche_ambiente = [0.05, 0.05, 0.1, 1.0]
-        cielo_noche = [0.02, 0.02, 0.1]
-        
-        # Interpolación suave entre día y noche
-        luz_difusa = [
-            luz_dia_difusa[0] * factor_dia + luz_noche_difusa[0] * factor_noche,
-            luz_dia_difusa[1] * factor_dia + luz_noche_difusa[1] * factor_noche,
-            luz_dia_difusa[2] * factor_dia + luz_noche_difusa[2] * factor_noche,
-            1.0
-        ]
-        
-        luz_ambiente = [
-            luz_dia_ambiente[0] * factor_dia + luz_noche_ambiente[0] * factor_noche,
-            luz_dia_ambiente[1] * factor_dia + luz_noche_ambiente[1] * factor_noche,
-            luz_dia_ambiente[2] * factor_dia + luz_noche_ambiente[2] * factor_noche,
-            1.0
-        ]
-        
-        # Color del cielo con interpolación suave
-        color_cielo = [
-            cielo_dia[0] * factor_dia + cielo_noche[0] * factor_noche,
-            cielo_dia[1] * factor_dia + cielo_noche[1] * factor_noche,
-            cielo_dia[2] * factor_dia + cielo_noche[2] * factor_noche
-        ]
-        
-        # Aplicar colores calculados
-        glLightfv(GL_LIGHT0, GL_DIFFUSE, luz_difusa)
-        glLightfv(GL_LIGHT0, GL_AMBIENT, luz_ambiente)
-        glClearColor(color_cielo[0], color_cielo[1], color_cielo[2], 1.0)
-        
-        # Posición de la luz que simula el sol/luna
-        altura_luz = 15.0 * factor_dia + 8.0 * factor_noche
-        pos_x_luz = 0.0 * factor_dia + 3.0 * factor_noche
-        
-        glLightfv(GL_LIGHT0, GL_POSITION, [pos_x_luz, altura_luz, 5.0, 1.0])
-        
-        # Habilitar materiales
-        glEnable(GL_COLOR_MATERIAL)
-        glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
-        
-        # Configurar segunda luz para simular luna durante la noche
-        if factor_noche > 0.3:
-            glEnable(GL_LIGHT1)
-            luz_luna = [0.1 * factor_noche, 0.1 * factor_noche, 0.2 * factor_noche, 1.0]
-            ambiente_luna = [0.05 * factor_noche, 0.05 * factor_noche, 0.1 * factor_noche, 1.0]
-            
-            glLightfv(GL_LIGHT1, GL_DIFFUSE, luz_luna)
-            glLightfv(GL_LIGHT1, GL_AMBIENT, ambiente_luna)
-            glLightfv(GL_LIGHT1, GL_POSITION, [-5.0, 12.0, -10.0, 1.0])
-        else:
-            glDisable(GL_LIGHT1)
+        self.iluminacion.actualizar(self.auto_pos_x)
+        self.iluminacion.aplicar()
 
 
 
     def actualizar_auto(self):
+        # Los parámetros están ajustados para pasos de PASO_SIMULACION; con otro dt se escalan
+        k = self.dt / self.PASO_SIMULACION
+        
         # Control de velocidad lineal
         if not (self.tecla_arriba or self.tecla_abajo):
-            self.velocidad_auto *= self.friccion
+            self.velocidad_auto *= self.friccion ** k
             if abs(self.velocidad_auto) < 0.001:
                 self.velocidad_auto = 0
         
         if self.tecla_arriba:
-            self.velocidad_auto = min(self.velocidad_auto + self.aceleracion, 0.25)
+            self.velocidad_auto = min(self.velocidad_auto + self.aceleracion * k, 0.25)
         elif self.tecla_abajo:
-            self.velocidad_auto = max(self.velocidad_auto - self.aceleracion, -0.15)
+            self.velocidad_auto = max(self.velocidad_auto - self.aceleracion * k, -0.15)
+        
+        # Penalización de velocidad en el césped
+        if self.velocidad_auto and not self.carretera.obtener_consulta().en_carretera(
+                self.auto_pos_x, self.auto_pos_z):
+            self.velocidad_auto *= self.friccion_cesped ** k
         
 
 
 
         # Control de rotación
         if not (self.tecla_izquierda or self.tecla_derecha):
-            self.velocidad_angular *= self.friccion_angular
+            self.velocidad_angular *= self.friccion_angular ** k
             if abs(self.velocidad_angular) < 0.1:
                 self.velocidad_angular = 0
         
         if abs(self.velocidad_auto) > 0.01:
             if self.tecla_izquierda:
-                self.velocidad_angular = min(self.velocidad_angular + 0.3, self.velocidad_rotacion)
+                self.velocidad_angular = min(self.velocidad_angular + 0.3 * k, self.velocidad_rotacion)
             elif self.tecla_derecha:
-                self.velocidad_angular = max(self.velocidad_angular - 0.3, -self.velocidad_rotacion)
+                self.velocidad_angular = max(self.velocidad_angular - 0.3 * k, -self.velocidad_rotacion)
         else:
-            self.velocidad_angular *= 0.8
+            self.velocidad_angular *= 0.8 ** k
         
         # Aplicar rotación
-        self.auto_angulo += self.velocidad_angular
+        self.auto_angulo += self.velocidad_angular * k
         self.auto_angulo = self.auto_angulo % 360
         
         # Mover el auto según su ángulo actual
         if abs(self.velocidad_auto) > 0:
             radianes = math.radians(self.auto_angulo)
-            self.auto_pos_x += math.sin(radianes) * self.velocidad_auto
-            self.auto_pos_z += math.cos(radianes) * self.velocidad_auto
+            self.auto_pos_x += math.sin(radianes) * self.velocidad_auto * k
+            self.auto_pos_z += math.cos(radianes) * self.velocidad_auto * k
+        
+        # Choques con los objetos colocados y con los demás autos
+        self._resolver_colisiones_auto()
         
         # Actualizar posición del objeto auto
         self.auto.posicion = [self.auto_pos_x, self.auto_pos_y, self.auto_pos_z]
         self.auto.rotacion = [0, self.auto_angulo, 0]
 
+    def _semiejes_auto(self):
+        return np.array([[self.auto.ancho / 2, self.auto.largo / 2]])
+    
+    def _resolver_colisiones_auto(self):
+        """Saca el auto de lo que toca; de frente se detiene y de lado se desliza"""
+        self.colisiones.preparar(self.objetos, self.simulacion_vehiculos)
+        x = np.array([self.auto_pos_x], dtype=np.float64)
+        z = np.array([self.auto_pos_z], dtype=np.float64)
+        velocidad = np.array([self.velocidad_auto], dtype=np.float64)
+        if self.colisiones.resolver(x, z, np.array([self.auto_angulo]), velocidad,
+                                    self._semiejes_auto(), self.simulacion_vehiculos.cuerpos()):
+            self.auto_pos_x, self.auto_pos_z = float(x[0]), float(z[0])
+            self.velocidad_auto = float(velocidad[0])
+
     def manejar_teclado(self, tecla, x, y):
         tecla = tecla.lower()
         if tecla == b'\x1b':  # ESC
@@ -1123,6 +4441,24 @@ class Escena:
             else:
                 self.modo_vista = 'perspectiva'
             glutPostRedisplay()
+        elif tecla == b'g' and self.mundo:  # Con mundo por teselas se guardan las teselas cambiadas
+            self.mundo.guardar_todo()
+            print(f"Teselas guardadas en {self.mundo.directorio}")
+        elif tecla == b'g':  # Tecla G para guardar la escena
+            self.guardar(self.archivo_escena)
+            print(f"Escena guardada en {self.archivo_escena}")
+        elif tecla == b'c' and self.mundo:
+            print("El mundo por teselas se carga solo al moverse")
+        elif tecla == b'c':  # Tecla C para cargar la escena guardada
+            try:
+                cantidad = self.cargar(self.archivo_escena)
+                print(f"{cantidad} objetos cargados de {self.archivo_escena}")
+            except (OSError, ValueError) as e:
+                print(f"No se pudo cargar la escena: {e}")
+            glutPostRedisplay()
+        elif tecla == b'p':  # Tecla P para mostrar/ocultar el perfilador
+            self.perfilador.alternar_overlay()
+            glutPostRedisplay()
 
 
 
@@ -1150,18 +4486,15 @@ class Escena:
     def manejar_clic_raton(self, button, state, x, y):
         if button == GLUT_LEFT_BUTTON and state == GLUT_DOWN:
             # Verificar si se hizo clic en algún botón
-            for boton in self.botones:
-                if (boton["x"] <= x <= boton["x"] + 70 and 
-                    boton["y"] <= y <= boton["y"] + 30):
-                    
-                    if boton["tipo"] in ["aumentar_tam", "disminuir_tam"]:
-                        self._manejar_cambio_tamano(boton["tipo"])
-                    else:
-                        self.boton_seleccionado = boton["tipo"]
-                        print(f"Botón {boton['texto']} seleccionado")
-                    break
-            else:
-                # Si se hizo clic fuera de los botones
+            boton = self.barra.boton_en(x, y)
+            if boton:
+                if boton["tipo"] in ["aumentar_tam", "disminuir_tam"]:
+                    self._manejar_cambio_tamano(boton["tipo"])
+                else:
+                    self.boton_seleccionado = boton["tipo"]
+                    print(f"Botón {boton['texto']} seleccionado")
+            elif not self.barra.contiene(x, y):
+                # Si se hizo clic en la escena
                 if self.boton_seleccionado == "eliminar":
                     self._eliminar_objeto_en_posicion(x, y)
                 elif self.boton_seleccionado:  # Para los otros botones (añadir objetos)
@@ -1182,105 +4515,57 @@ class Escena:
         elif accion == "disminuir_tam":
             self.fractal_seleccionado.disminuir_escala()
             print(f"Tamaño reducido a {self.fractal_seleccionado.escala_fractal:.2f}")
+        # La esfera envolvente cambió con la escala
+        self.indice_espacial.mover(self.fractal_seleccionado)
+        if self.mundo:
+            self.mundo.objeto_movido(self.fractal_seleccionado)
 
 
     
 
 
     def _agregar_objeto_en_posicion(self, x_2d, y_2d):
-        """Convierte coordenadas 2D del ratón a 3D en la escena"""
-        # Convertir coordenadas de pantalla a coordenadas 3D
-        viewport = glGetIntegerv(GL_VIEWPORT)
-        modelview = glGetDoublev(GL_MODELVIEW_MATRIX)
-        projection = glGetDoublev(GL_PROJECTION_MATRIX)
-        
-        # El Y de OpenGL está invertido respecto a las coordenadas de la ventana
-        y_2d = viewport[3] - y_2d
-        
-        # Obtener coordenadas en el plano del suelo (y=0)
-        try:
-            win_x = x_2d
-            win_y = y_2d
-            win_z = glReadPixels(x_2d, y_2d, 1, 1, GL_DEPTH_COMPONENT, GL_FLOAT)[0][0]
-            
-            pos_3d = gluUnProject(win_x, win_y, win_z, 
-                                 modelview, projection, viewport)
-            
-            if pos_3d:
-                x, y, z = pos_3d
-                if self.boton_seleccionado == "arbol":
-                    nuevo_objeto = Arbol(pos=(x, 0, z))
-                elif self.boton_seleccionado == "casa":
-                    nuevo_objeto = Casa(pos=(x, 0, z))
-                elif self.boton_seleccionado == "montana":
-                    nuevo_objeto = Montana(pos=(x, 0, z))
-                elif self.boton_seleccionado == "auto":
-                    nuevo_objeto = Auto(pos=(x, 0.2, z))
-                elif self.boton_seleccionado == "helecho_fractal":
-                    nuevo_objeto = HelechoFractal(pos=(x, 0, z))
-                elif self.boton_seleccionado == "sierpinski":
-                    nuevo_objeto = TrianguloSierpinski(pos=(x, 1.7, z))
-                elif self.boton_seleccionado == "cubo_menger":
-                    nuevo_objeto = CuboMenger(pos=(x, 0.7, z))
-
-                
-                self.objetos.append(nuevo_objeto)
-                # Si es un fractal, lo marcamos como seleccionado
-                if isinstance(nuevo_objeto, Fractal):
-                    self.fractal_seleccionado = nuevo_objeto
-        except:
+        """Coloca el objeto del botón seleccionado donde el clic toca el suelo"""
+        punto = self.seleccion.punto_suelo(x_2d, y_2d)
+        if punto is None:
             print("No se pudo determinar la posición 3D")
-
-    def _eliminar_objeto_en_posicion(self, x_2d, y_2d):
-        """Intenta eliminar un objeto en la posición del clic"""
-        # Convertir coordenadas 2D a 3D
-        viewport = glGetIntegerv(GL_VIEWPORT)
-        modelview = glGetDoublev(GL_MODELVIEW_MATRIX)
-        projection = glGetDoublev(GL_PROJECTION_MATRIX)
+            return
         
-        # El Y de OpenGL está invertido
-        y_2d = viewport[3] - y_2d
+        x, _, z = punto
+        if self.boton_seleccionado == "arbol":
+            nuevo_objeto = Arbol(pos=(x, 0, z))
+        elif self.boton_seleccionado == "casa":
+            nuevo_objeto = Casa(pos=(x, 0, z))
+        elif self.boton_seleccionado == "montana":
+            nuevo_objeto = Montana(pos=(x, 0, z))
+        elif self.boton_seleccionado == "auto":
+            self.agregar_vehiculo(Auto(pos=(x, 0.2, z)), self.auto_angulo)
+            return
+        elif self.boton_seleccionado == "helecho_fractal":
+            nuevo_objeto = HelechoFractal(pos=(x, 0, z))
+        elif self.boton_seleccionado == "sierpinski":
+            nuevo_objeto = TrianguloSierpinski(pos=(x, 1.7, z))
+        elif self.boton_seleccionado == "cubo_menger":
+            nuevo_objeto = CuboMenger(pos=(x, 0.7, z))
+        else:
+            return
         
-        try:
-            # Obtener profundidad en el punto del clic
-            win_z = glReadPixels(x_2d, y_2d, 1, 1, GL_DEPTH_COMPONENT, GL_FLOAT)[0][0]
-            
-            # Convertir a coordenadas 3D
-            pos_3d = gluUnProject(x_2d, y_2d, win_z, modelview, projection, viewport)
-            
-            if pos_3d:
-                x, y, z = pos_3d
-                punto_clic = (x, y, z)
-                
-                # Buscar el objeto más cercano al punto de clic
-                objeto_a_eliminar = None
-                distancia_min = float('inf')
-                umbral_distancia = 4.0
-                
-                for obj in self.objetos:
-                    distancia = math.sqrt(
-                        (obj.posicion[0] - x)**2 +
-                        (obj.posicion[1] - y)**2 +
-                        (obj.posicion[2] - z)**2
-                    )
-                    
-                    if distancia < distancia_min and distancia < umbral_distancia:
-                        distancia_min = distancia
-                        objeto_a_eliminar = obj
-                
-                # Eliminar el objeto si se encontró uno cercano
-                if objeto_a_eliminar:
-                    self.objetos.remove(objeto_a_eliminar)
-                    # Si era el fractal seleccionado, deseleccionarlo
-                    if objeto_a_eliminar == self.fractal_seleccionado:
-                        self.fractal_seleccionado = None
-                    print("Objeto eliminado")
-                else:
-                    print("No se encontró objeto para eliminar en esa posición")
+        self.agregar_objeto(nuevo_objeto)
+        # Si es un fractal, lo marcamos como seleccionado
+        if isinstance(nuevo_objeto, Fractal):
+            self.fractal_seleccionado = nuevo_objeto
 
-
-        except Exception as e:
-            print(f"Error al intentar eliminar objeto: {str(e)}")
+    def _eliminar_objeto_en_posicion(self, x_2d, y_2d):
+        """Elimina el objeto que está bajo el cursor"""
+        objeto_a_eliminar, _ = self.seleccion.objeto_en(x_2d, y_2d, self.indice_espacial)
+        if objeto_a_eliminar:
+            self.quitar_objeto(objeto_a_eliminar)
+            # Si era el fractal seleccionado, deseleccionarlo
+            if objeto_a_eliminar == self.fractal_seleccionado:
+                self.fractal_seleccionado = None
+            print("Objeto eliminado")
+        else:
+            print("No se encontró objeto para eliminar en esa posición")
 
     def dibujar_barra_herramientas(self):
         """Dibuja la barra de herramientas en modo 2D"""
@@ -1289,8 +4574,7 @@ class Escena:
         # Guardar estado de proyección
         glMatrixMode(GL_PROJECTION)
         glPushMatrix()
-        glLoadIdentity()
-        gluOrtho2D(0, self.ancho, self.alto, 0)  # Coordenadas invertidas en Y
+        self.camara.aplicar_interfaz()  # Coordenadas invertidas en Y
         
         glMatrixMode(GL_MODELVIEW)
         glPushMatrix()
@@ -1300,36 +4584,11 @@ class Escena:
         glDisable(GL_DEPTH_TEST)  # IMPORTANTE: desactivar depth test para la UI
         glDisable(GL_LIGHTING)
         
-        # Dibujar fondo de la barra (gris oscuro)
-        glColor3f(0.2, 0.2, 0.25)
-        glBegin(GL_QUADS)
-        glVertex2f(0, 0)
-        glVertex2f(self.ancho, 0)
-        glVertex2f(self.ancho, 90)
-        glVertex2f(0, 90)
-        glEnd()
+        # Fondo, botones y etiquetas desde la display list de la barra
+        self.barra.dibujar(self.boton_seleccionado, self.ancho, self.alto)
         
-        # Dibujar botones
-        for boton in self.botones:
-            # Color del botón (azul si está seleccionado, gris si no)
-            if self.boton_seleccionado == boton["tipo"]:
-                glColor3f(0.3, 0.5, 0.8)  # Azul seleccionado
-            else:
-                glColor3f(*boton.get("color", (0.4, 0.4, 0.5)))
-            
-            # Dibujar fondo del botón
-            glBegin(GL_QUADS)
-            glVertex2f(boton["x"], boton["y"]-20)
-            glVertex2f(boton["x"] + 70, boton["y"]-20)
-            glVertex2f(boton["x"] + 70, boton["y"] + 30)
-            glVertex2f(boton["x"], boton["y"] + 30)
-            glEnd()
-            
-            # Dibujar texto del botón (blanco)
-            glColor3f(1, 1, 1)
-            glRasterPos2f(boton["x"] + 10, boton["y"] + 10)
-            for char in boton["texto"]:
-                glutBitmapCharacter(GLUT_BITMAP_HELVETICA_12, ord(char))
+        if self.perfilador.mostrar_overlay:
+            self._dibujar_overlay_perfil()
         
         # Restaurar estado OpenGL
         glEnable(GL_DEPTH_TEST)
@@ -1342,17 +4601,267 @@ class Escena:
 
 
 
+    def _dibujar_overlay_perfil(self):
+        """Panel con FPS, gráfica de tiempos por cuadro y desglose por etapa (en coordenadas 2D)"""
+        perfilador = self.perfilador
+        resumen = perfilador.resumen()
+        ancho_panel, alto_grafica = 240, 60
+        x0, y0 = self.ancho - ancho_panel - 10, 100
+        alto_panel = 110 + 16 * len(perfilador.ETAPAS)
+        
+        # Fondo semitransparente
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glColor4f(0.0, 0.0, 0.0, 0.6)
+        glBegin(GL_QUADS)
+        glVertex2f(x0, y0)
+        glVertex2f(x0 + ancho_panel, y0)
+        glVertex2f(x0 + ancho_panel, y0 + alto_panel)
+        glVertex2f(x0, y0 + alto_panel)
+        glEnd()
+        glDisable(GL_BLEND)
+        
+        # Gráfica de tiempos por cuadro; la línea roja marca 16.7 ms (60 FPS)
+        base = y0 + 10 + alto_grafica
+        escala = alto_grafica / 33.3
+        glColor3f(0.8, 0.3, 0.3)
+        glBegin(GL_LINES)
+        glVertex2f(x0 + 10, base - 16.7 * escala)
+        glVertex2f(x0 + ancho_panel - 10, base - 16.7 * escala)
+        glEnd()
+        tiempos = perfilador.tiempos_cuadro
+        if len(tiempos) > 1:
+            paso = (ancho_panel - 20) / (tiempos.maxlen - 1)
+            glColor3f(0.3, 0.9, 0.4)
+            glBegin(GL_LINE_STRIP)
+            for i, tiempo in enumerate(tiempos):
+                glVertex2f(x0 + 10 + i * paso, base - min(tiempo * 1000, 33.3) * escala)
+            glEnd()
+        
+        # Texto
+        lineas = [
+            f"FPS: {resumen['fps']:.1f}   cuadro: {resumen['cuadro_ms']['media']:.2f} ms",
+            f"Visibles: {self.estadisticas_culling['visibles']}   "
+            f"descartados: {self.estadisticas_culling['descartados']}",
+            f"Llamadas GL: {resumen['llamadas_gl'] or 0:.0f}   "
+            f"cambios de estado: {resumen['cambios_estado']:.0f}"
+        ]
+        for etapa in perfilador.ETAPAS:
+            lineas.append(f"  {etapa}: {resumen['etapas_ms'][etapa]['media']:.2f} ms")
+        glColor3f(1, 1, 1)
+        for i, linea in enumerate(lineas):
+            glRasterPos2f(x0 + 10, base + 20 + 16 * i)
+            for char in linea:
+                glutBitmapCharacter(GLUT_BITMAP_HELVETICA_12, ord(char))
+
     def actualizar(self):
-        self.actualizar_auto()
+        """Callback del temporizador: avanza la física según el tiempo real y pide un redibujado"""
+        self.bucle_simulacion.avanzar_tiempo_real()
         glutPostRedisplay()
 
-#------------------------ MAIN -------------------------
-def main():
-    glutInit(sys.argv)
-    glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
-    glutInitWindowSize(1024, 768)
-    glutCreateWindow(b"Carrera 3D con GLUT")
+# ------------------------- RENDER SIN VENTANA -------------------------
+class RenderizadorOffscreen:
+    """Framebuffer fuera de pantalla para renderizar sin mostrar la ventana.
+
+    Los cuadros se leen con glReadPixels sobre un buffer reservado una sola vez
+    y se pueden guardar como PNG (con Pillow) o como RGB sin comprimir.
+    """
+    def __init__(self, ancho, alto):
+        self.ancho = ancho
+        self.alto = alto
+        self.pixeles = np.empty((alto, ancho, 3), dtype=np.uint8)
+        
+        self.fbo = glGenFramebuffers(1)
+        self.buffer_color = glGenRenderbuffers(1)
+        self.buffer_profundidad = glGenRenderbuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        
+        glBindRenderbuffer(GL_RENDERBUFFER, self.buffer_color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, ancho, alto)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.buffer_color)
+        
+        glBindRenderbuffer(GL_RENDERBUFFER, self.buffer_profundidad)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH24_STENCIL8, ancho, alto)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER,
+                                  self.buffer_profundidad)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        
+        estado = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        if estado != GL_FRAMEBUFFER_COMPLETE:
+            self.liberar()
+            raise RuntimeError(f"Framebuffer offscreen incompleto (estado {estado})")
+    
+    def activar(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.ancho, self.alto)
+    
+    def leer_cuadro(self):
+        """Copia el cuadro renderizado al buffer reservado y lo devuelve"""
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(0, 0, self.ancho, self.alto, GL_RGB, GL_UNSIGNED_BYTE, self.pixeles)
+        return self.pixeles
+    
+    def guardar_cuadro(self, ruta, formato="png"):
+        # OpenGL entrega las filas de abajo hacia arriba
+        imagen = self.pixeles[::-1]
+        if formato == "png":
+            Image.fromarray(imagen).save(ruta)
+        else:
+            with open(ruta, "wb") as archivo:
+                archivo.write(imagen.tobytes())
+    
+    def liberar(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteRenderbuffers(2, [self.buffer_color, self.buffer_profundidad])
+        glDeleteFramebuffers(1, [self.fbo])
+
+
+# ------------------------- BENCHMARK -------------------------
+class BancoPruebas:
+    """Benchmark determinista del bucle de render y actualización.
+
+    Llena una escena con un número fijo de objetos en posiciones pseudoaleatorias
+    (con semilla), conduce el auto por un guion de teclas y mide por separado
+    actualizar_auto, renderizar y el _dibujar de cada tipo de objeto.
+    """
+    def __init__(self, escena, cuadros=300, calentamiento=10, cuadros_memoria=30):
+        self.escena = escena
+        self.cuadros = cuadros
+        self.calentamiento = calentamiento
+        self.cuadros_memoria = cuadros_memoria
+        self.contador = ContadorLlamadasGL()
+    
+    @staticmethod
+    def poblar(escena, arboles=0, casas=0, montanas=0, fractales=0, nivel_fractal=3,
+               semilla=0, radio=90.0):
+        """Coloca los objetos pedidos en posiciones reproducibles"""
+        generador = random.Random(semilla)
+        def posicion(altura):
+            return (generador.uniform(-radio, radio), altura, generador.uniform(-radio, radio))
+        
+        for _ in range(arboles):
+            escena.agregar_objeto(Arbol(pos=posicion(0)))
+        for _ in range(casas):
+            escena.agregar_objeto(Casa(pos=posicion(0)))
+        for _ in range(montanas):
+            escena.agregar_objeto(Montana(pos=posicion(0)))
+        tipos_fractal = [(HelechoFractal, 0), (TrianguloSierpinski, 1.7), (CuboMenger, 0.7)]
+        for i in range(fractales):
+            clase, altura = tipos_fractal[i % len(tipos_fractal)]
+            fractal = clase(pos=posicion(altura))
+            fractal.nivel = nivel_fractal
+            escena.agregar_objeto(fractal)
+    
+    @staticmethod
+    def aplicar_guion(escena, tiempo):
+        """Teclas pulsadas a los tiempo segundos: acelerar, girar a un lado, al otro y frenar"""
+        fase = tiempo % 3.84
+        escena.tecla_arriba = fase < 3.2
+        escena.tecla_abajo = fase >= 3.52
+        escena.tecla_izquierda = 0.64 <= fase < 1.28
+        escena.tecla_derecha = 1.92 <= fase < 2.56
+    
+    def _cuadro(self, cuadro):
+        self.aplicar_guion(self.escena, cuadro * self.escena.dt)
+        inicio = time.perf_counter()
+        self.escena.paso_simulacion()
+        medio = time.perf_counter()
+        self.escena.renderizar()
+        glFinish()
+        fin = time.perf_counter()
+        return medio - inicio, fin - medio
+    
+    def ejecutar(self):
+        resultados = {}
+        
+        # Calentamiento: compila display lists, lotes y mallas de fractales
+        inicio = time.perf_counter()
+        for cuadro in range(self.calentamiento):
+            self._cuadro(cuadro)
+        resultados["calentamiento_ms"] = (time.perf_counter() - inicio) * 1000
+        
+        tiempos_actualizar, tiempos_dibujar, llamadas = [], [], []
+        self.contador.activar()
+        try:
+            for cuadro in range(self.calentamiento, self.calentamiento + self.cuadros):
+                self.contador.reiniciar()
+                actualizar, dibujar = self._cuadro(cuadro)
+                tiempos_actualizar.append(actualizar)
+                tiempos_dibujar.append(dibujar)
+                llamadas.append(self.contador.total())
+            conteos_ultimo_cuadro = dict(self.contador.conteos)
+        finally:
+            self.contador.desactivar()
+        
+        resultados["actualizar"] = self.percentiles(tiempos_actualizar)
+        resultados["dibujar"] = self.percentiles(tiempos_dibujar)
+        resultados["cuadro"] = self.percentiles(np.add(tiempos_actualizar, tiempos_dibujar))
+        resultados["llamadas_dibujo"] = {
+            "media": float(np.mean(llamadas)),
+            "max": int(np.max(llamadas)),
+            "ultimo_cuadro": conteos_ultimo_cuadro
+        }
+        resumen = self.escena.perfilador.resumen()
+        resultados["etapas"] = resumen["etapas_ms"]
+        resultados["cambios_estado_por_cuadro"] = resumen["cambios_estado"]
+        resultados["memoria"] = self._medir_memoria()
+        resultados["dibujar_por_tipo"] = self._medir_tipos()
+        return resultados
     
+    def _medir_memoria(self):
+        """Bytes reservados por cuadro (pico y retenidos) según tracemalloc"""
+        picos, retenidos = [], []
+        tracemalloc.start()
+        try:
+            for cuadro in range(self.cuadros_memoria):
+                antes = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                self._cuadro(cuadro)
+                actual, pico = tracemalloc.get_traced_memory()
+                picos.append(pico - antes)
+                retenidos.append(actual - antes)
+        finally:
+            tracemalloc.stop()
+        return {
+            "pico_por_cuadro_bytes": int(np.median(picos)) if picos else 0,
+            "retenidos_por_cuadro_bytes": int(np.median(retenidos)) if retenidos else 0
+        }
+    
+    def _medir_tipos(self, repeticiones=20):
+        """Tiempo de un _dibujar en modo inmediato para un objeto de cada tipo"""
+        representantes = {}
+        for obj in self.escena.objetos:
+            representantes.setdefault(type(obj).__name__, obj)
+        
+        tiempos = {}
+        for nombre, obj in sorted(representantes.items()):
+            glFinish()
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                glPushMatrix()
+                obj._dibujar()
+                glPopMatrix()
+            glFinish()
+            tiempos[nombre] = (time.perf_counter() - inicio) / repeticiones * 1000
+        return tiempos
+    
+    @staticmethod
+    def percentiles(tiempos):
+        """Resumen en milisegundos de una lista de duraciones en segundos"""
+        ms = np.asarray(tiempos, dtype=np.float64) * 1000
+        if len(ms) == 0:
+            return {}
+        return {
+            "p50": float(np.percentile(ms, 50)),
+            "p95": float(np.percentile(ms, 95)),
+            "p99": float(np.percentile(ms, 99)),
+            "media": float(ms.mean()),
+            "max": float(ms.max())
+        }
+
+
+#------------------------ MAIN -------------------------
+def configurar_gl():
     glEnable(GL_DEPTH_TEST)
     glDepthFunc(GL_LESS)
     glClearDepth(1.0)  
@@ -1365,12 +4874,191 @@ def main():
     glEnable(GL_BLEND)
     glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
-    # Cargar texturas SIN verificar si existen
-    textura_hierba = Textura("hierba.jpg")      # Para el suelo
-    textura_montana = Textura("montana.jpg")    # Para las montañas  
-    textura_asfalto = Textura("asfalto.jpg")    # Para la carretera
+def crear_escena():
+    # Las texturas se decodifican en segundo plano; si no existen se usa color sólido
+    gestor = GestorTexturas()
+    textura_hierba = gestor.obtener("hierba.jpg")      # Para el suelo
+    textura_montana = gestor.obtener("montana.jpg")    # Para las montañas  
+    textura_asfalto = gestor.obtener("asfalto.jpg")    # Para la carretera
     # Crear escena pasando las texturas
-    escena = Escena(textura_hierba, textura_montana, textura_asfalto)
+    return Escena(textura_hierba, textura_montana, textura_asfalto, gestor)
+
+def leer_argumentos():
+    parser = argparse.ArgumentParser(description="Mini motor gráfico 3D con GLUT")
+    parser.add_argument("--headless", action="store_true",
+                        help="renderizar sin mostrar ventana (por ejemplo bajo Xvfb)")
+    parser.add_argument("--cuadros", type=int, default=120, help="cuadros a renderizar en modo headless")
+    parser.add_argument("--dt", type=float, default=Escena.PASO_SIMULACION,
+                        help="segundos de simulación por cuadro en modo headless")
+    parser.add_argument("--salida", default="cuadros", help="carpeta donde guardar los cuadros")
+    parser.add_argument("--formato", choices=["png", "raw", "ninguno"], default="png",
+                        help="formato de los cuadros guardados (raw = RGB sin comprimir)")
+    parser.add_argument("--ancho", type=int, default=1024)
+    parser.add_argument("--alto", type=int, default=768)
+    parser.add_argument("--hz-simulacion", type=float, default=1 / Escena.PASO_SIMULACION,
+                        help="pasos de física por segundo, independiente de los FPS")
+    parser.add_argument("--fps", type=float, default=60, help="frecuencia de redibujado de la ventana")
+    parser.add_argument("--escena", help="archivo de escena a cargar al iniciar (.json o binario)")
+    parser.add_argument("--mundo", metavar="DIRECTORIO",
+                        help="usar un mundo por teselas guardado en DIRECTORIO (con --escena, lo reparte antes)")
+    parser.add_argument("--radio-teselas", type=int, default=1, help="teselas cargadas alrededor del auto")
+    parser.add_argument("--memoria-mundo", type=float, default=64, help="presupuesto de memoria del mundo en MB")
+    parser.add_argument("--sombras", choices=SistemaSombras.MODOS, default="plano",
+                        help="sombras planas, con stencil (sin oscurecer dos veces donde se solapan) "
+                             "o con mapa de profundidad (también sobre los objetos)")
+    parser.add_argument("--resolucion-sombras", type=int, default=1024,
+                        help="lado en píxeles del mapa de sombras")
+    parser.add_argument("--simular", type=float, metavar="SEGUNDOS",
+                        help="simular sin pantalla ni contexto OpenGL siguiendo el guion de teclas del benchmark")
+    
+    benchmark = parser.add_argument_group("benchmark")
+    benchmark.add_argument("--benchmark", action="store_true",
+                           help="medir el rendimiento de una escena generada (usa el modo headless)")
+    benchmark.add_argument("--arboles", type=int, default=200)
+    benchmark.add_argument("--casas", type=int, default=50)
+    benchmark.add_argument("--montanas", type=int, default=10)
+    benchmark.add_argument("--fractales", type=int, default=6)
+    benchmark.add_argument("--nivel-fractal", type=int, default=3)
+    benchmark.add_argument("--semilla", type=int, default=0)
+    benchmark.add_argument("--json", default="benchmark.json", help="archivo de resultados")
+    # GLUT ya consume sus propios argumentos en glutInit
+    argumentos, _ = parser.parse_known_args(sys.argv[1:])
+    return argumentos
+
+def preparar_escena(escena, argumentos):
+    """Carga la escena o el mundo por teselas indicados en la línea de comandos"""
+    escena.sistema_sombras.modo = argumentos.sombras
+    escena.sistema_sombras.mapa.resolucion = argumentos.resolucion_sombras
+    if argumentos.mundo:
+        if argumentos.escena:
+            MundoTeselas.dividir_escena(argumentos.escena, argumentos.mundo)
+        escena.activar_mundo(argumentos.mundo, radio=argumentos.radio_teselas,
+                             presupuesto_bytes=int(argumentos.memoria_mundo * 2**20))
+    elif argumentos.escena:
+        escena.archivo_escena = argumentos.escena
+        if os.path.exists(argumentos.escena):
+            escena.cargar(argumentos.escena)
+
+def crear_contexto_sin_ventana(ancho, alto):
+    """Crea un contexto OpenGL con una ventana oculta y activa un framebuffer offscreen"""
+    glutInit(sys.argv)
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH | GLUT_STENCIL)
+    glutInitWindowSize(ancho, alto)
+    glutCreateWindow(b"Carrera 3D con GLUT")
+    glutHideWindow()  # Solo se necesita el contexto OpenGL
+    
+    configurar_gl()
+    offscreen = RenderizadorOffscreen(ancho, alto)
+    offscreen.activar()
+    return offscreen
+
+def ejecutar_sin_ventana(argumentos):
+    """Renderiza un número fijo de cuadros en un framebuffer offscreen"""
+    offscreen = crear_contexto_sin_ventana(argumentos.ancho, argumentos.alto)
+    escena = crear_escena()
+    escena.gestor_texturas.esperar()  # Cuadros reproducibles: todas las texturas desde el primero
+    escena.ancho = argumentos.ancho
+    escena.alto = argumentos.alto
+    escena.configurar_paso(1 / argumentos.hz_simulacion)
+    preparar_escena(escena, argumentos)
+    # Sin límite de pasos: cada cuadro consume exactamente --dt de simulación
+    escena.bucle_simulacion.max_pasos = None
+    
+    if argumentos.formato != "ninguno":
+        os.makedirs(argumentos.salida, exist_ok=True)
+    
+    inicio = time.perf_counter()
+    for cuadro in range(argumentos.cuadros):
+        escena.bucle_simulacion.avanzar(argumentos.dt)
+        escena.renderizar()
+        offscreen.leer_cuadro()
+        if argumentos.formato != "ninguno":
+            extension = "png" if argumentos.formato == "png" else "rgb"
+            ruta = os.path.join(argumentos.salida, f"cuadro_{cuadro:05d}.{extension}")
+            offscreen.guardar_cuadro(ruta, argumentos.formato)
+    duracion = time.perf_counter() - inicio
+    
+    print(f"{argumentos.cuadros} cuadros de {argumentos.ancho}x{argumentos.alto} en {duracion:.2f} s "
+          f"({duracion / max(argumentos.cuadros, 1) * 1000:.2f} ms por cuadro)")
+    offscreen.liberar()
+
+def ejecutar_simulacion(argumentos):
+    """Simula sin pantalla (no hace falta contexto OpenGL) e imprime el estado final"""
+    escena = Escena()
+    escena.configurar_paso(1 / argumentos.hz_simulacion)
+    preparar_escena(escena, argumentos)
+    pasos = round(argumentos.simular * argumentos.hz_simulacion)
+    
+    inicio = time.perf_counter()
+    for paso in range(pasos):
+        BancoPruebas.aplicar_guion(escena, paso * escena.dt)
+        escena.paso_simulacion()
+    duracion = time.perf_counter() - inicio
+    
+    x, y, z, angulo = escena._pose_auto()
+    print(json.dumps({"pasos": pasos, "segundos_simulados": argumentos.simular,
+                      "posicion": [x, y, z], "angulo": angulo, "velocidad": escena.velocidad_auto}))
+    print(f"{pasos} pasos en {duracion:.3f} s ({pasos / max(duracion, 1e-9):.0f} pasos/s)")
+
+def ejecutar_benchmark(argumentos):
+    """Mide una escena generada y guarda los resultados en JSON"""
+    offscreen = crear_contexto_sin_ventana(argumentos.ancho, argumentos.alto)
+    escena = crear_escena()
+    escena.gestor_texturas.esperar()  # Cuadros reproducibles: todas las texturas desde el primero
+    escena.ancho = argumentos.ancho
+    escena.alto = argumentos.alto
+    configuracion = {
+        "arboles": argumentos.arboles, "casas": argumentos.casas,
+        "montanas": argumentos.montanas, "fractales": argumentos.fractales,
+        "nivel_fractal": argumentos.nivel_fractal, "semilla": argumentos.semilla,
+        "cuadros": argumentos.cuadros, "ancho": argumentos.ancho, "alto": argumentos.alto,
+        "sombras": argumentos.sombras, "resolucion_sombras": argumentos.resolucion_sombras
+    }
+    escena.sistema_sombras.modo = argumentos.sombras
+    escena.sistema_sombras.mapa.resolucion = argumentos.resolucion_sombras
+    BancoPruebas.poblar(escena, argumentos.arboles, argumentos.casas, argumentos.montanas,
+                        argumentos.fractales, argumentos.nivel_fractal, argumentos.semilla)
+    
+    resultados = BancoPruebas(escena, cuadros=argumentos.cuadros).ejecutar()
+    informe = {
+        "configuracion": configuracion,
+        "entorno": {
+            "python": sys.version.split()[0],
+            "renderer": glGetString(GL_RENDERER).decode(errors="replace"),
+            "version_gl": glGetString(GL_VERSION).decode(errors="replace")
+        },
+        "resultados": resultados
+    }
+    with open(argumentos.json, "w", encoding="utf-8") as archivo:
+        json.dump(informe, archivo, indent=2, ensure_ascii=False)
+    
+    cuadro = resultados["cuadro"]
+    print(f"Cuadro: p50 {cuadro['p50']:.2f} ms, p95 {cuadro['p95']:.2f} ms, p99 {cuadro['p99']:.2f} ms; "
+          f"{resultados['llamadas_dibujo']['media']:.0f} llamadas de dibujo por cuadro")
+    print(f"Resultados guardados en {argumentos.json}")
+    offscreen.liberar()
+
+def main():
+    argumentos = leer_argumentos()
+    if argumentos.simular is not None:
+        ejecutar_simulacion(argumentos)
+        return
+    if argumentos.benchmark:
+        ejecutar_benchmark(argumentos)
+        return
+    if argumentos.headless:
+        ejecutar_sin_ventana(argumentos)
+        return
+    
+    glutInit(sys.argv)
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH | GLUT_STENCIL)
+    glutInitWindowSize(1024, 768)
+    glutCreateWindow(b"Carrera 3D con GLUT")
+    
+    configurar_gl()
+    escena = crear_escena()
+    escena.configurar_paso(1 / argumentos.hz_simulacion)
+    preparar_escena(escena, argumentos)
     
     glutDisplayFunc(escena.dibujar)
     glutMouseFunc(escena.manejar_clic_raton)  # <-- Nuevo callback para el ratón
@@ -1378,9 +5066,12 @@ def main():
     glutSpecialFunc(escena.manejar_teclado_especial)
     glutSpecialUpFunc(escena.manejar_teclado_especial_up)
     
+    # El temporizador marca los redibujados; la física avanza por su cuenta en pasos fijos
+    intervalo_ms = max(1, int(1000 / argumentos.fps))
+    
     def timer_callback(value):
         escena.actualizar()
-        glutTimerFunc(16, timer_callback, 0)
+        glutTimerFunc(intervalo_ms, timer_callback, 0)
     
     def reshape(width, height):
         escena.ancho = width
@@ -1393,6 +5084,8 @@ def main():
     
     print("Controles:")
     print("- Flechas: Mover el auto")
+    print("- O: Alternar vista, P: Perfilador")
+    print("- G / C: Guardar / cargar la escena")
     print("- ESC: Salir")
     
     glutMainLoop()